@@ -14,24 +14,62 @@
 #define PARSE_ERROR 1
 #define PARSE_EMPTY 2
 
+// first byte of every binary broadcast frame, never sent in text messages (which are ASCII)
+#define FRAME_SYNC 0xA5
+
+// filters applied to the successive readings of each channel
+#define FILTER_NONE 0
+#define FILTER_EMA 1      // exponential moving average: y += alpha*(x - y)
+#define FILTER_EMA2 2     // two exponential moving averages in a row, for a steeper roll-off
+#define FILTER_COUNT 3
+const char* const FILTER_NAMES[FILTER_COUNT] = {"NONE", "EMA", "EMA2"};
+
 const unsigned long ULONG_MAX = (unsigned long)(-1);
 
 // Measurement settings to persist between power cycles
 struct Settings {
   float trueVoltage;            // what the reference voltage is (around 5V)
-  unsigned long samples;        // how many analogRead samples to average
+  unsigned long samples;        // how many ADC samples to average
   unsigned long interval;       // time between prints in broadcast
   unsigned long channels;       // channels to broadcast
+  unsigned long filterType;     // filter of the readings, one of FILTER_*
+  float filterAlpha;            // smoothing factor of the filter, from 0 (frozen) to 1 (no smoothing)
 };
-Settings settings;
+Settings settings;                  // kept in RAM, the EEPROM is only written when they change
+unsigned long generation = 0;       // how many times the settings changed, stored in the EEPROM after them
+
+float filterState[6][2];            // output of each filter stage of each channel
+bool filterPrimed[6] = {false};     // whether the filter of each channel got its first reading
+unsigned long filterCount[6];       // adcCount of the average each filter last took
+
+// free running ADC, the channels take turns in bursts of conversions
+#define ADC_SETTLE 1      // conversions thrown away after switching to a channel
+#define ADC_BURST 4       // conversions kept before switching to the next channel
+#define ADC_STEPS (ADC_SETTLE + ADC_BURST)
+
+volatile byte adcStep = 0;              // position in the turns of the conversion that is running
+volatile unsigned long adcSamples = 1;  // samples in each average, settings.samples when the ADC started
+unsigned long adcSum[6];                // sum of the average being taken of each channel (only used by the ISR)
+unsigned long adcTaken[6];              // samples added to it so far
+unsigned long adcFirst[6];              // millis() of its first sample
+volatile unsigned long adcLatest[6];     // sum of the last complete average of each channel
+volatile unsigned long adcLatestTime[6]; // millis() halfway through it
+volatile bool adcReady[6];              // whether each channel has a complete average since the ADC started
+volatile unsigned long adcCount[6];     // complete averages of each channel since the ADC started
+unsigned long readTime;                 // millis() halfway through the average returned by the last readSum
+unsigned long readCount;                // adcCount of the average returned by the last readSum
 
 unsigned long lastBroadcastMillis = ULONG_MAX;
+bool binaryBroadcast = false;   // whether the broadcast sends binary frames instead of text
+byte frameSeq = 0;              // sequence number of the next binary frame
 
 
 // state variables for parsing a command
 int size = 16;    // how many chars in current piece
 int argc = 4;     // how many pieces (1 command + up to 3 arguments)
 bool closed = false;
+bool more = false;      // the command ended with ';', more commands of its line follow
+bool batching = false;  // the last command ended with ';', the next one belongs to the same batch
 
 // program accepts commands, of at most 15 chars, with at most 3 arguments, 
 // each with at most 15 chars as well (string termination \0).
@@ -44,6 +82,7 @@ int parse_command() {
   size = 0;
   argc = 0;
   closed = false;
+  more = false;
   while(true) {
     int ch = Serial.read();
     if(ch == -1) {
@@ -54,6 +93,10 @@ int parse_command() {
       // newline \n immediately ends the parsing, error (size = -1) if parsing isn't closed
       if(!closed) size = -1;
       break;
+    } else if(closed && ch == ';') {
+      // ';' after the closing bracket ends the command, and another one of the batch follows
+      more = true;
+      break;
     } else if(closed) {
       // here ch is something different than \n. since parsing is closed do error
       size = -1;
@@ -102,15 +145,170 @@ int parse_command() {
   else return PARSE_OK;                     // parsed ok
 }
 
+// the ADC converts on its own, one conversion after the other, and the interrupt at the end of each
+// adds it to the average being taken of its channel. the channels take turns in bursts, and the first
+// conversions of a burst are thrown away while the sample and hold settles on the new channel
+// (what the old delay(7) after each analogRead was for, https://www.skillbank.co.uk/arduino/readanalogvolts.ino)
+void adcStart() {
+  ADCSRA = 0;   // stop converting while the state is reset
+  adcSamples = max(settings.samples, 1);
+  adcStep = 0;
+  for(int i = 0; i < 6; i++){
+    adcSum[i] = 0;
+    adcTaken[i] = 0;
+    adcReady[i] = false;
+    adcCount[i] = 0;
+  }
+  ADMUX = _BV(REFS0);   // AVcc reference, like analogRead, starting with A0
+  ADCSRB = 0;           // free running: the next conversion starts as soon as one ends
+  DIDR0 = 0x3F;         // digital inputs of A0 to A5 off, they add noise to the readings
+  // enable, start, auto trigger, interrupt, clear a pending interrupt, 16 MHz / 128 = 125 kHz ADC clock
+  ADCSRA = _BV(ADEN) | _BV(ADSC) | _BV(ADATE) | _BV(ADIE) | _BV(ADIF) | _BV(ADPS2) | _BV(ADPS1) | _BV(ADPS0);
+}
+
+ISR(ADC_vect) {
+  unsigned int value = ADC;
+  byte i = adcStep / ADC_STEPS;   // channel of the conversion that just ended
+  if(adcStep % ADC_STEPS >= ADC_SETTLE){
+    unsigned long now = millis();
+    if(!adcTaken[i]) adcFirst[i] = now;
+    adcSum[i] += value;
+    if(++adcTaken[i] >= adcSamples){
+      adcLatest[i] = adcSum[i];
+      adcLatestTime[i] = adcFirst[i] + (now - adcFirst[i])/2;
+      adcReady[i] = true;
+      adcCount[i]++;
+      adcSum[i] = 0;
+      adcTaken[i] = 0;
+    }
+  }
+  adcStep = (adcStep + 1) % (6*ADC_STEPS);
+  // the conversion that just started got its channel from the last interrupt, this picks the one after it
+  ADMUX = (ADMUX & 0xF0) | (((adcStep + 1) % (6*ADC_STEPS)) / ADC_STEPS);
+}
+
+// function that returns the sum of the samples of the last complete average at a given analog pin,
+// without waiting for new samples, and sets readTime to the millis() halfway through them and readCount to its number
+unsigned long readSum(int pin) {
+  int i = pin - A0;
+  if(i < 0 || i > 5){
+    readTime = millis();
+    return 0;
+  }
+  while(!adcReady[i]);    // only right after adcStart, until the first average is complete
+  noInterrupts();
+  unsigned long sum = adcLatest[i];
+  readTime = adcLatestTime[i];
+  readCount = adcCount[i];
+  interrupts();
+  return sum;
+}
+
+// function that returns the sum of the samples read at a given analog pin, through the filter of its channel
+float filtered(int pin) {
+  float x = readSum(pin);
+  int i = pin - A0;
+  if(settings.filterType == FILTER_NONE || i < 0 || i > 5) return x;
+
+  if(!filterPrimed[i]){
+    // start from the first reading instead of 0
+    filterState[i][0] = filterState[i][1] = x;
+    filterPrimed[i] = true;
+  } else if(readCount != filterCount[i]){
+    // only new averages step the filter, a reading repeating the last one leaves it where it is
+    filterState[i][0] += settings.filterAlpha * (x - filterState[i][0]);
+    filterState[i][1] += settings.filterAlpha * (filterState[i][0] - filterState[i][1]);
+  }
+  filterCount[i] = readCount;
+  return settings.filterType == FILTER_EMA ? filterState[i][0] : filterState[i][1];
+}
+
+// makes the filters start over with the next reading
+void resetFilter() {
+  for(int i = 0; i < 6; i++) filterPrimed[i] = false;
+}
+
+// how much the filter reduces the noise of the readings (ratio of standard deviations)
+float filterGain() {
+  float a = settings.filterAlpha, q = (1 - a)*(1 - a);
+  if(settings.filterType == FILTER_EMA) return sqrt(a / (2 - a));
+  if(settings.filterType == FILTER_EMA2) return sqrt(a*a*a*a * (1 + q) / ((1 - q)*(1 - q)*(1 - q)));
+  return 1;
+}
+
 // function that returns the voltage at a given analog pin accounting for samples
 float voltage(int pin) {
-  // delay(7) https://www.skillbank.co.uk/arduino/readanalogvolts.ino
-  unsigned long sum = 0;
-  for(int i = 0; i < settings.samples; i++){
-    sum += analogRead(pin);
-    delay(7);
+  return (filtered(pin)+0.5) * settings.trueVoltage / (settings.samples * 1024.0);
+}
+
+// function that returns the average 10-bit ADC count at a given analog pin, rounded
+unsigned int counts(int pin) {
+  return (unsigned int)((filtered(pin) + settings.samples/2) / settings.samples);
+}
+
+// prints the filter setting
+void printFilter() {
+  Serial.print("FILTER: ");
+  Serial.print(FILTER_NAMES[settings.filterType]);
+  Serial.print(" ");
+  Serial.println(settings.filterAlpha, 4);
+}
+
+// writes a byte of a binary frame and adds it to the checksum
+void frameWrite(byte b, byte &checksum) {
+  Serial.write(b);
+  checksum += b;
+}
+
+// function that sends the broadcast channels as a binary frame:
+// sync byte, sequence number, millis() halfway through the reading (4 bytes, little endian),
+// the 10-bit counts of each channel from A0 up packed LSB first, and the sum of the bytes after the sync byte
+void frame() {
+  byte checksum = 0;
+  unsigned int c[6];
+  unsigned long first = 0;
+  long offset = 0;
+  int n = 0;
+  for(int i = 0; i < 6; i++){
+    if(!(settings.channels & (1 << i))) continue;
+    c[i] = counts(A0+i);
+    if(!n++) first = readTime;
+    offset += (long)(readTime - first);
+  }
+  unsigned long t = first + offset/max(n, 1);   // average time of the averages, safe across millis() wrapping
+
+  Serial.write(FRAME_SYNC);
+  frameWrite(frameSeq++, checksum);
+  for(int i = 0; i < 4; i++){
+    frameWrite((byte)(t >> (8*i)), checksum);
+  }
+
+  unsigned long bits = 0;   // bits waiting to be written
+  int nbits = 0;
+  for(int i = 0; i < 6; i++){
+    if(!(settings.channels & (1 << i))) continue;
+    bits |= (unsigned long)c[i] << nbits;
+    nbits += 10;
+    while(nbits >= 8){
+      frameWrite((byte)bits, checksum);
+      bits >>= 8;
+      nbits -= 8;
+    }
   }
-  return (sum+0.5) * settings.trueVoltage / (settings.samples * 1024.0);
+  if(nbits) frameWrite((byte)bits, checksum);
+
+  Serial.write(checksum);
+}
+
+
+// replaces the settings, writing them to the EEPROM only if they changed, and returns whether they did
+bool saveSettings(const Settings &updated) {
+  if(!memcmp(&updated, &settings, sizeof(Settings))) return false;
+  settings = updated;
+  generation++;
+  EEPROM.put(0, settings);
+  EEPROM.put(sizeof(Settings), generation);
+  return true;
 }
 
 
@@ -139,11 +337,9 @@ void mult(){
 void err() {
   if(argc > 1) BAD_ARG_COUNT("no")
 
-  EEPROM.get(0, settings);
-
   Serial.print("+- ");
   // error = trueVoltage / (1024.0 *2) / (sqrt(max(samples,4)) / 2)
-  Serial.print(settings.trueVoltage/(1024.0*sqrt(max(settings.samples,4))), 8);
+  Serial.print(settings.trueVoltage/(1024.0*sqrt(max(settings.samples,4))) * filterGain(), 8);
   Serial.println(" V");
 }
 
@@ -151,8 +347,6 @@ void defget(){
   // this command prints the settings stored in memory
   if(argc > 2) BAD_ARG_COUNT("0 or 1")
 
-  EEPROM.get(0, settings);
-  
   if(argc == 1 || !strcmp(argv[1],"TRUE_VOLTAGE")) {
     Serial.print("TRUE_VOLTAGE: ");
     Serial.print(settings.trueVoltage);
@@ -174,42 +368,78 @@ void defget(){
     }
     Serial.println();
   }
+  if(argc == 1 || !strcmp(argv[1],"FILTER")) {
+    printFilter();
+  }
+  if(argc == 1 || !strcmp(argv[1],"GENERATION")) {
+    Serial.print("GENERATION: ");
+    Serial.println(generation);
+  }
 }
 
 void defput(){
   // this command writes a setting to memory
   if(argc != 3) BAD_ARG_COUNT("2")
 
-  EEPROM.get(0, settings);
+  Settings updated = settings;
   if(!strcmp(argv[1], "TRUE_VOLTAGE")) {
-    settings.trueVoltage = atof(argv[2]);
+    updated.trueVoltage = atof(argv[2]);
   } else if(!strcmp(argv[1], "SAMPLES")) {
-    settings.samples = strtoul(argv[2], NULL, 10);
+    updated.samples = strtoul(argv[2], NULL, 10);
   } else if(!strcmp(argv[1], "INTERVAL")) {
-    settings.interval = strtoul(argv[2], NULL, 10);
+    updated.interval = strtoul(argv[2], NULL, 10);
   } else if(!strcmp(argv[1], "CHANNELS")) {
-    if(argv[2][1] != 'b'){
-      Serial.print("ERROR: incorrectly formatted bitmask");
+    if(argv[2][0] != '0' || argv[2][1] != 'b'){
+      Serial.println("ERROR: incorrectly formatted bitmask");
       return;
     }
-    settings.channels = strtoul(argv[2]+2, NULL, 10);
+    updated.channels = strtoul(argv[2]+2, NULL, 2);
   } else {
     Serial.print("ERROR: 'defput' field '");
     Serial.print(argv[1]);
     Serial.println("' not found");
     return;
   }
-  EEPROM.put(0, settings);
+  if(saveSettings(updated) && !strcmp(argv[1], "SAMPLES")) {
+    // averages of the old size are thrown away
+    adcStart();
+    resetFilter();
+  }
   Serial.println("OK");
 }
 
+// function that prints the voltages of the channels of a bitmask from A5 down to A0, comma terminated,
+// followed by the millis() of the reading
+void printChannels(unsigned long bitmask) {
+  // read every channel before printing, the reading is timestamped with the average millis()
+  // halfway through the averages of its channels
+  float v[6];
+  unsigned long first = 0;
+  long offset = 0;
+  int n = 0;
+  for(int i = 5; i >= 0; i--){
+    if(!(bitmask & (1 << i))) continue;
+    v[i] = voltage(A0+i);
+    if(!n++) first = readTime;
+    offset += (long)(readTime - first);
+  }
+  unsigned long t = first + offset/max(n, 1);   // no channel of A0 to A5 in the bitmask leaves n at 0
+
+  for(int i = 5; i >= 0; i--){
+    if(bitmask & (1 << i)){
+      Serial.print(v[i], 4);
+      Serial.print(",");
+    }
+  }
+  Serial.println(t);
+}
+
 void analog(){
   // this command prints a voltage read from a specific analog pin
   if(argc > 2) BAD_ARG_COUNT("0 or 1")
 
   unsigned long currentBitmask = 0;
 
-  EEPROM.get(0, settings);
   if(argc == 2){
     if(argv[1][0] == '0' && argv[1][1] == 'b'){
       // multichannel
@@ -228,20 +458,53 @@ void analog(){
     }
   }
 
-  if(currentBitmask){
-    for(int i = 5; i >= 0; i--){
-      if(currentBitmask & (1 << i)){
-        Serial.print(voltage(A0+i), 4);
-        Serial.print(",");
-      }
-    }
-    Serial.println();
+  if(currentBitmask) printChannels(currentBitmask);
+}
+
+void filter() {
+  // this command sets the filter of the readings
+  if(argc > 3) BAD_ARG_COUNT("0 to 2")
+
+  if(argc == 1) {
+    printFilter();
+    return;
   }
+
+  int type = -1;
+  for(int i = 0; i < FILTER_COUNT; i++){
+    if(!strcmp(argv[1], FILTER_NAMES[i])) type = i;
+  }
+  if(type < 0) {
+    Serial.print("ERROR: 'filter' type '");
+    Serial.print(argv[1]);
+    Serial.println("' not found");
+    return;
+  }
+  float alpha = argc == 3 ? atof(argv[2]) : settings.filterAlpha;
+  if(!(alpha > 0 && alpha <= 1)) {
+    Serial.println("ERROR: 'filter' alpha must be above 0 and at most 1");
+    return;
+  }
+
+  Settings updated = settings;
+  updated.filterType = type;
+  updated.filterAlpha = alpha;
+  saveSettings(updated);
+  resetFilter();
+  Serial.println("OK");
 }
 
 void bstart() {
-  if(argc > 1) BAD_ARG_COUNT("no")
+  if(argc > 2) BAD_ARG_COUNT("0 or 1")
 
+  if(argc == 2 && strcmp(argv[1], "BIN")) {
+    Serial.print("ERROR: 'bstart' mode '");
+    Serial.print(argv[1]);
+    Serial.println("' not found");
+    return;
+  }
+  binaryBroadcast = argc == 2;
+  resetFilter();
   lastBroadcastMillis = millis();
   Serial.println("OK");
 }
@@ -259,21 +522,31 @@ void help(){
   Serial.println(F("\t- help(): provides information on all the commands."));
   Serial.println(F("\t- add(a, ...): adds from 1 to 3 numbers."));
   Serial.println(F("\t- mult(a, b): multiplies 2 numbers."));
-  Serial.println(F("\t- err(): the error of any reading in V, according to the values of TRUE_VOLTAGE and SAMPLES."));
-  Serial.println(F("\t- defget(...): prints the setting with the provided name (TRUE_VOLTAGE, SAMPLES, INTERVAL or BROADCAST_CHN).\n\t\t"
+  Serial.println(F("\t- err(): the error of any reading in V, according to the values of TRUE_VOLTAGE, SAMPLES and FILTER."));
+  Serial.println(F("\t- defget(...): prints the setting with the provided name (TRUE_VOLTAGE, SAMPLES, INTERVAL, BROADCAST_CHN, FILTER or GENERATION).\n\t\t"
                   "If no name is provided, print all the settings."));
   Serial.println(F("\t- defput(name, val): sets the value of the setting with the provided name\n\t\t"
                   "(TRUE_VOLTAGE, SAMPLES, INTERVAL or BROADCAST_CHN)."));
   Serial.println(F("\t- analog(...): prints the input channel voltages, the argument can be a single number\n\t\t"
-                  "from 0 to 6 or a bitmask like 0b001011 specifying multiple channels (LSB is A0).\n\t\t"
+                  "from 0 to 5 or a bitmask like 0b001011 specifying multiple channels (LSB is A0),\n\t\t"
+                  "in which case the line ends with the millis() of the reading.\n\t\t"
+                  "The ADC averages SAMPLES readings of every channel all the time, the latest averages are printed right away.\n\t\t"
                   "If no argument is provided and is broadcasting, immediately print the broadcast bitmask channels."));
-  Serial.println(F("\t- bstart(): starts broadcasting with the broadcast parameters in the settings."));
+  Serial.println(F("\t- bstart(...): starts broadcasting with the broadcast parameters in the settings.\n\t\t"
+                  "With the argument BIN, readings are sent as binary frames of raw ADC counts."));
   Serial.println(F("\t- bstop(): stops broadcasting."));
+  Serial.println(F("\t- filter(type, alpha): sets the filter of the readings of each channel, NONE, EMA (exponential\n\t\t"
+                  "moving average) or EMA2 (two in a row), with a smoothing factor alpha between 0 and 1.\n\t\t"
+                  "If no argument is provided, print the filter."));
+  Serial.println(F("Several commands can be sent in one line as a batch, separated by ';' like `bstop();defget()`.\n\t"
+                  "The answer of each one is followed by a line with ';', and the answer of the last one by a line with '.'."));
   Serial.println(F("Available settings:"));
   Serial.println(F("\t- TRUE_VOLTAGE: the real voltage measured at the Arduino 5V pin."));
   Serial.println(F("\t- SAMPLES: number of samples to take average of, to reduce noise."));
   Serial.println(F("\t- INTERVAL: time in ms to wait between reading broadcasts."));
   Serial.println(F("\t- CHANNELS: bitmask like 0b001011 specifying multiple analog ports to read when broadcasting"));
+  Serial.println(F("\t- FILTER: filter of the readings and its smoothing factor, set with 'filter'."));
+  Serial.println(F("\t- GENERATION: how many times the settings changed, it can't be set."));
 }
 
 
@@ -283,26 +556,50 @@ void setup() {
   Serial.begin(38400);
   Serial.println("INFO: type `help()` in a serial message to get information on all the commands");
 
-  // update settings right away
+  // the only time the settings are read from the EEPROM
   EEPROM.get(0, settings);
+  EEPROM.get(sizeof(Settings), generation);
+
+  // settings written by older versions of the program don't have a valid filter
+  if(settings.filterType >= FILTER_COUNT || !(settings.filterAlpha > 0 && settings.filterAlpha <= 1)){
+    Settings updated = settings;
+    updated.filterType = FILTER_NONE;
+    updated.filterAlpha = 1;
+    saveSettings(updated);
+  }
+
+  adcStart();
 }
 
 void loop() {
-  // check if supposed to broadcast analog readings periodically
-  if(lastBroadcastMillis < ULONG_MAX){
+  // check if supposed to broadcast analog readings periodically.
+  // not in the middle of a batch, so its answers stay together
+  if(lastBroadcastMillis < ULONG_MAX && !batching){
     unsigned long currentMillis = millis();
     if(currentMillis >= lastBroadcastMillis + settings.interval){
-      analog();
+      // not analog(), it would take the arguments of the last command as its own
+      if(binaryBroadcast) frame();
+      else printChannels(settings.channels);
       lastBroadcastMillis = currentMillis;
     }
   }
 
   // check if there's a new command to process
   int result = parse_command();
+  if(result == PARSE_EMPTY) return;
+
+  // the commands of a line like `a();b();c()` are a batch: each one answers as usual, followed
+  // by a line with ';', except the last one, followed by a line with '.'
+  bool batch = batching || more;
+  batching = more;
 
   if(result == PARSE_ERROR) Serial.println("ERROR: invalid command");
-  if(result != PARSE_OK) return;
+  else run_command();
+
+  if(batch) Serial.println(more ? ";" : ".");
+}
 
+void run_command() {
   // process any commands using the RUN_ARG macro
   bool found = false;
   RUN_ARG(help)
@@ -314,6 +611,7 @@ void loop() {
   RUN_ARG(analog)
   RUN_ARG(bstart)
   RUN_ARG(bstop)
+  RUN_ARG(filter)
 
   if(!found){
     Serial.print("ERROR: command '");
@@ -1,17 +1,31 @@
-# this program is meant to test the commands implementation on `analog_serial_pi`,
-# and show a limited example of serial communication from python
+# this program tests the commands implementation on `analog_serial_pi`: the syntax accepted
+# by `parse_command()`, with hand-written cases and random ones generated from its grammar,
+# and the answers of some of the commands, and which readings of binary frames the host keeps.
+# it also measures how many commands per second get through, sending them one after the other
+# without waiting for each answer.
+#
+#     python test.py [PORT] [--fuzz N] [--seed S] [--window BYTES]
+#
+# without a port (COM# on windows, /dev/tty# on linux), the simulated arduino of
+# test/simulator.py is used. the exit status is 1 if any case failed.
 
-import serial
+import argparse
+import collections
+import os
+import queue
+import random
+import string
+import sys
 import time
+import numpy as np
+import serial
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "test"))
+from command_parser import BATCH_END, BATCH_NEXT, BATCH_SEPARATOR, INVALID, MAX_ARGS, MAX_SIZE, PARSE_ERROR, PARSE_OK, parse_line, validate_many
+from acquisition import SerialReader
+from protocol import RX_BUFFER
+from simulator import SimulatedSerial
 
-# find the arduino port (COM# on windows, /dev/tty# on linux)
-port = serial.Serial(port="COM8", baudrate=38400,
-    bytesize=serial.EIGHTBITS,
-    parity=serial.PARITY_NONE,
-    stopbits=serial.STOPBITS_ONE,
-)
-time.sleep(3)
 
 # syntactically valid commands
 valid_commands = [
@@ -88,29 +102,270 @@ invalid_commands = [
     "invalid#cmd(100)",  # # not allowed
     "weird$name(50)",  # $ not allowed
 
+    # 🚫 Characters outside ASCII
+    "add(1,2)’",  # typographic quote after the command
+    "€()",  # not even in a single byte
+
     "name(50)aaa",  # text after is not allowed
     "undefinedCommand(100)",    # command too long
     "undefinedCommands(100)",    # command too long
     "checkNumbers(1234567890123456)",  # 16-char argument not allowed
 ]
 
+# commands of the arduino that answer with a single line, and that line
+command_answers = [
+    ("add(1,2)", "3.000000"),
+    ("add(1.5,-2,0.25)", "-0.250000"),
+    ("add()", "ERROR: 'add' expects 1 or more arguments"),
+    ("mult(2,3)", "6.000000"),
+    ("mult(2)", "ERROR: 'mult' expects 2 arguments"),
+    ("err(1)", "ERROR: 'err' expects no arguments"),
+    ("defput(NOPE,1)", "ERROR: 'defput' field 'NOPE' not found"),
+    ("defput(CHANNELS,101)", "ERROR: incorrectly formatted bitmask"),
+    ("analog(1,2)", "ERROR: 'analog' expects 0 or 1 arguments"),
+    ("bstart(TXT)", "ERROR: 'bstart' mode 'TXT' not found"),
+    ("bstop(1)", "ERROR: 'bstop' expects no arguments"),
+    ("filter(BAD)", "ERROR: 'filter' type 'BAD' not found"),
+]
+
+# batches of commands, and the lines the arduino answers them with
+batch_answers = [
+    ("add(1,2);mult(2,3)", ["3.000000", BATCH_NEXT, "6.000000", BATCH_END]),
+    ("add(1);nope();mult(2)", ["1.000000", BATCH_NEXT, "ERROR: command 'nope' not found", BATCH_NEXT,
+                               "ERROR: 'mult' expects 2 arguments", BATCH_END]),
+    ("add(1);add(", ["1.000000", BATCH_NEXT, INVALID, BATCH_END]),
+    ("add(1);", ["1.000000", BATCH_NEXT, INVALID, BATCH_END]),
+]
+
+# millis() of binary frames, in the chunks they're read in, and how many readings the host keeps:
+# frames sent faster than the averages complete repeat the last one, and only count once
+frame_answers = [
+    ("repeated at the start", [[500, 500]], 1),
+    ("repeated across chunks", [[500], [500, 600]], 2),
+    ("repeated after a reset", [[90000, 91000], [20, 20]], 3),
+]
+
+# names of the commands of the arduino, generated commands never use them
+known_commands = ["help", "add", "mult", "err", "defget", "defput", "analog", "bstart", "bstop", "filter"]
+
+# characters of the grammar of the commands
+NAME_FIRST = string.ascii_letters + "_"
+NAME_CHARS = NAME_FIRST + string.digits
+ARG_CHARS = NAME_CHARS + ".-"
+OTHER_CHARS = " ;:@#$\"'!?*/+=<>[]{}é’€"
+
+
+def expected_lines(command: str) -> list:
+    '''
+    lines the arduino answers a line with, when it doesn't use the name of one of its commands.
+    a parse error can stop before the end of the line, and the rest is then parsed on its own,
+    so an invalid line can get more than one error
+    '''
+    lines = []
+    batching = False
+    for result, argv, more in parse_line(command.encode('utf-8')):
+        if result == PARSE_ERROR:
+            lines.append(INVALID)
+        elif result == PARSE_OK:
+            lines.append(f"ERROR: command '{argv[0]}' not found")
+        # the answer of each command of a batch is followed by a marker
+        if batching or more:
+            lines.append(BATCH_NEXT if more else BATCH_END)
+        batching = more
+    return lines
+
+
+def known(command: str) -> bool:
+    '''whether any part of the line would run one of the commands of the arduino'''
+    return any(line.split("'")[1] in known_commands for line in expected_lines(command) if "not found" in line)
+
+
+def random_word(rng: random.Random, first: str, chars: str, size: int) -> str:
+    return rng.choice(first) + "".join(rng.choice(chars) for _ in range(size - 1))
+
+
+def valid_case(rng: random.Random) -> str:
+    '''a random command that follows the grammar'''
+    name = random_word(rng, NAME_FIRST, NAME_CHARS, rng.randint(1, MAX_SIZE))
+    args = [random_word(rng, ARG_CHARS, ARG_CHARS, rng.randint(1, MAX_SIZE)) for _ in range(rng.randint(0, MAX_ARGS))]
+    return f"{name}({','.join(args)})"
+
+
+def invalid_case(rng: random.Random) -> str:
+    '''a random command that breaks one rule of the grammar'''
+    name = random_word(rng, NAME_FIRST, NAME_CHARS, rng.randint(1, MAX_SIZE))
+    args = [random_word(rng, ARG_CHARS, ARG_CHARS, rng.randint(1, 8)) for _ in range(rng.randint(0, MAX_ARGS))]
+    rule = rng.randrange(9)
+    if rule == 0:       # name too long
+        name = random_word(rng, NAME_FIRST, NAME_CHARS, rng.randint(MAX_SIZE + 1, MAX_SIZE + 5))
+    elif rule == 1:     # argument too long
+        args.append(random_word(rng, ARG_CHARS, ARG_CHARS, rng.randint(MAX_SIZE + 1, MAX_SIZE + 5)))
+    elif rule == 2:     # too many arguments
+        args = [random_word(rng, ARG_CHARS, ARG_CHARS, rng.randint(1, 4)) for _ in range(rng.randint(MAX_ARGS + 1, MAX_ARGS + 3))]
+    elif rule == 3:     # empty argument
+        args.insert(rng.randint(0, len(args)), "")
+        if len(args) == 1:
+            args.append("")
+    elif rule == 4:     # name starting with a digit, or with a character only allowed in arguments
+        name = rng.choice(string.digits + ".-") + name[1:]
+    text = f"{name}({','.join(args)})"
+    if rule == 5:       # a character outside the grammar somewhere
+        i = rng.randrange(len(text) + 1)
+        text = text[:i] + rng.choice(OTHER_CHARS) + text[i:]
+    elif rule == 6:     # missing bracket
+        text = text.replace("(", "", 1) if rng.random() < 0.5 else text[:-1]
+    elif rule == 7:     # extra bracket
+        i = rng.randrange(len(text) + 1)
+        text = text[:i] + rng.choice("()") + text[i:]
+    elif rule == 8:     # text after the closing bracket
+        text += random_word(rng, ARG_CHARS + "()", ARG_CHARS + "()", rng.randint(1, 5))
+    return text
+
+
+def fuzz_cases(n: int, seed: int) -> list:
+    '''
+    n random (category, command) cases, in turns following the grammar, breaking it,
+    and batches of commands following it
+    '''
+    rng = random.Random(seed)
+    cases = []
+    while len(cases) < n:
+        category = ["fuzz valid", "fuzz invalid", "fuzz batch"][len(cases) % 3]
+        if category == "fuzz valid":
+            command = valid_case(rng)
+        elif category == "fuzz invalid":
+            command = invalid_case(rng)
+        else:
+            command = BATCH_SEPARATOR.join(valid_case(rng) for _ in range(rng.randint(2, 4)))
+        if len(command.encode('utf-8')) + 1 < RX_BUFFER and not known(command):
+            cases.append((category, command))
+    return cases
+
+
+def kept_frames(chunks: list) -> int:
+    '''readings a SerialReader keeps from chunks of binary frames of A0 with the given millis()'''
+    reader = SerialReader(SimulatedSerial(), queue.Queue())
+    reader.frame_mask = 0b1
+    seq = 0
+    for i, millis in enumerate(chunks):
+        n = len(millis)
+        reader.handle_frames(1000.0 + i, np.arange(seq, seq + n, dtype=np.uint8), np.array(millis, dtype=np.uint32), np.zeros((n, 1)))
+        seq += n
+    return sum(len(payload[0]) for kind, _, payload in reader.events.queue if kind == 'samples')
+
+
+def run_cases(port, commands: list, expected: list, window: int, timeout: float) -> list:
+    '''
+    sends every command, without waiting for the answer to the previous ones as long as the
+    bytes of the commands not answered yet fit in `window`, so the receive buffer of the arduino
+    never overflows. returns the lines received for each command, fewer than expected if the
+    arduino stopped answering for `timeout` seconds
+    '''
+    data = [(command + "\n").encode('utf-8') for command in commands]
+    received = [[] for _ in commands]
+    waiting = collections.deque()   # commands sent and not fully answered
+    in_flight = 0                   # their bytes
+    sent = 0
+    buffer = b''
+    last = time.time()
+    port.timeout = 0.01
+    while sent < len(commands) or waiting:
+        while sent < len(commands) and (not waiting or in_flight + len(data[sent]) <= window):
+            port.write(data[sent])
+            waiting.append(sent)
+            in_flight += len(data[sent])
+            sent += 1
+
+        chunk = port.read(port.in_waiting or 1)
+        if chunk:
+            last = time.time()
+        elif time.time() - last > timeout:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if not waiting:
+                break
+            i = waiting[0]
+            received[i].append(line.decode('ascii', errors='replace').strip())
+            if len(received[i]) >= len(expected[i]):
+                waiting.popleft()
+                in_flight -= len(data[i])
+    return received
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="tests the commands of the arduino, pipelined")
+    parser.add_argument("port", nargs="?", help="serial port of the arduino, the simulated one is used if not given")
+    parser.add_argument("--baud", type=int, default=38400, help="baud rate")
+    parser.add_argument("--fuzz", type=int, default=500, help="random commands generated from the grammar")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random commands")
+    parser.add_argument("--window", type=int, default=RX_BUFFER - 4, help="most bytes of commands not answered yet")
+    parser.add_argument("--timeout", type=float, default=2, help="seconds to wait for an answer")
+    parser.add_argument("--show", type=int, default=20, help="failed cases to print")
+    args = parser.parse_args()
+
+    if args.port:
+        port = serial.Serial(args.port, args.baud, timeout=3)
+    else:
+        port = SimulatedSerial(baudrate=args.baud, timeout=3)
+    # the arduino resets when the port opens, it's ready once it prints its welcome message
+    port.readline()
+    port.reset_input_buffer()
+
+    cases = [("valid", c) for c in valid_commands] + [("invalid", c) for c in invalid_commands]
+    cases += fuzz_cases(args.fuzz, args.seed)
+    expected = [expected_lines(command) for _, command in cases]
+    # the lists and the generator say which commands the parser must accept,
+    # and the reference parser must agree with its vectorized validation
+    totals = collections.Counter()
+    failed = collections.Counter()
+    accepted = validate_many([command for _, command in cases])
+    for (category, command), lines, ok in zip(cases, expected, accepted):
+        if category == "fuzz batch":
+            continue
+        totals["validation"] += 1
+        if (len(lines) == 1 and lines[0] != INVALID) != ok:
+            failed["validation"] += 1
+            print(f"the validation of {command!r} disagrees with the reference parser: {lines}")
+        elif ok == category.endswith("invalid"):
+            failed["validation"] += 1
+            print(f"the reference parser disagrees with the {category} case {command!r}: {lines}")
+    for name, chunks, readings in frame_answers:
+        totals["frames"] += 1
+        try:
+            kept = kept_frames(chunks)
+        except Exception as e:
+            kept = repr(e)
+        if kept != readings:
+            failed["frames"] += 1
+            print(f"FAIL {'frames':<12} {name} {chunks}\n\texpected {readings} readings\n\treceived {kept}")
+    cases += [("answers", command) for command, _ in command_answers]
+    expected += [[line] for _, line in command_answers]
+    cases += [("batch", command) for command, _ in batch_answers]
+    expected += [lines for _, lines in batch_answers]
+
+    start = time.perf_counter()
+    received = run_cases(port, [c for _, c in cases], expected, args.window, args.timeout)
+    elapsed = time.perf_counter() - start
+    port.close()
+
+    for (category, command), want, got in zip(cases, expected, received):
+        totals[category] += 1
+        if got != want:
+            failed[category] += 1
+            if sum(failed.values()) <= args.show:
+                print(f"FAIL {category:<12} {command!r}\n\texpected {want}\n\treceived {got}")
 
-print("VALID COMMANDS")
-for cmd in valid_commands:
-    print(f"Test: {cmd:<64}", end="")
-    port.write(bytes(cmd+"\n", encoding="ascii"))
-    time.sleep(0.1)
+    print()
+    for category in totals:
+        print(f"{category:<12} {totals[category] - failed[category]:>5} / {totals[category]} passed")
+    sent = sum(len(c.encode('utf-8')) + 1 for _, c in cases)
+    print(f"{len(cases)} commands in {elapsed:.2f} s: {len(cases) / elapsed:.1f} commands/s, "
+          f"{sent / elapsed:.0f} bytes/s sent, window of {args.window} bytes")
+    return 1 if failed else 0
 
-    last_line = port.read_all().decode("ascii").strip("\r\n").split("\n")[-1]
-    print(last_line)
-    #time.sleep(0.5)
 
-print("\nINVALID COMMANDS")
-for cmd in invalid_commands:
-    print(f"Test: {cmd:<64}", end="")
-    port.write(bytes(cmd+"\n", encoding="ascii"))
-    time.sleep(0.1)
 
-    last_line = port.read_all().decode("ascii").strip("\r\n").split("\n")[-1]
-    print(last_line)
-    #time.sleep(0.5)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+'''
+acquires from an arduino without the GUI, such as on a Raspberry Pi logger with no display.
+
+    python acquire.py [PORT] [options]
+
+sets the acquisition parameters of the arduino with `defput`, acquires the selected channels
+for a given time or number of readings, and writes them to a recording (bin or csv, like the
+GUI) or as CSV to stdout. the simulated arduino is used if no port is given.
+'''
+import argparse
+import queue
+import sys
+import threading
+import time
+import numpy as np
+import serial
+from acquisition import SerialReader
+from client import CommandError
+from protocol import format_command, mask_channels
+from recorder import Recorder
+
+
+class StdoutSink():
+    '''writes readings as CSV lines to stdout, in the same columns as a csv recording'''
+
+    def __init__(self, names: list, true_voltage: float, start_time: float):
+        self.names = names
+        self.start_time = start_time
+        print(f"# true_voltage={true_voltage} start_time={start_time}")
+        print(','.join(['t'] + names), flush=True)
+
+    def write(self, times: np.ndarray, refs: list, values: np.ndarray):
+        rows = np.full((len(times), len(self.names) + 1), np.nan)
+        rows[:, 0] = times - self.start_time
+        rows[:, [1 + j for j in refs]] = values
+        np.savetxt(sys.stdout, rows, fmt='%.6f', delimiter=',')
+        sys.stdout.flush()
+
+    def new_line(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Acquisition():
+    '''
+    sink of a SerialReader that passes the readings of the acquired channels to the output,
+    in the columns of those channels only, until `count` readings arrived (if given)
+    '''
+
+    def __init__(self, output, channels: list, count=None):
+        self.output = output
+        self.columns = {ref: k for k, ref in enumerate(channels)}
+        self.count = count
+        self.readings = 0
+        self.done = threading.Event()
+
+    def write(self, times: np.ndarray, refs: list, values: np.ndarray):
+        if self.done.is_set():
+            return
+        if self.count is not None and self.readings + len(times) >= self.count:
+            n = self.count - self.readings
+            times, values = times[:n], values[:n]
+            self.done.set()
+        self.readings += len(times)
+        self.output.write(times, [self.columns[ref] for ref in refs], values)
+
+
+def open_port(path: str, baudrate: int):
+    '''opens the serial port at path, or a simulated arduino if None'''
+    if path is None:
+        from simulator import SimulatedSerial
+        return SimulatedSerial(baudrate=baudrate)
+    return serial.Serial(path, baudrate)
+
+
+def command(reader: SerialReader, name: str, *args) -> list:
+    '''sends a command and waits for its response, raising CommandError if it fails'''
+    response = reader.submit(format_command(name, *args)).result()
+    if not response.ok:
+        raise CommandError(response)
+    return response.lines
+
+
+def commands(reader: SerialReader, calls: list) -> list:
+    '''
+    sends (name, *args) commands together in a batch and waits for their responses,
+    raising CommandError for the first one that fails
+    '''
+    futures = reader.submit_batch([format_command(*call) for call in calls])
+    responses = [future.result() for future in futures]
+    for response in responses:
+        if not response.ok:
+            raise CommandError(response)
+    return [response.lines for response in responses]
+
+
+def acquire(args) -> int:
+    '''runs the acquisition described by the command line arguments, returns the exit status'''
+    mask = int(args.mask, 0)
+    channels = mask_channels(mask)
+    if not channels:
+        print("ERROR: no channels to acquire", file=sys.stderr)
+        return 1
+
+    port = open_port(args.port, args.baud)
+    events = queue.Queue()
+    # the arduino resets when the port opens, commands wait for its welcome message
+    reader = SerialReader(port, events, welcome=True)
+    reader.start()
+    output = None
+    try:
+        # the settings are sent in one batch, in a single round trip
+        setup = []
+        if args.samples is not None:
+            setup.append(("defput", "SAMPLES", args.samples))
+        if args.filter is not None:
+            kind, _, alpha = args.filter.partition(':')
+            setup.append(("filter", kind, *([alpha] if alpha else [])))
+        setup.append(("defget", "TRUE_VOLTAGE"))
+        commands(reader, setup)
+
+        names = [f"A{i}" for i in channels]
+        start_time = time.time()
+        if args.output == "-":
+            output = StdoutSink(names, reader.true_voltage, start_time)
+        else:
+            fmt = args.format or ("csv" if args.output.endswith(".csv") else "bin")
+            output = Recorder(args.output, fmt, names, reader.true_voltage, start_time)
+            output.start()
+        output.new_line()
+
+        acquisition = Acquisition(output, channels, args.count)
+        reader.sinks = [acquisition]
+        if args.mode == "poll":
+            reader.poll(mask)
+        else:
+            reader.stream(mask, args.interval, binary=args.mode == "binary")
+
+        # wait for the end, reporting anything the arduino says on its own
+        end = time.time() + args.duration if args.duration is not None else None
+        status = 0
+        while not acquisition.done.is_set() and (end is None or time.time() < end):
+            try:
+                kind, _, payload = events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == 'line':
+                print(payload, file=sys.stderr)
+            elif kind == 'error':
+                print("SERIAL ERROR:", payload, file=sys.stderr)
+                status = 1
+                break
+        acquisition.done.set()
+
+        if status == 0:
+            if args.mode == "poll":
+                reader.poll(0)
+            else:
+                command(reader, "bstop")
+        print(f"{acquisition.readings} readings", file=sys.stderr)
+        return status
+    except KeyboardInterrupt:
+        return 130
+    except (CommandError, TimeoutError, ConnectionError) as e:
+        print("ERROR:", e, file=sys.stderr)
+        return 1
+    finally:
+        reader.stop()
+        port.close()
+        if output is not None:
+            output.close()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="acquires from an arduino without the GUI")
+    parser.add_argument("port", nargs="?", help="serial port of the arduino, the simulated one is used if not given")
+    parser.add_argument("--baud", type=int, default=38400, help="baud rate")
+    parser.add_argument("--mask", default="0b111111", help="channels to acquire, as a bitmask (LSB is A0)")
+    parser.add_argument("--mode", choices=["poll", "stream", "binary"], default="binary",
+                        help="request each reading with `analog`, or have the arduino broadcast them as text or binary frames")
+    parser.add_argument("--interval", type=int, default=100, help="ms between broadcast readings")
+    parser.add_argument("--samples", type=int, help="ADC samples averaged in each reading, left as it is if not given")
+    parser.add_argument("--filter", metavar="TYPE[:ALPHA]", help="filter of the readings on the arduino, such as EMA:0.2")
+    parser.add_argument("--duration", type=float, help="seconds to acquire for")
+    parser.add_argument("--count", type=int, help="readings to acquire")
+    parser.add_argument("--output", default="-", help="recording to write, - for CSV to stdout")
+    parser.add_argument("--format", choices=Recorder.formats, help="format of the recording, from its extension if not given")
+    args = parser.parse_args()
+    if args.duration is None and args.count is None:
+        parser.error("either --duration or --count is needed")
+
+    sys.exit(acquire(args))
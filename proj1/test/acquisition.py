@@ -0,0 +1,499 @@
+import collections
+import concurrent.futures
+import queue
+import re
+import threading
+import time
+import numpy as np
+from clocksync import ClockSync
+from command_parser import BATCH_END, BATCH_NEXT, BATCH_SEPARATOR, INVALID, batch_lines, validate, validate_many
+from protocol import Response, command_name, decode_frames, expected_lines, frame_size, mask_channels, counts_to_voltage
+from settings import SettingsCache
+
+
+# a data line is a comma terminated list of voltages, as printed by `analog()` on the arduino,
+# followed by the millis() of the reading (older firmware leaves it out)
+DATA_LINE = re.compile(r'^(-?\d+(\.\d+)?,)+(\d+)?$')
+
+
+def parse_data_line(text: str) -> np.ndarray:
+    '''
+    parses a data line into an array of voltages, A0 first.
+    the arduino prints the channels of the bitmask from A5 down to A0.
+    '''
+    return np.array(text.split(',')[:-1], dtype=float)[::-1]
+
+
+class Command():
+    '''a command sent to the arduino, and the lines of its response as they arrive'''
+
+    def __init__(self, text: str, timeout: float, poll=False):
+        self.text = text
+        self.name = command_name(text)
+        self.timeout = timeout
+        self.poll = poll            # whether it's a reading requested by the polling itself
+        self.expected = expected_lines(text)
+        self.future = concurrent.futures.Future()
+        self.lines = []
+        self.sent = None            # time it was written
+        self.last_line = None       # time the last line of the response arrived
+
+    def add(self, t: float, text: str):
+        self.lines.append(text)
+        self.last_line = t
+
+    def complete(self, t: float) -> bool:
+        '''whether the whole response arrived by time t'''
+        if self.lines and self.lines[-1].startswith("ERROR: "):
+            return True
+        if self.expected is None:
+            # unknown length, over once the arduino is quiet for a while
+            return bool(self.lines) and t - self.last_line > SerialReader.quiet_time
+        return len(self.lines) >= self.expected
+
+
+class Batch(Command):
+    '''
+    commands sent together in one line, with a combined response where the answer of each one
+    is followed by a ';' line and the last one by a '.' line. their futures get their own part
+    '''
+
+    def __init__(self, commands: list):
+        super().__init__(BATCH_SEPARATOR.join(c.text for c in commands), sum(c.timeout for c in commands))
+        self.commands = commands
+        if any(c.name == 'analog' for c in commands):
+            self.name = 'analog'
+        self.future.add_done_callback(self.split)
+
+    def complete(self, t: float) -> bool:
+        return bool(self.lines) and self.lines[-1] == BATCH_END
+
+    def split(self, future: concurrent.futures.Future):
+        if future.exception() is not None:
+            for command in self.commands:
+                command.future.set_exception(future.exception())
+            return
+        answers = [[]]
+        for line in future.result().lines[:-1]:
+            if line == BATCH_NEXT:
+                answers.append([])
+            else:
+                answers[-1].append(line)
+        for i, command in enumerate(self.commands):
+            if i < len(answers):
+                command.future.set_result(Response(command.text, answers[i]))
+            else:
+                # the batch ended before this one was answered, it would wait forever
+                command.future.set_exception(ValueError(f"no answer to '{command.text}' in its batch"))
+
+
+class BatchProbe(Command):
+    '''
+    a harmless batch that tells whether the arduino accepts batches, sent before the first one.
+    firmware without them doesn't send the ';' and '.' lines: it can't parse the first command,
+    and runs the rest of the line on its own, so a batch would run commands twice, or out of order
+    '''
+
+    def __init__(self):
+        super().__init__(BATCH_SEPARATOR.join(["add(0)"] * 2), SerialReader.command_timeout)
+
+    def complete(self, t: float) -> bool:
+        # the answers of older firmware have no end, they're over once it's quiet
+        return bool(self.lines) and (self.lines[-1] == BATCH_END or t - self.last_line > SerialReader.quiet_time)
+
+    @property
+    def supported(self) -> bool:
+        return self.lines[-1:] == [BATCH_END]
+
+
+class SerialReader(threading.Thread):
+    '''
+    background thread that owns an open serial port.
+    commands are sent one at a time, in the order they're submitted, or several in a line as a
+    batch, and every line that arrives is matched to the command waiting for it, so responses never
+    get mixed up. incoming data is read as soon as it arrives, and pushed into the `events` queue
+    as (kind, host time, payload) tuples:
+        ('samples', t, (times, channels, values))   readings of the polled or broadcast channels,
+                                                    with `values` of shape (len(times), len(channels))
+        ('line', t, text)                           a line that isn't the response to any command
+        ('settings', t, values)                     a setting printed by `defget` changed, values are
+                                                    all the known ones by name (see SettingsCache)
+        ('open', t, None)                           the port was opened by the thread, if it was closed
+        ('error', t, exception)                     the port failed, the thread has stopped
+    readings are also passed to the `write(times, channels, values)` method of every object in
+    `sinks` (such as a Recorder) from this thread, so they don't wait for the GUI.
+    '''
+
+    # default seconds to wait for the response to a command
+    command_timeout = 5
+
+    # how long to wait for a reading before polling again, in seconds
+    poll_timeout = 2
+
+    # seconds without new lines after which a response of unknown length is over
+    quiet_time = 0.1
+
+    # longest the arduino takes to reset and print its welcome message, in seconds
+    welcome_timeout = 3
+
+    # seconds to wait for the generation of the settings, firmware without it doesn't answer
+    generation_timeout = 0.5
+
+    def __init__(self, port, events: queue.Queue, welcome=False):
+        super().__init__(daemon=True)
+        self.serial = port
+        self.serial.timeout = 0.02      # bounds how long a read blocks before checking for writes
+        # seconds each byte takes to arrive (8N1: start, 8 data and stop bits), readings are timestamped
+        # when they were taken rather than when they finished arriving, so devices at different baud
+        # rates or with longer lines stay aligned
+        self.byte_time = 10 / port.baudrate
+        self.events = events
+        self.sinks = []
+        self.requests = queue.Queue()
+        self.stopped = threading.Event()
+
+        # acquisition state, only touched by this thread after start
+        self.pending = collections.deque()  # commands waiting to be sent
+        self.current = None     # command waiting for its response
+        self.batches = None     # whether the arduino accepts batches, None until a BatchProbe finds out
+        # if the arduino is expected to print a welcome message, nothing is sent until it does
+        self.welcome = time.time() + SerialReader.welcome_timeout if welcome else None
+        self.mask = 0           # bitmask of channels being polled or broadcast
+        self.polling = False    # whether readings are requested one by one with `analog`
+        self.streaming = False  # whether the arduino is broadcasting readings on its own
+        self.frame_mask = 0     # bitmask of the binary frames being decoded, 0 if reading text only
+        self.last_seq = None    # sequence number of the last binary frame
+        self.last_millis = None # millis() of the last reading, a reading taken before the next average repeats it
+
+        # number of binary frames lost or corrupted on the way
+        self.dropped = 0
+
+        # copy of the settings of the arduino, updated whenever it prints them
+        self.settings = SettingsCache()
+
+        # maps the millis() of the readings to host time
+        self.clock = ClockSync()
+
+        # FilterChain the readings go through before anything else sees them, None to leave them as they are
+        self.filter = None
+
+
+    def submit(self, text: str, timeout=None) -> concurrent.futures.Future:
+        '''
+        queues a command to be sent to the arduino (thread-safe).
+        returns a future that gets its Response, or a TimeoutError if the arduino doesn't answer
+        within timeout seconds. commands the arduino can't parse are answered without sending them.
+        callbacks of the future run in this thread
+        '''
+        command = Command(text, timeout or SerialReader.command_timeout)
+        self.requests.put(('command', command))
+        return command.future
+
+
+    @property
+    def true_voltage(self) -> float:
+        '''needed to convert the counts of binary frames'''
+        return float(self.settings.get("TRUE_VOLTAGE", 5.0))
+
+
+    def refresh_settings(self):
+        '''
+        brings the copy of the settings up to date, fetching them all only if their generation
+        changed, or if the arduino doesn't count generations (thread-safe)
+        '''
+        self.requests.put(('settings', None))
+
+
+    def submit_batch(self, texts: list, timeout=None) -> list:
+        '''
+        like `submit` for many commands, which are sent together in as few batch lines as fit in
+        the receive buffer of the arduino, so they take one round trip instead of one each
+        (thread-safe). returns the future of each command
+        '''
+        commands = [Command(text, timeout or SerialReader.command_timeout) for text in texts]
+        self.requests.put(('batch', commands))
+        return [command.future for command in commands]
+
+
+    def poll(self, mask: int):
+        '''starts polling the given channel bitmask as fast as the arduino answers, 0 stops (thread-safe)'''
+        self.requests.put(('poll', mask))
+
+
+    def stream(self, mask: int, interval: int, binary=False):
+        '''
+        makes the arduino broadcast the given channel bitmask every interval ms, 0 stops (thread-safe).
+        the broadcast parameters are written to the arduino settings with `defput`.
+        if binary, the readings are sent as compact binary frames instead of text
+        '''
+        self.requests.put(('stream', (mask, interval, binary)))
+
+
+    def set_filter(self, chain):
+        '''filters the readings from now on with the given FilterChain, None stops filtering (thread-safe)'''
+        self.requests.put(('filter', chain))
+
+
+    def stop(self):
+        '''stops the thread and waits for it to finish. the port is left open'''
+        self.stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+
+    def run(self):
+        buffer = b''    # text waiting for the end of its line
+        raw = b''       # bytes waiting to be decoded as binary frames
+        try:
+            if not self.serial.is_open:
+                # opening can take a while, so it's done here rather than by whoever started the thread
+                self.serial.open()
+                self.settings.clear()
+                self.batches = None
+                self.last_millis = None
+                self.events.put(('open', time.time(), None))
+                if self.welcome is not None:
+                    self.welcome = time.time() + SerialReader.welcome_timeout
+            while not self.stopped.is_set():
+                self.handle_requests()
+
+                # blocks until at least a byte is available or the port timeout expires
+                data = self.serial.read(self.serial.in_waiting or 1)
+                now = time.time()
+
+                if self.frame_mask:
+                    # split the binary frames from the text around them
+                    seq, millis, counts, data, raw = decode_frames(raw + data, self.frame_mask)
+                    if len(seq):
+                        self.handle_frames(now, seq, millis, counts)
+
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                left = sum(len(line) + 1 for line in lines) + len(buffer)    # bytes from each line on
+                for line in lines:
+                    self.handle_line(now - left * self.byte_time, line.decode('ascii', errors='replace').strip())
+                    left -= len(line) + 1
+
+                self.check_current(now)
+        except Exception as e:
+            self.events.put(('error', time.time(), e))
+        finally:
+            # nothing is going to answer the commands left
+            for command in [self.current, *self.pending]:
+                if command is not None and not command.future.done():
+                    command.future.set_exception(ConnectionError("serial reader stopped"))
+
+
+    def handle_requests(self):
+        '''handles the requests of other threads, and sends the next command if none is waiting for a response'''
+        while True:
+            try:
+                kind, arg = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'command':
+                if validate(arg.text):
+                    self.pending.append(arg)
+                else:
+                    # the arduino would only answer that it can't parse it
+                    arg.future.set_result(Response(arg.text, [INVALID]))
+            elif kind == 'batch':
+                valid = validate_many([command.text for command in arg])
+                for command, ok in zip(arg, valid):
+                    if not ok:
+                        command.future.set_result(Response(command.text, [INVALID]))
+                self.pending.extend(self.batch([command for command, ok in zip(arg, valid) if ok]))
+            elif kind == 'filter':
+                self.filter = arg
+            elif kind == 'settings':
+                self.pending.append(self.fetch_settings(check=self.settings.synced is not None))
+            elif kind == 'poll':
+                self.polling = bool(arg)
+                if arg:
+                    self.mask = arg
+                    self.frame_mask = 0
+            elif kind == 'stream':
+                mask, interval, binary = arg
+                if mask:
+                    self.mask = mask
+                    # frames carry counts, so the reference voltage is needed to convert them
+                    self.enqueue(f'defput(CHANNELS,0b{mask:06b})', f'defput(INTERVAL,{interval})',
+                                 *(['defget(TRUE_VOLTAGE)', 'bstart(BIN)'] if binary else ['bstart()']))
+                    if binary:
+                        self.last_seq = None
+                    # keep decoding frames after a binary broadcast stops, some may still be on the way
+                    self.frame_mask = mask if binary else 0
+                else:
+                    self.enqueue('bstop()')
+                self.streaming = bool(mask)
+
+        if self.welcome is not None:
+            if time.time() < self.welcome:
+                return
+            self.welcome = None
+
+        if self.current is None:
+            if not self.pending and self.polling:
+                # request the next reading right after the previous one arrived
+                self.pending.append(Command(f'analog(0b{self.mask:06b})', SerialReader.poll_timeout, poll=True))
+            if self.pending and isinstance(self.pending[0], Batch):
+                if self.batches is None:
+                    self.pending.appendleft(self.probe())
+                elif not self.batches:
+                    # older firmware, the commands of batches not sent yet are sent one at a time
+                    self.pending.extendleft(reversed(self.pending.popleft().commands))
+            if self.pending:
+                self.current = self.pending.popleft()
+                self.current.sent = time.time()
+                self.serial.write((self.current.text + "\n").encode('ascii'))
+
+
+    def probe(self) -> Command:
+        '''command that finds out whether the arduino accepts batches'''
+        command = BatchProbe()
+        def done(future):
+            # if it goes unanswered, the next batch probes again
+            if future.exception() is None:
+                self.batches = command.supported
+        command.future.add_done_callback(done)
+        return command
+
+
+    def fetch_settings(self, check: bool) -> Command:
+        '''command that fetches every setting, or only their generation first if check'''
+        if check:
+            command = Command('defget(GENERATION)', SerialReader.generation_timeout)
+            command.future.add_done_callback(self.check_generation)
+        else:
+            command = Command('defget()', SerialReader.command_timeout)
+            command.future.add_done_callback(self.synced)
+        return command
+
+
+    def check_generation(self, future: concurrent.futures.Future):
+        if future.exception() is None and self.settings.stale:
+            self.pending.append(self.fetch_settings(check=False))
+
+
+    def synced(self, future: concurrent.futures.Future):
+        if future.exception() is None:
+            self.settings.synced = self.settings.generation
+
+
+    def enqueue(self, *texts):
+        '''queues commands of the reader itself, in a batch, the GUI only hears about them if they fail'''
+        commands = [Command(text, SerialReader.command_timeout) for text in texts]
+        for command in commands:
+            command.future.add_done_callback(self.report_failure)
+        self.pending.extend(self.batch(commands))
+
+
+    def batch(self, commands: list) -> list:
+        '''
+        groups valid commands in Batches of a line each, lone commands are sent as they are.
+        the Batches are split again before they're sent if the arduino turns out not to accept them
+        '''
+        if self.batches is False:
+            return commands
+        groups = []
+        for line in batch_lines([command.text for command in commands]):
+            n = line.count(BATCH_SEPARATOR) + 1
+            group, commands = commands[:n], commands[n:]
+            groups.append(Batch(group) if n > 1 else group[0])
+        return groups
+
+
+    def report_failure(self, future: concurrent.futures.Future):
+        error = future.exception()
+        if error is None and future.result().ok:
+            return
+        text = f"ERROR: {error}" if error is not None else future.result().lines[-1]
+        self.events.put(('line', time.time(), text))
+
+
+    def check_current(self, t: float):
+        '''completes the command waiting for a response if it's over or took too long'''
+        command = self.current
+        if command is None:
+            return
+        if command.complete(t):
+            self.current = None
+            command.future.set_result(Response(command.text, command.lines))
+        elif t - command.sent > command.timeout:
+            # a lost poll request is simply sent again
+            self.current = None
+            if not command.poll:
+                command.future.set_exception(TimeoutError(f"no response to '{command.text}'"))
+
+
+    def handle_line(self, t: float, text: str):
+        '''matches a line read from the arduino with the command waiting for it, or turns it into an event'''
+        if self.settings.update(text):
+            self.events.put(('settings', t, dict(self.settings.values)))
+        self.welcome = None
+
+        command = self.current
+        data = DATA_LINE.match(text)
+        if command is not None and (command.name == 'analog' or not data):
+            command.add(t, text)
+            if data and command.poll:
+                self.emit_line(t, data, text)
+            self.check_current(t)
+        elif data and self.streaming:
+            self.emit_line(t, data, text)
+        else:
+            self.events.put(('line', t, text))
+
+
+    def handle_frames(self, t: float, seq: np.ndarray, millis: np.ndarray, counts: np.ndarray):
+        '''turns the decoded binary frames that arrived at time t into an event'''
+        # gaps in the sequence numbers are frames that were lost
+        if self.last_seq is not None:
+            seq = np.concatenate(([self.last_seq], seq))
+        self.dropped += int(np.sum((np.diff(seq.astype(np.int16)) - 1) % 256))
+        self.last_seq = seq[-1]
+
+        # frames sent faster than the averages complete repeat the last one
+        new = np.diff(millis.astype(np.int64), prepend=-1 if self.last_millis is None else self.last_millis) != 0
+        self.last_millis = int(millis[-1])
+        kept = np.flatnonzero(new)
+        if not len(kept):
+            return
+        # only the last frame is known to have just arrived, the others waited for it in the buffers,
+        # so the last new one arrived at the latest before the frames after it
+        self.clock.update(millis[kept[-1:]], [t - (len(millis) - kept[-1]) * frame_size(self.frame_mask) * self.byte_time])
+        millis, counts = millis[kept], counts[kept]
+        times = self.clock.to_host(millis)
+        values = counts_to_voltage(counts, self.true_voltage)
+        self.emit_samples(t, times, mask_channels(self.frame_mask), values)
+
+
+    def emit_line(self, t: float, data: re.Match, text: str):
+        '''hands the reading of a data line that arrived at time t on, unless it repeats the last one'''
+        times = self.reading_time(t, data)
+        if times is not None:
+            self.emit_samples(t, times, mask_channels(self.mask), parse_data_line(text)[None, :])
+
+
+    def reading_time(self, t: float, data: re.Match) -> np.ndarray:
+        '''
+        host time of the reading of a data line that arrived at time t, None if it has the same
+        millis() as the last one: it was asked for before the next average was complete
+        '''
+        if data.group(3) is None:
+            return np.array([t])
+        millis = int(data.group(3))
+        if millis == self.last_millis:
+            return None
+        self.last_millis = millis
+        self.clock.update([millis], [t])
+        return self.clock.to_host([millis])
+
+
+    def emit_samples(self, t: float, times: np.ndarray, refs: list, values: np.ndarray):
+        '''hands a batch of readings to the sinks and the GUI'''
+        if self.filter is not None:
+            values = self.filter(refs, values)
+        for sink in self.sinks:
+            sink.write(times, refs, values)
+        self.events.put(('samples', t, (times, refs, values)))
@@ -0,0 +1,216 @@
+'''
+throughput and latency benchmarks of the acquisition pipeline.
+
+    python benchmark.py [--port PORT] [--duration S] [--output FILE]
+
+runs against the simulated arduino unless a port is given, and writes the results as JSON,
+together with the commit and a hash of window4.py, to compare versions.
+'''
+import argparse
+import hashlib
+import json
+import os
+import platform
+import queue
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import serial
+from acquisition import SerialReader, parse_data_line
+from protocol import decode_frames, encode_frame, mask_channels
+from simulator import ADC_CONVERSION, SimulatedSerial
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def open_port(args):
+    '''opens the real port given in the arguments, or a simulated arduino, and skips the welcome message'''
+    if args.port:
+        port = serial.Serial(args.port, 38400, timeout=2)
+        time.sleep(2)       # the arduino resets when the port opens
+    else:
+        port = SimulatedSerial(timeout=2, baudrate=args.baud, conversion_time=args.conversion_time, seed=0)
+        port.readline()
+    port.reset_input_buffer()
+    return port
+
+
+def round_trip(port, command: str, repeat: int) -> dict:
+    '''time between writing a command and reading the first line of its response, in ms'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        port.write((command + "\n").encode('ascii'))
+        port.readline()
+        times.append((time.perf_counter() - start) * 1000)
+        port.reset_input_buffer()
+    return {"mean_ms": float(np.mean(times)), "median_ms": float(np.median(times)),
+            "min_ms": float(np.min(times)), "max_ms": float(np.max(times)), "n": repeat}
+
+
+def throughput(port, mode: str, mask: int, interval: int, duration: float) -> dict:
+    '''readings per second delivered by the reader thread in the given mode'''
+    events = queue.Queue()
+    reader = SerialReader(port, events)
+    reader.start()
+    if mode == "poll":
+        reader.poll(mask)
+    else:
+        reader.stream(mask, interval, binary=mode == "binary")
+
+    readings = 0
+    start = time.perf_counter()
+    first = None
+    while time.perf_counter() - start < duration:
+        try:
+            kind, _, payload = events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if kind == 'samples':
+            if first is None:
+                # count from the first reading, after the setup commands
+                first = time.perf_counter()
+            else:
+                readings += len(payload[0])
+    elapsed = time.perf_counter() - first if first is not None else duration
+
+    if mode == "poll":
+        reader.poll(0)
+    else:
+        reader.stream(0, 0)
+    time.sleep(0.2)
+    reader.stop()
+    port.reset_input_buffer()
+    return {"readings_per_s": readings / elapsed, "channel_values_per_s": readings * len(mask_channels(mask)) / elapsed,
+            "dropped_frames": reader.dropped, "clock_drift_ppm": reader.clock.drift * 1e6, "duration_s": elapsed}
+
+
+def parse_cost(repeat=20000) -> dict:
+    '''cost of decoding a reading of 6 channels, as text and as binary frames'''
+    line = "4.9951,0.0000,2.5012,3.3000,1.2345,0.0012,"
+    text_us = min(timeit.repeat(lambda: parse_data_line(line), number=repeat, repeat=3)) / repeat * 1e6
+
+    frames = b''.join(encode_frame(i, i, [i % 1024]*6, 0b111111) for i in range(1000))
+    binary_us = min(timeit.repeat(lambda: decode_frames(frames, 0b111111), number=20, repeat=3)) / 20 / 1000 * 1e6
+    return {"text_line_us": text_us, "binary_frame_us": binary_us}
+
+
+def plot_cost(readings: int, batch: int) -> dict:
+    '''cost per reading of appending to a Channel and redrawing it, and the memory it keeps'''
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    import pyqtgraph as pg
+    from window4 import AcquisitionApp, Channel
+
+    app = QApplication.instance() or QApplication([])
+    graph = pg.PlotWidget()
+    graph.resize(1000, 400)
+    channel = Channel(graph, 'w')
+    channel.new_line()
+    rate = 1000     # readings per second of the synthetic signal
+    t = np.arange(readings) / rate
+    v = 2.5 + 2*np.sin(t)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(0, readings, batch):
+        channel.extend(t[i:i+batch], v[i:i+batch])
+        x_max = max(t[min(i+batch, readings)-1], AcquisitionApp.time_range)
+        channel.update(x_max - AcquisitionApp.time_range, x_max, 1000)
+        # the redraw happens once Qt gets to the events of the update
+        app.processEvents()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"us_per_reading": elapsed / readings * 1e6, "us_per_update": elapsed / (readings / batch) * 1e6,
+            "memory_growth_mb": current / 2**20, "peak_memory_growth_mb": peak / 2**20, "readings": readings, "batch": batch}
+
+
+# run in a fresh interpreter, prints the seconds from its start to each step as JSON
+STARTUP_SCRIPT = '''
+import json, os, sys, time
+start = time.perf_counter()
+if sys.argv[1] == "acquire":
+    import acquire
+    print(json.dumps({"import_s": time.perf_counter() - start}))
+    sys.exit()
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import window4
+imported = time.perf_counter()
+app = window4.QApplication([])
+window = window4.AcquisitionApp(app)
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "shown_s": shown - start}), flush=True)
+os._exit(0)
+'''
+
+
+def startup(target: str, repeat: int) -> dict:
+    '''
+    seconds a fresh interpreter takes to import the acquisition window ("window4") or the headless
+    acquisition ("acquire"), and for the window to show, the best of `repeat` runs
+    '''
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, target], cwd=HERE,
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["process_s"] = time.perf_counter() - start
+        runs.append(result)
+    return {key: min(run[key] for run in runs) for key in runs[0]}
+
+
+def version() -> dict:
+    '''identifies the code being measured'''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    with open(os.path.join(HERE, "window4.py"), 'rb') as file:
+        window_hash = hashlib.sha1(file.read()).hexdigest()
+    return {"commit": commit, "window4_sha1": window_hash, "python": sys.version.split()[0],
+            "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmarks of the acquisition pipeline")
+    parser.add_argument("--port", help="serial port of a real arduino, the simulated one is used if not given")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of each throughput measurement")
+    parser.add_argument("--repeat", type=int, default=20, help="round trips measured for each command")
+    parser.add_argument("--mask", default="0b111111", help="channels to acquire")
+    parser.add_argument("--interval", type=int, default=0, help="broadcast interval in ms")
+    parser.add_argument("--baud", type=int, default=38400, help="baud rate of the simulated arduino")
+    parser.add_argument("--conversion-time", type=float, default=ADC_CONVERSION, help="seconds per ADC conversion of the simulated arduino")
+    parser.add_argument("--readings", type=int, default=200000, help="readings fed to the Channel plot benchmark")
+    parser.add_argument("--no-plot", action="store_true", help="skip the benchmarks that need PyQt5")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    args = parser.parse_args()
+    mask = int(args.mask, 0)
+
+    results = {"version": version(), "device": args.port or "simulated", "mask": f"0b{mask:06b}"}
+
+    port = open_port(args)
+    results["round_trip"] = {
+        "analog": round_trip(port, f"analog(0b{mask:06b})", args.repeat),
+        "defget": round_trip(port, "defget(TRUE_VOLTAGE)", args.repeat),
+    }
+    results["throughput"] = {mode: throughput(port, mode, mask, args.interval, args.duration)
+                             for mode in ["poll", "stream", "binary"]}
+    port.close()
+
+    results["parse"] = parse_cost()
+    results["startup"] = {"acquire": startup("acquire", 3)}
+    if not args.no_plot:
+        results["startup"]["window4"] = startup("window4", 3)
+        results["plot"] = plot_cost(args.readings, 50)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,85 @@
+import asyncio
+from protocol import Response, format_command
+
+
+class CommandError(Exception):
+    '''the arduino answered a command with an error message'''
+
+    def __init__(self, response: Response):
+        super().__init__(response.message)
+        self.response = response
+
+
+class CommandBatch():
+    '''
+    commands queued to be sent together as a batch, in one round trip:
+
+        batch = client.batch()
+        batch.add("defput", "SAMPLES", 16)
+        batch.add("defget", "TRUE_VOLTAGE")
+        samples, voltage = await batch.flush()
+    '''
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.commands = []
+
+
+    def add(self, name: str, *args):
+        '''queues the command `name(args...)`'''
+        self.commands.append(format_command(name, *args))
+
+
+    async def flush(self, timeout=None, check=True) -> list:
+        '''
+        sends the queued commands and returns their responses, in order.
+        raises CommandError for the first one the arduino answers with an error (unless check
+        is False), or TimeoutError if it doesn't answer within timeout seconds each
+        '''
+        commands, self.commands = self.commands, []
+        futures = self.reader.submit_batch(commands, timeout)
+        responses = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        if check:
+            for response in responses:
+                if not response.ok:
+                    raise CommandError(response)
+        return list(responses)
+
+
+class CommandClient():
+    '''
+    asyncio interface to the commands of the arduino, on top of a running SerialReader:
+
+        response = await client.call("defget", "TRUE_VOLTAGE")
+
+    commands are sent one at a time and each gets its own response, recognizing
+    ERROR/WARN/INFO status messages, without waiting any longer than the arduino takes.
+    several commands can also be sent together with a `batch`.
+    '''
+
+    def __init__(self, reader):
+        self.reader = reader
+
+
+    async def call(self, name: str, *args, timeout=None, check=True) -> Response:
+        '''
+        sends the command `name(args...)` and returns its response.
+        raises CommandError if the arduino answers with an error (unless check is False),
+        or TimeoutError if it doesn't answer within timeout seconds
+        '''
+        future = self.reader.submit(format_command(name, *args), timeout)
+        response = await asyncio.wrap_future(future)
+        if check and not response.ok:
+            raise CommandError(response)
+        return response
+
+
+    def batch(self) -> CommandBatch:
+        '''a new batch of commands'''
+        return CommandBatch(self.reader)
+
+
+    async def setting(self, name: str) -> str:
+        '''returns the value of a setting as printed by `defget`, without its unit'''
+        response = await self.call("defget", name)
+        return response.lines[0].split(": ", 1)[1].split(' ')[0]
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class ClockSync():
+    '''
+    maps the millis() of an arduino to host time (unix seconds):
+        host = offset + (device - reference) * (1 + drift) / 1000
+    fitted to the lower envelope of (device time, arrival time) pairs. a reading can only arrive
+    after it was taken, so the pair that arrived the fastest in each block of device time is the
+    closest to the true mapping, and USB or scheduler delays of the others don't matter.
+    millis() wrapping around (every 49.7 days) is accounted for, and going back in time
+    (the arduino reset) starts the fit over.
+    '''
+
+    # ms of device time in each block, only the fastest pair of each is kept
+    block = 1000
+
+    # blocks the fit is made over, older ones are forgotten so the drift can follow temperature changes
+    blocks = 600
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.reference = None   # unwrapped device ms the fit is relative to
+        self.last = None        # last raw millis received
+        self.wraps = 0          # times millis() wrapped around until then
+        self.minima = {}        # block -> (device ms since the reference, host - device seconds) of its fastest pair
+        self.offset = None
+        self.drift = 0.0
+
+
+    def unwrap(self, millis) -> tuple:
+        '''returns the raw 32-bit millis as ms since the reference, and the wraps after the last one'''
+        m = np.asarray(millis, dtype=np.int64)
+        prev = self.last if self.last is not None else m[0]
+        steps = np.diff(m, prepend=prev)
+        wraps = self.wraps + np.cumsum(steps < -(1 << 31)) - np.cumsum(steps > (1 << 31))
+        return (m + (wraps << 32) - self.reference).astype(float), int(wraps[-1])
+
+
+    def update(self, millis, host):
+        '''adds readings taken at the given device times that arrived at the given host times'''
+        m = np.asarray(millis, dtype=np.int64)
+        steps = np.diff(m, prepend=self.last if self.last is not None else m[0])
+        if np.any((steps < 0) & (steps > -(1 << 31))):
+            # millis() went back, the arduino was reset
+            self.reset()
+        if self.reference is None:
+            self.reference = int(m[0])
+
+        d, self.wraps = self.unwrap(m)
+        self.last = int(m[-1])
+        residual = np.asarray(host, dtype=float) - d / 1000
+
+        changed = False
+        blocks = (d // ClockSync.block).astype(np.int64)
+        for b in np.unique(blocks):
+            i = np.flatnonzero(blocks == b)
+            i = i[np.argmin(residual[i])]
+            if b not in self.minima or residual[i] < self.minima[b][1]:
+                self.minima[b] = (d[i], residual[i])
+                changed = True
+        if not changed:
+            return
+
+        # forget old blocks
+        newest = max(self.minima)
+        for b in [b for b in self.minima if b <= newest - ClockSync.blocks]:
+            del self.minima[b]
+
+        d, r = np.array(list(self.minima.values())).T
+        slope = np.polyfit(d, r, 1)[0] if len(d) > 2 else 0.0
+        # the line goes through the fastest pair, the rest are above it
+        self.offset = float(np.min(r - slope * d))
+        self.drift = float(slope * 1000)
+
+
+    def to_host(self, millis) -> np.ndarray:
+        '''host times of readings taken at the given device times, near the ones last updated'''
+        d, _ = self.unwrap(millis)
+        return self.offset + d * (1 + self.drift) / 1000
@@ -0,0 +1,204 @@
+'''
+the grammar of the commands of the arduino, as `parse_command()` parses them, so commands can be
+checked before they are sent, the simulator parses exactly like the board, and the tests know
+what the board answers to anything.
+
+a command is a name of at most 15 letters, digits and underscores (not starting with a digit),
+followed by up to 3 comma separated arguments between brackets, each of at most 15 letters,
+digits, underscores, decimal points and minus signs, and a newline. several commands separated
+by ';' in one line are a batch, answered one after the other (see `batch_lines`).
+'''
+import string
+import numpy as np
+
+
+PARSE_OK = 0
+PARSE_ERROR = 1
+PARSE_EMPTY = 2
+
+# longest name or argument, and most arguments
+MAX_SIZE = 15
+MAX_ARGS = 3
+
+# the answer of the arduino to a command it can't parse
+INVALID = "ERROR: invalid command"
+
+# separator of the commands of a batch, and the lines that end the answer of each one and of the last one
+BATCH_SEPARATOR = ";"
+BATCH_NEXT = ";"
+BATCH_END = "."
+
+# classes of bytes in the grammar, for the vectorized validation
+OTHER, WORD, DIGIT, SIGN, OPEN, COMMA, CLOSE, PAD = range(8)
+CLASSES = np.full(256, OTHER, dtype=np.uint8)
+CLASSES[list((string.ascii_letters + "_").encode('ascii'))] = WORD
+CLASSES[list(string.digits.encode('ascii'))] = DIGIT
+CLASSES[list(b'.-')] = SIGN
+CLASSES[ord('(')] = OPEN
+CLASSES[ord(',')] = COMMA
+CLASSES[ord(')')] = CLOSE
+
+
+def is_letter(ch: int) -> bool:
+    return ord('a') <= ch <= ord('z') or ord('A') <= ch <= ord('Z')
+
+
+def parse_command(buf: bytes) -> tuple:
+    '''
+    port of `parse_command()`: parses one command from the start of the received bytes.
+    returns (result, argv, consumed), or None if the arduino would still be waiting for more bytes.
+    like on the arduino, a parse error can stop before the end of the line, and the rest
+    of it is then parsed as another command. a command of a batch ends at the ';' after it,
+    the last consumed byte.
+    '''
+    size = 0
+    argc = 0
+    closed = False
+    argv = [bytearray() for _ in range(MAX_ARGS + 1)]
+
+    for i, ch in enumerate(buf):
+        if ch == ord('\n'):
+            # newline immediately ends the parsing, error if parsing isn't closed
+            if not closed:
+                size = -1
+            break
+        elif closed and ch == ord(BATCH_SEPARATOR):
+            # ';' after the closing bracket ends the command, and another one of the batch follows
+            break
+        elif closed:
+            # anything other than a newline after the closing bracket is an error
+            size = -1
+            break
+
+        if size == -1:
+            continue
+
+        if (is_letter(ch) or ch == ord('_') or
+            (ord('0') <= ch <= ord('9') and (size or argc)) or
+            (ch in b'.-' and argc)):
+            if size > MAX_SIZE - 1:
+                size = -1
+                continue
+            argv[argc].append(ch)
+            size += 1
+        else:
+            if ((ch == ord('(') and not argc) or (ch == ord(',') and 0 < argc < MAX_ARGS)) and size:
+                argc += 1
+                size = 0
+            else:
+                closed = ch == ord(')') and argc != 0 and (argc == 1 or size != 0)
+                if closed and size:
+                    argc += 1
+                if not closed:
+                    size = -1
+    else:
+        # ran out of bytes: nothing to parse, or the arduino would wait for the rest
+        return (PARSE_EMPTY, [], 0) if not buf else None
+
+    argv = [a.decode('ascii') for a in argv[:argc]]
+    return (PARSE_ERROR if size == -1 else PARSE_OK), argv, i + 1
+
+
+def parse_line(text) -> list:
+    '''
+    everything the arduino parses from a line (str or bytes, without the newline), as a list of
+    (result, argv, more), more being whether the command ended with ';'. it's a single command
+    unless it's a batch or there's a parse error. characters of a str that don't fit in a byte
+    are outside the grammar, like any other
+    '''
+    buf = (text.encode('latin-1', errors='replace') if isinstance(text, str) else bytes(text)) + b'\n'
+    parsed = []
+    while buf:
+        result, argv, consumed = parse_command(buf)
+        parsed.append((result, argv, buf[consumed - 1] == ord(BATCH_SEPARATOR)))
+        buf = buf[consumed:]
+    return parsed
+
+
+def batch_lines(commands: list) -> list:
+    '''
+    groups commands in as few batch lines as possible, without the newline, so that each line fits
+    in the receive buffer of the arduino: it only reads the next command of a batch after running
+    the previous one, and slow ones (writing the EEPROM) leave the rest of the line waiting there.
+    raises ValueError if the arduino couldn't parse any of the commands
+    '''
+    from protocol import RX_BUFFER
+    ok = validate_many(commands)
+    if not ok.all():
+        raise ValueError("invalid commands " + ", ".join(repr(commands[i]) for i in np.flatnonzero(~ok)))
+    lines = []
+    for command in commands:
+        if lines and len(lines[-1]) + len(command) + 2 < RX_BUFFER:
+            lines[-1] += BATCH_SEPARATOR + command
+        else:
+            lines.append(command)
+    return lines
+
+
+def validate(text) -> bool:
+    '''whether the arduino parses a line (without the newline) as one command'''
+    parsed = parse_line(text)
+    return len(parsed) == 1 and parsed[0][0] == PARSE_OK
+
+
+def validate_many(commands: list) -> np.ndarray:
+    '''
+    `validate` for many lines at once, as a boolean array. instead of running the parser on
+    each byte, the lines are laid out in a padded byte matrix and every rule of the grammar
+    is checked on all of them together: only its characters, one '(' after a name of the
+    right size, one ')' at the end, and at most 3 arguments of the right size between them
+    '''
+    lines = [c.encode('latin-1', errors='replace') if isinstance(c, str) else bytes(c) for c in commands]
+    lengths = np.fromiter(map(len, lines), dtype=np.intp, count=len(lines))
+    width = int(lengths.max(initial=0))
+    if not width:
+        return np.zeros(len(lines), dtype=bool)
+    buf = np.frombuffer(b''.join(line.ljust(width, b'\0') for line in lines), dtype=np.uint8).reshape(-1, width)
+    col = np.arange(width)
+    real = col < lengths[:, None]
+    cls = np.where(real, CLASSES[buf], PAD)
+    rows = np.arange(len(lines))
+
+    opens = cls == OPEN
+    commas = cls == COMMA
+    n_commas = commas.sum(axis=1)
+    name = np.argmax(opens, axis=1)     # size of the name, where the '(' is
+    before = col < name[:, None]
+    ok = (
+        (lengths > 0)
+        & ~np.any(cls == OTHER, axis=1)
+        & (opens.sum(axis=1) == 1)
+        & ((cls == CLOSE).sum(axis=1) == 1)
+        & (cls[rows, lengths - 1] == CLOSE)
+        & (name >= 1) & (name <= MAX_SIZE)
+        & (cls[:, 0] == WORD)
+        & ~np.any(before & ((cls == SIGN) | commas), axis=1)
+        & (n_commas < MAX_ARGS)
+    )
+
+    # size of each argument, from the separator before it to the one after it.
+    # only `name()` can have an empty one
+    separators = opens | commas | (cls == CLOSE)
+    last = np.maximum.accumulate(np.where(separators, col, -1), axis=1)
+    previous = np.concatenate((np.full((len(lines), 1), -1), last[:, :-1]), axis=1)
+    size = col - previous - 1
+    ends = separators & ~opens
+    shortest = np.where(n_commas == 0, 0, 1)[:, None]
+    ok &= ~np.any(ends & ((size < shortest) | (size > MAX_SIZE)), axis=1)
+    return ok
+
+
+def encode_command(name: str, *args) -> bytes:
+    '''the bytes of a command, raising ValueError if the arduino couldn't parse it'''
+    text = f"{name}({','.join(str(a) for a in args)})"
+    if not validate(text):
+        raise ValueError(f"invalid command {text!r}")
+    return text.encode('ascii') + b'\n'
+
+
+def encode_commands(commands: list) -> bytes:
+    '''the bytes of many command lines, raising ValueError if the arduino couldn't parse any of them'''
+    ok = validate_many(commands)
+    if not ok.all():
+        raise ValueError("invalid commands " + ", ".join(repr(commands[i]) for i in np.flatnonzero(~ok)))
+    return "".join(c + "\n" if isinstance(c, str) else c.decode('ascii') + "\n" for c in commands).encode('ascii')
@@ -0,0 +1,93 @@
+import numpy as np
+from ringbuffer import RingBuffer
+
+
+class MinMaxPyramid():
+    '''
+    multi-resolution min/max summary of the readings of a channel, updated as they arrive.
+    level k holds one (time, min, max) entry for every `factor**(k+1)` readings, time being the
+    time of the first of them. blocks never span two lines: `new_line` closes the incomplete ones.
+    coarser levels keep a longer history than the readings themselves, in the same memory.
+    '''
+
+    # how many entries of a level are summarized by one entry of the next
+    factor = 4
+
+    # number of levels, the coarsest summarizes factor**levels readings per entry
+    levels = 8
+
+    def __init__(self, capacity: int):
+        self.levels = [RingBuffer(capacity, 3) for _ in range(MinMaxPyramid.levels)]
+        self.pending = [np.empty((3, 0)) for _ in self.levels]  # entries of the level below waiting to fill a block
+        self.starts = []    # index of the first entry of each line, for each level
+
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+        self.pending = [np.empty((3, 0)) for _ in self.levels]
+        self.starts.clear()
+
+
+    def new_line(self):
+        '''closes the incomplete blocks of the current line, and starts a new one'''
+        for k, p in enumerate(self.pending):
+            if not p.shape[1]:
+                continue
+            self.pending[k] = np.empty((3, 0))
+            entry = np.array([[p[0, 0]], [p[1].min()], [p[2].max()]])
+            self.levels[k].append(*entry)
+            if k+1 < len(self.levels):
+                self.pending[k+1] = np.hstack((self.pending[k+1], entry))
+        self.starts.append([level.count for level in self.levels])
+
+
+    def extend(self, times: np.ndarray, values: np.ndarray):
+        '''adds readings to the current line'''
+        entries = np.vstack(np.broadcast_arrays(times, values, values)).astype(float)
+        for k, level in enumerate(self.levels):
+            entries = np.hstack((self.pending[k], entries))
+            n = entries.shape[1] // MinMaxPyramid.factor * MinMaxPyramid.factor
+            self.pending[k] = entries[:, n:]
+            if not n:
+                break
+
+            # summarize every complete block of `factor` entries at once
+            blocks = entries[:, :n].reshape(3, -1, MinMaxPyramid.factor)
+            entries = np.vstack((blocks[0, :, 0], blocks[1].min(axis=1), blocks[2].max(axis=1)))
+            level.append(*entries)
+
+
+    def tail(self, k: int) -> np.ndarray:
+        '''(time, min, max) of the readings of the current line not yet summarized at level k, empty if none'''
+        pending = np.hstack(self.pending[:k+1])
+        if not pending.shape[1]:
+            return np.empty((3, 0))
+        return np.array([[pending[0].min()], [pending[1].min()], [pending[2].max()]])
+
+
+    def line(self, i: int, x_min: float, x_max: float, points: int):
+        '''
+        returns (k, time, min, max) for the entries of line i between x_min and x_max, from the finest
+        level with at most `points` entries there (or the coarsest one), or None if no level has any.
+        '''
+        found = None
+        last = i == len(self.starts) - 1
+        for k, level in enumerate(self.levels):
+            start = self.starts[i][k]
+            end = level.count if last else self.starts[i+1][k]
+            entries = level.view(start, end)
+
+            # keep the entry before x_min too, it covers readings inside the range
+            a = max(np.searchsorted(entries[0], x_min) - 1, 0)
+            b = np.searchsorted(entries[0], x_max, side='right')
+            entries = entries[:, a:b]
+            if last:
+                # the readings of the current line that don't fill a block yet
+                entries = np.hstack((entries, self.tail(k)))
+
+            if entries.shape[1]:
+                found = (k, *entries)
+                if entries.shape[1] <= points:
+                    break
+        return found
@@ -0,0 +1,83 @@
+import numpy as np
+from scipy import signal
+from protocol import FILTERS
+
+
+def coefficients(kind: str, alpha: float) -> tuple:
+    '''
+    (b, a) coefficients of the filters the arduino applies with `filter(type, alpha)`:
+        EMA     y[n] = y[n-1] + alpha*(x[n] - y[n-1])
+        EMA2    two EMA in a row
+    '''
+    if kind not in FILTERS:
+        raise ValueError(f"unknown filter '{kind}'")
+    if kind != "NONE" and not 0 < alpha <= 1:
+        raise ValueError("filter alpha must be above 0 and at most 1")
+    b, a = np.array([1.0]), np.array([1.0])
+    for _ in range(FILTERS.index(kind)):
+        b = np.convolve(b, [alpha])
+        a = np.convolve(a, [1.0, alpha - 1])
+    return b, a
+
+
+class FilterChain():
+    '''
+    stages of IIR filters applied to the readings of every channel as they arrive in batches.
+    the state of each channel is carried from one batch to the next, so filtering in batches
+    gives the same result as filtering everything at once, and like on the arduino, each
+    channel starts from its first reading instead of 0.
+    '''
+
+    def __init__(self, stages: list, channels=6):
+        '''stages is a list of (b, a) coefficients, or of (kind, alpha) like the arduino filters'''
+        self.stages = [coefficients(*stage) if isinstance(stage[0], str) else stage for stage in stages]
+        self.channels = channels
+        self.reset()
+
+
+    def reset(self):
+        '''makes every channel start over with its next reading'''
+        self.state = [None] * len(self.stages)  # (order, channels) state of each stage
+        self.primed = np.zeros(self.channels, dtype=bool)
+
+
+    def __call__(self, refs: list, values: np.ndarray) -> np.ndarray:
+        '''filters readings of shape (n, len(refs)) of the channels in refs, in the order they were taken'''
+        refs = np.asarray(refs)
+        y = np.asarray(values, dtype=float)
+        new = ~self.primed[refs]
+        for k, (b, a) in enumerate(self.stages):
+            order = max(len(a), len(b)) - 1
+            if order == 0:
+                y = y * (b[0] / a[0])
+                continue
+            if self.state[k] is None:
+                self.state[k] = np.zeros((order, self.channels))
+            zi = self.state[k][:, refs]
+            if new.any():
+                # steady state for the first reading, as if it had always been there
+                zi[:, new] = signal.lfilter_zi(b, a)[:, None] * y[0, new]
+            y, zf = signal.lfilter(b, a, y, axis=0, zi=zi)
+            self.state[k][:, refs] = zf
+        self.primed[refs] = True
+        return y
+
+
+    def impulse_response(self, n=1 << 12) -> np.ndarray:
+        '''first n outputs of the stages for a unit impulse, starting from rest'''
+        y = np.zeros(n)
+        y[0] = 1
+        for b, a in self.stages:
+            y = signal.lfilter(b, a, y)
+        return y
+
+
+    def noise_gain(self) -> float:
+        '''how much the stages reduce white noise (ratio of standard deviations), like `filterGain()` on the arduino'''
+        return float(np.sqrt(np.sum(self.impulse_response()**2)))
+
+
+    def correlation(self) -> float:
+        '''correlation of successive outputs when the input is white noise, 0 if the stages don't filter'''
+        h = self.impulse_response()
+        return float(np.dot(h[:-1], h[1:]) / np.dot(h, h))
@@ -0,0 +1,158 @@
+'''
+reports serial ports being plugged or unplugged as soon as it happens.
+
+    python portwatch.py [--backend udev|inotify|poll]
+
+prints the events until interrupted.
+'''
+import argparse
+import ctypes
+import ctypes.util
+import os
+import queue
+import re
+import select
+import struct
+import sys
+import threading
+import serial.tools.list_ports
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+
+# inotify constants, from <sys/inotify.h>
+IN_ATTRIB = 0x004
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')    # wd, mask, cookie, len, followed by the name
+
+# device files of serial ports, leaving out the virtual consoles (tty, tty1, ...)
+SERIAL_DEVICE = re.compile(r'^(tty(?!\d*$)\w+|rfcomm\d+)$')
+
+
+class PortWatcher(threading.Thread):
+    '''
+    background thread that pushes an (action, path) tuple into the `events` queue whenever a
+    serial port is plugged ('add'), unplugged ('remove') or has its permissions changed ('change').
+    the best of these backends available is used:
+        udev        netlink events of the tty subsystem, through pyudev
+        inotify     creation and deletion of device files in /dev (Linux)
+        poll        lists the ports with pyserial, less often the longer nothing changes
+    the first two cost nothing while no port changes, and report changes right away.
+    '''
+
+    backends = ["udev", "inotify", "poll"]
+
+    # seconds between checks of the polling backend, while ports change and once they've been still for a while
+    min_interval = 0.2
+    max_interval = 2.0
+
+    # seconds a blocking wait lasts before checking whether to stop
+    wait_timeout = 0.5
+
+    def __init__(self, events: queue.Queue, backend=None):
+        super().__init__(daemon=True)
+        self.events = events
+        self.backend = backend or next(b for b in PortWatcher.backends if PortWatcher.available(b))
+        self.stopped = threading.Event()
+
+
+    @staticmethod
+    def available(backend: str) -> bool:
+        if backend == "udev":
+            return pyudev is not None and sys.platform.startswith("linux")
+        if backend == "inotify":
+            return sys.platform.startswith("linux") and os.path.isdir("/dev") and ctypes.util.find_library("c") is not None
+        return backend == "poll"
+
+
+    def stop(self):
+        '''stops the thread and waits for it to finish'''
+        self.stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+
+    def run(self):
+        getattr(self, "run_" + self.backend)()
+
+
+    def run_udev(self):
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by(subsystem='tty')
+        monitor.start()
+        while not self.stopped.is_set():
+            device = monitor.poll(timeout=PortWatcher.wait_timeout)
+            if device is not None and device.device_node and device.action in ["add", "remove", "change"]:
+                self.events.put((device.action, device.device_node))
+
+
+    def run_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0 or libc.inotify_add_watch(fd, b"/dev", IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+            # inotify is disabled or out of watches
+            if fd >= 0:
+                os.close(fd)
+            self.backend = "poll"
+            return self.run_poll()
+
+        actions = {IN_CREATE: "add", IN_DELETE: "remove", IN_ATTRIB: "change"}
+        try:
+            while not self.stopped.is_set():
+                ready, _, _ = select.select([fd], [], [], PortWatcher.wait_timeout)
+                if not ready:
+                    continue
+                data = os.read(fd, 4096)
+                offset = 0
+                while offset < len(data):
+                    _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = data[offset:offset+length].rstrip(b'\0').decode(errors='replace')
+                    offset += length
+                    action = next((a for m, a in actions.items() if mask & m), None)
+                    if action is not None and SERIAL_DEVICE.match(name):
+                        self.events.put((action, "/dev/" + name))
+        finally:
+            os.close(fd)
+
+
+    def run_poll(self):
+        known = {port.device for port in serial.tools.list_ports.comports()}
+        interval = PortWatcher.min_interval
+        while not self.stopped.wait(interval):
+            ports = {port.device for port in serial.tools.list_ports.comports()}
+            for path in sorted(ports - known):
+                self.events.put(("add", path))
+            for path in sorted(known - ports):
+                self.events.put(("remove", path))
+
+            # check often right after a change, as ports often come and go in bursts
+            interval = PortWatcher.min_interval if ports != known else min(interval * 2, PortWatcher.max_interval)
+            known = ports
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="prints serial ports being plugged or unplugged")
+    parser.add_argument("--backend", choices=PortWatcher.backends, help="backend to use, the best available if not given")
+    args = parser.parse_args()
+
+    events = queue.Queue()
+    watcher = PortWatcher(events, args.backend)
+    watcher.start()
+    print("watching with", watcher.backend, flush=True)
+    try:
+        while True:
+            try:
+                action, path = events.get(timeout=1)
+            except queue.Empty:
+                continue
+            print(action, path, flush=True)
+    except KeyboardInterrupt:
+        watcher.stop()
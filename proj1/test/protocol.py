@@ -0,0 +1,157 @@
+import numpy as np
+
+
+# bytes of the serial receive buffer of the arduino
+RX_BUFFER = 64
+
+# free running ADC of the firmware: seconds per conversion (13 cycles of the 16 MHz / 128 ADC clock),
+# and conversions thrown away and kept each time it switches to a channel
+ADC_CONVERSION = 13 * 128 / 16e6
+ADC_SETTLE = 1
+ADC_BURST = 4
+
+# first byte of every binary frame, it never appears in the text messages (which are ASCII)
+FRAME_SYNC = 0xA5
+
+# bytes of a frame that are not channel data: sync, sequence number, millis (4) and checksum
+FRAME_HEADER = 6
+FRAME_OVERHEAD = FRAME_HEADER + 1
+
+# bits of each packed ADC count
+COUNT_BITS = 10
+
+# prefixes of the status messages of the arduino
+STATUSES = ["ERROR", "WARN", "INFO"]
+
+# filters the arduino can apply to the readings with `filter(type, alpha)`, by their number in the settings
+FILTERS = ["NONE", "EMA", "EMA2"]
+
+
+class Response():
+    '''lines the arduino sent in response to a command'''
+
+    def __init__(self, command: str, lines: list):
+        self.command = command
+        self.lines = lines
+
+    def __repr__(self):
+        return f"Response({self.command!r}, {self.lines!r})"
+
+    @property
+    def status(self):
+        '''ERROR, WARN or INFO if the response is a status message, None otherwise'''
+        if len(self.lines) == 1:
+            return next((k for k in STATUSES if self.lines[0].startswith(k+": ")), None)
+        return None
+
+    @property
+    def message(self) -> str:
+        '''the response without the status prefix'''
+        text = "\n".join(self.lines)
+        return text.split(": ", 1)[1] if self.status else text
+
+    @property
+    def ok(self) -> bool:
+        return self.status != "ERROR"
+
+
+def format_command(name: str, *args) -> str:
+    '''builds the text of a command'''
+    return f"{name}({','.join(str(a) for a in args)})"
+
+
+def command_name(text: str) -> str:
+    return text.split('(')[0].strip()
+
+
+def expected_lines(text: str):
+    '''
+    number of lines the arduino answers to a command with, or None if it's not fixed.
+    an error message always ends the response, whatever this number is
+    '''
+    name = command_name(text)
+    if name == "help":
+        return None
+    if name == "defget":
+        # every setting without arguments, and firmware versions don't all have the same settings
+        args = text[text.find('(')+1:text.rfind(')')]
+        return 1 if args else None
+    return 1
+
+
+def mask_channels(mask: int) -> list:
+    '''channels of a bitmask, in the order they are packed in a binary frame (A0 first)'''
+    return [i for i in range(6) if mask & (1 << i)]
+
+
+def frame_size(mask: int) -> int:
+    '''size in bytes of a binary frame carrying the channels of the given bitmask'''
+    return FRAME_OVERHEAD + (COUNT_BITS * len(mask_channels(mask)) + 7) // 8
+
+
+def counts_to_voltage(counts: np.ndarray, true_voltage: float) -> np.ndarray:
+    '''converts ADC counts into voltages, the same way `voltage()` does on the arduino'''
+    return (counts + 0.5) * true_voltage / 1024.0
+
+
+def decode_frames(data: bytes, mask: int) -> tuple:
+    '''
+    decodes every complete binary frame in a buffer at once.
+    returns (seq, millis, counts, text, rest) where:
+        seq     (n,) uint8 array with the sequence number of each frame
+        millis  (n,) uint32 array with the arduino time of each frame
+        counts  (n, channels) uint16 array with the ADC counts, A0 first
+        text    bytes found between frames, such as responses to commands
+        rest    trailing bytes that may be the beginning of a frame, to be decoded with the next data
+    frames with a wrong checksum are ignored.
+    '''
+    size = frame_size(mask)
+    n_channels = len(mask_channels(mask))
+    buf = np.frombuffer(data, dtype=np.uint8)
+
+    # every sync byte with enough room after it for a whole frame is a candidate,
+    # and is accepted if the checksum matches
+    candidates = np.flatnonzero(buf[:max(len(buf)-size+1, 0)] == FRAME_SYNC)
+    frames = buf[candidates[:, None] + np.arange(size)]
+    valid = (frames[:, 1:-1].sum(axis=1, dtype=np.uint32) & 0xFF) == frames[:, -1]
+    starts, frames = candidates[valid], frames[valid]
+
+    if len(starts) > 1 and np.any(np.diff(starts) < size):
+        # a sync byte inside a frame passed the checksum by chance, keep the first of overlapping frames
+        keep = np.zeros(len(starts), dtype=bool)
+        end = 0
+        for i, s in enumerate(starts):
+            if s >= end:
+                keep[i] = True
+                end = s + size
+        starts, frames = starts[keep], frames[keep]
+
+    # anything that can't be part of a complete frame yet is kept for later, from its sync byte on
+    end = starts[-1] + size if len(starts) else 0
+    tail = max(end, len(buf) - size + 1)
+    pending = np.flatnonzero(buf[tail:] == FRAME_SYNC)
+    rest_start = tail + pending[0] if len(pending) else len(buf)
+
+    # bytes outside of frames are text, anything not ASCII is garbage from a corrupted frame
+    covered = np.zeros(len(buf), dtype=bool)
+    covered[(starts[:, None] + np.arange(size)).ravel()] = True
+    text = buf[:rest_start][~covered[:rest_start]]
+    text = text[text < 0x80].tobytes()
+
+    seq = frames[:, 1].copy()
+    millis = np.ascontiguousarray(frames[:, 2:6]).view('<u4').ravel()
+    bits = np.unpackbits(frames[:, FRAME_HEADER:-1], axis=1, bitorder='little')
+    bits = bits[:, :COUNT_BITS*n_channels].reshape(len(frames), n_channels, COUNT_BITS)
+    counts = (bits.astype(np.uint16) << np.arange(COUNT_BITS, dtype=np.uint16)).sum(axis=2, dtype=np.uint16)
+
+    return seq, millis, counts, text, data[rest_start:]
+
+
+def encode_frame(seq: int, millis: int, counts, mask: int) -> bytes:
+    '''builds the binary frame the arduino sends for the given counts of the channels of a bitmask, A0 first'''
+    body = bytes([seq & 0xFF]) + (millis & 0xFFFFFFFF).to_bytes(4, 'little')
+    bits = 0
+    for i, c in enumerate(counts):
+        bits |= int(c) << (COUNT_BITS * i)
+    body += bits.to_bytes((COUNT_BITS * len(mask_channels(mask)) + 7) // 8, 'little')
+    return bytes([FRAME_SYNC]) + body + bytes([sum(body) & 0xFF])
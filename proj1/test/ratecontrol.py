@@ -0,0 +1,169 @@
+import math
+import threading
+import time
+from protocol import ADC_BURST, ADC_CONVERSION, ADC_SETTLE, format_command, frame_size, mask_channels
+
+
+# bytes of a text reading: "x.xxxx," for each channel, and the millis() (up to 10 digits) and "\r\n"
+TEXT_CHANNEL = 7
+TEXT_OVERHEAD = 12
+
+
+def reading_bytes(mask: int, binary: bool) -> int:
+    '''bytes each reading of the channels of a bitmask takes on the serial link'''
+    if binary:
+        return frame_size(mask)
+    return TEXT_CHANNEL * len(mask_channels(mask)) + TEXT_OVERHEAD
+
+
+def link_interval(mask: int, binary: bool, baudrate: int) -> float:
+    '''seconds each reading takes to be sent, at 10 bits per byte (8N1)'''
+    return reading_bytes(mask, binary) * 10 / baudrate
+
+
+def average_interval(samples: int) -> float:
+    '''seconds between new averages of a channel, the free running ADC converts the 6 channels in turns'''
+    return samples / ADC_BURST * 6 * (ADC_SETTLE + ADC_BURST) * ADC_CONVERSION
+
+
+def samples_for(interval: float, max_samples: int) -> int:
+    '''
+    most samples whose averages are still complete every interval seconds, at least 1.
+    only powers of two, so small changes of the interval don't restart the ADC every time
+    '''
+    n = min(max(math.floor(interval / average_interval(1)), 1), max_samples)
+    return 1 << (n.bit_length() - 1)
+
+
+
+class RateController():
+    '''
+    sink of a SerialReader that measures the rate readings arrive at, and if `adaptive`, tunes
+    the acquisition to the highest rate the serial link and the ADC sustain with `defput`.
+    when broadcasting, INTERVAL starts at the time each reading takes on the link, backs off when
+    readings arrive slower than asked, binary frames are lost, or readings arrive late (the host
+    fell behind), and creeps back 1 ms at a time while they don't, never to an interval that failed.
+    SAMPLES is the most whose averages are complete every interval, so fast readings aren't
+    repeats of the same average, and slow ones are as precise as they can be. when polling, the
+    rate is set by the round trips, and only SAMPLES follows it.
+    '''
+
+    # seconds between adjustments
+    period = 2
+
+    # fraction of the link the readings use at most, the rest is left for commands
+    headroom = 0.8
+
+    # fraction of the asked rate below which the readings aren't keeping up
+    tolerance = 0.9
+
+    # seconds a reading can arrive later than the earliest ones before it's late
+    late = 0.2
+
+    # factor the interval grows by when the rate isn't sustained
+    backoff = 1.25
+
+    # most samples averaged in each reading
+    max_samples = 64
+
+    def __init__(self, reader, mask: int, mode: str, adaptive=True):
+        self.reader = reader
+        self.mode = mode
+        self.adaptive = adaptive
+        self.lock = threading.Lock()
+
+        # fastest interval in ms, raised to beyond the ones that failed
+        if mode == "poll":
+            # a round trip carries the request and the reading
+            size = len(format_command("analog", f"0b{mask:06b}")) + 1 + reading_bytes(mask, False)
+            self.floor = math.ceil(1000 * size * 10 / reader.serial.baudrate)
+        else:
+            self.floor = max(1, math.ceil(1000 * link_interval(mask, mode == "binary", reader.serial.baudrate) / RateController.headroom))
+        self.interval = self.floor
+        self.samples = samples_for(self.interval / 1000, RateController.max_samples)
+        self.rate = None        # readings per second in the last period
+        self.settling = True    # whether the last period had old settings in it
+        self.last = time.time()
+        self.dropped = reader.dropped
+        self.baseline = math.inf    # least lateness of the readings since the settings changed
+
+        # counted by the reader thread
+        self.readings = 0
+        self.earliest = math.inf
+        self.latest = -math.inf
+
+
+    def start(self, interval: int) -> int:
+        '''sends the settings to start with, returns the interval to broadcast at (or interval if not adaptive)'''
+        if not self.adaptive:
+            self.interval = interval
+            return interval
+        self.reader.submit_batch([format_command("defput", "SAMPLES", self.samples)])
+        return self.interval
+
+
+    def write(self, times, refs: list, values):
+        lateness = time.time() - times[-1]
+        with self.lock:
+            self.readings += len(times)
+            self.earliest = min(self.earliest, lateness)
+            self.latest = max(self.latest, lateness)
+
+
+    def update(self) -> bool:
+        '''
+        measures the rate since the last update, and if adaptive, tunes the settings of the arduino.
+        returns whether they changed
+        '''
+        now = time.time()
+        with self.lock:
+            readings, earliest, latest = self.readings, self.earliest, self.latest
+            self.readings, self.earliest, self.latest = 0, math.inf, -math.inf
+        self.rate = readings / (now - self.last)
+        self.last = now
+        dropped = self.reader.dropped - self.dropped
+        self.dropped = self.reader.dropped
+        self.baseline = min(self.baseline, earliest)
+        late = latest > self.baseline + RateController.late
+
+        if not self.adaptive or self.settling:
+            self.settling = False
+            return False
+        if self.mode == "poll":
+            if not self.rate:
+                return False
+            return self.apply(self.interval, samples_for(1 / self.rate, RateController.max_samples))
+
+        interval = self.interval
+        if dropped or late or self.rate < RateController.tolerance * 1000 / self.interval:
+            self.floor = max(self.floor, self.interval + 1)
+            interval = math.ceil(self.interval * RateController.backoff)
+        elif self.interval > self.floor:
+            interval = self.interval - 1
+        return self.apply(interval, samples_for(interval / 1000, RateController.max_samples))
+
+
+    def apply(self, interval: int, samples: int) -> bool:
+        '''sends the settings that changed'''
+        commands = []
+        if interval != self.interval and self.mode != "poll":
+            commands.append(format_command("defput", "INTERVAL", interval))
+        if samples != self.samples:
+            commands.append(format_command("defput", "SAMPLES", samples))
+        self.interval, self.samples = interval, samples
+        if not commands:
+            return False
+        self.reader.submit_batch(commands)
+        self.settling = True
+        self.baseline = math.inf
+        return True
+
+
+    def describe(self) -> str:
+        '''the effective rate, and the settings if they're tuned'''
+        if self.rate is None:
+            return ""
+        text = f"{self.rate:.1f} readings/s"
+        if self.adaptive:
+            text += f" ({self.samples} samples)" if self.mode == "poll" else f" ({self.interval} ms, {self.samples} samples)"
+        return text
@@ -0,0 +1,183 @@
+import os
+import queue
+import struct
+import threading
+import time
+import numpy as np
+
+
+# binary recordings start with a header:
+#   magic, header size, number of channels, true voltage, start time (unix seconds),
+#   followed by the comma separated channel names, zero padded to a multiple of HEADER_SIZE.
+# then come fixed size records: time since the start (float64) and the voltage of every
+# channel (float32, NaN if the channel was not acquired), all little endian.
+# two int64 sidecar files go with it:
+#   <path>.seg  index of the first record of each line (each start of the acquisition)
+#   <path>.idx  the time step of the index in ms, then the index of the first record at or
+#               after each multiple of it, to find any time in the recording in constant time
+MAGIC = b'IADREC\x00\x01'
+HEADER_FORMAT = '<8sIHdd'
+HEADER_SIZE = 256
+INDEX_STEP = 1000
+
+
+def record_dtype(n_channels: int) -> np.dtype:
+    '''numpy type of a record of a binary recording'''
+    return np.dtype([('t', '<f8'), ('v', '<f4', (n_channels,))])
+
+
+def header_size(names: list) -> int:
+    '''size in bytes of the header of a binary recording of the given channels'''
+    length = struct.calcsize(HEADER_FORMAT) + len(','.join(names))
+    return -(-length // HEADER_SIZE) * HEADER_SIZE
+
+
+def write_header(file, names: list, true_voltage: float, start_time: float):
+    '''writes the header of a binary recording'''
+    size = header_size(names)
+    header = struct.pack(HEADER_FORMAT, MAGIC, size, len(names), true_voltage, start_time)
+    header += ','.join(names).encode('ascii')
+    file.write(header.ljust(size, b'\0'))
+
+
+def read_header(file) -> tuple:
+    '''
+    reads the header of a binary recording, returns (names, true voltage, start time).
+    the file is left at the first record
+    '''
+    header = file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError("not a recording")
+    magic, size, n_channels, true_voltage, start_time = struct.unpack_from(HEADER_FORMAT, header)
+    if magic != MAGIC or size < HEADER_SIZE or size % HEADER_SIZE:
+        raise ValueError("not a recording")
+    header += file.read(size - HEADER_SIZE)
+    if len(header) < size:
+        raise ValueError("not a recording")
+    names = header[struct.calcsize(HEADER_FORMAT):].rstrip(b'\0').decode('ascii').split(',')
+    return names[:n_channels], true_voltage, start_time
+
+
+class Recorder(threading.Thread):
+    '''
+    background thread that appends every reading given to `write` to a file, in binary ('bin')
+    or CSV ('csv') format. writes are buffered, and the file is flushed and synced to disk every
+    `sync_interval` seconds, so a crash loses at most that much data.
+    '''
+
+    formats = ['bin', 'csv']
+
+    # seconds between syncs to disk
+    sync_interval = 1.0
+
+    def __init__(self, path: str, fmt: str, names: list, true_voltage: float, start_time: float):
+        super().__init__(daemon=True)
+        if fmt not in Recorder.formats:
+            raise ValueError(f"unknown recording format '{fmt}'")
+        self.path = path
+        self.fmt = fmt
+        self.names = names
+        self.start_time = start_time
+        self.batches = queue.Queue()
+        self.dtype = record_dtype(len(names))
+
+        self.file = open(path, 'ab' if fmt == 'bin' else 'a', buffering=1 << 16)
+        if self.file.tell() == 0:
+            if fmt == 'bin':
+                write_header(self.file, names, true_voltage, start_time)
+            else:
+                self.file.write(f"# true_voltage={true_voltage} start_time={start_time}\n")
+                self.file.write(','.join(['t'] + names) + "\n")
+
+        if fmt == 'bin':
+            self.records = (self.file.tell() - header_size(names)) // self.dtype.itemsize
+            self.seg_file = open(path + '.seg', 'ab')
+            self.idx_file = open(path + '.idx', 'ab')
+            if self.idx_file.tell() == 0:
+                self.idx_file.write(np.int64(INDEX_STEP).tobytes())
+            self.next_step = (self.idx_file.tell() // 8) - 1     # next multiple of the step to index
+
+
+    def write(self, times: np.ndarray, refs: list, values: np.ndarray):
+        '''queues readings of the channels in refs at the given (unix) times (thread-safe)'''
+        self.batches.put(('samples', times, refs, values))
+
+
+    def new_line(self):
+        '''marks the start of a new line, the readings written after it belong to it (thread-safe)'''
+        self.batches.put(('line',))
+
+
+    def close(self):
+        '''writes every queued reading, closes the file and stops the thread'''
+        self.batches.put(('close',))
+        if self.is_alive():
+            self.join()
+
+
+    def run(self):
+        last_sync = time.time()
+        while True:
+            try:
+                kind, *args = self.batches.get(timeout=Recorder.sync_interval)
+            except queue.Empty:
+                kind = None
+
+            if kind == 'close':
+                break
+            elif kind == 'line':
+                self.mark_line()
+            elif kind == 'samples':
+                self.append(*args)
+
+            if time.time() - last_sync >= Recorder.sync_interval:
+                self.sync()
+                last_sync = time.time()
+
+        self.sync()
+        self.file.close()
+        if self.fmt == 'bin':
+            self.seg_file.close()
+            self.idx_file.close()
+
+
+    def mark_line(self):
+        '''records where a new line starts'''
+        if self.fmt == 'bin':
+            self.seg_file.write(np.int64(self.records).tobytes())
+        else:
+            self.file.write("# line\n")
+
+
+    def append(self, times: np.ndarray, refs: list, values: np.ndarray):
+        '''writes a batch of readings to the file buffer'''
+        records = np.empty(len(times), dtype=self.dtype)
+        records['t'] = times - self.start_time
+        records['v'] = np.nan
+        records['v'][:, refs] = values
+
+        if self.fmt == 'bin':
+            self.file.write(records.tobytes())
+
+            # index the first record after each multiple of the step reached by this batch
+            t = records['t']
+            last_step = int(t[-1] * 1000 // INDEX_STEP)
+            if last_step >= self.next_step:
+                steps = np.arange(self.next_step, last_step + 1) * INDEX_STEP / 1000
+                index = self.records + np.searchsorted(t, steps)
+                self.idx_file.write(index.astype('<i8').tobytes())
+                self.next_step = last_step + 1
+            self.records += len(records)
+        else:
+            rows = np.column_stack((records['t'], records['v']))
+            np.savetxt(self.file, rows, fmt='%.6f', delimiter=',')
+
+
+    def sync(self):
+        '''pushes everything written so far to the disk'''
+        files = [self.file]
+        if self.fmt == 'bin':
+            files += [self.seg_file, self.idx_file]
+        for file in files:
+            file.flush()
+            os.fsync(file.fileno())
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class RingBuffer():
+    '''
+    fixed capacity buffer of rows of floats, stored column by column in preallocated arrays.
+    rows are addressed by their absolute index (how many rows were appended before them),
+    and only the latest `capacity` rows are kept.
+    every row is written twice, `capacity` apart, so any range of kept rows is contiguous
+    and can be returned as a view without copying.
+    '''
+
+    def __init__(self, capacity: int, columns: int):
+        self.capacity = capacity
+        self.data = np.empty((columns, 2*capacity))
+        self.count = 0      # total rows ever appended
+
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+
+    @property
+    def first(self) -> int:
+        '''absolute index of the oldest row still kept'''
+        return max(self.count - self.capacity, 0)
+
+
+    def clear(self):
+        self.count = 0
+
+
+    def append(self, *columns):
+        '''appends rows given as one array (or scalar) per column'''
+        columns = np.broadcast_arrays(*[np.atleast_1d(c) for c in columns])
+        n = len(columns[0])
+        skip = max(n - self.capacity, 0)    # rows that would be overwritten right away
+        idx = (self.count + np.arange(skip, n)) % self.capacity
+        for col, values in zip(self.data, columns):
+            col[idx] = values[skip:]
+            col[idx + self.capacity] = values[skip:]
+        self.count += n
+
+
+    def view(self, start: int, stop: int) -> np.ndarray:
+        '''
+        returns a view of shape (columns, rows) of the rows between the absolute indices start and stop,
+        clipped to the rows still kept
+        '''
+        start = min(max(start, self.first), self.count)
+        stop = max(min(stop, self.count), start)
+        i = start % self.capacity
+        return self.data[:, i:i + stop - start]
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+from recorder import read_header, record_dtype
+
+
+class Session():
+    '''
+    read-only access to a binary recording made by a Recorder.
+    the records are memory mapped, so sessions of any size can be opened without reading them,
+    and only the parts that are accessed are loaded from the disk.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.names, self.true_voltage, self.start_time = read_header(file)
+            offset = file.tell()
+
+        # a record cut short by a crash is left out
+        dtype = record_dtype(len(self.names))
+        n = (os.path.getsize(path) - offset) // dtype.itemsize
+        self.records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(n,)) if n else np.empty(0, dtype=dtype)
+
+        # sidecar files are small (one entry per line and per index step)
+        self.segments = self.read_sidecar('.seg', [0])
+        index = self.read_sidecar('.idx', [1000])
+        self.step = index[0] / 1000
+        self.index = np.minimum(index[1:], n)
+
+
+    def read_sidecar(self, ext: str, default: list) -> np.ndarray:
+        if not os.path.exists(self.path + ext):
+            return np.array(default, dtype=np.int64)
+        return np.fromfile(self.path + ext, dtype='<i8')
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    @property
+    def duration(self) -> float:
+        return float(self.records['t'][-1]) if len(self.records) else 0.0
+
+
+    def seek(self, t: float) -> int:
+        '''
+        returns the index of the first record at or after time t.
+        the index narrows the search to the records of a single step, so it takes the same time
+        no matter the size of the session
+        '''
+        k = int(t // self.step)
+        if k < 0:
+            return 0
+        if k >= len(self.index):
+            # after the last indexed step, only the most recent records are left
+            start = self.index[-1] if len(self.index) else 0
+            end = len(self.records)
+        else:
+            start = self.index[k]
+            end = self.index[k+1] if k+1 < len(self.index) else len(self.records)
+        return int(start + np.searchsorted(self.records['t'][start:end], t))
+
+
+    def lines(self, start: int, stop: int) -> list:
+        '''splits the records between start and stop into (start, stop) pairs, one for each line'''
+        bounds = self.segments[(self.segments > start) & (self.segments < stop)]
+        edges = [start, *bounds.tolist(), stop]
+        return list(zip(edges[:-1], edges[1:]))
@@ -0,0 +1,48 @@
+class SettingsCache():
+    '''
+    copy of the settings of an arduino, kept from every line `defget` prints, by name
+    (TRUE_VOLTAGE, SAMPLES, ...) as the text of the value without its unit.
+    the arduino counts the changes of its settings in GENERATION, so the copy is only fetched
+    again with `defget()` when `defget(GENERATION)` tells it changed, instead of every time.
+    '''
+
+    # settings printed by `defget()`, in order
+    names = ["TRUE_VOLTAGE", "SAMPLES", "INTERVAL", "CHANNELS", "FILTER", "GENERATION"]
+
+    def __init__(self):
+        self.clear()
+
+
+    def clear(self):
+        '''forgets everything, such as when the arduino resets'''
+        self.values = {}
+        self.synced = None      # generation of the last time every setting was fetched
+
+
+    def update(self, text: str) -> bool:
+        '''takes the value of a setting from a line printed by `defget`, returns whether it changed'''
+        name, sep, value = text.partition(": ")
+        if not sep or name not in SettingsCache.names:
+            return False
+        if name != "FILTER":
+            value = value.split(' ')[0]
+        changed = self.values.get(name) != value
+        self.values[name] = value
+        return changed
+
+
+    def get(self, name: str, default=None) -> str:
+        return self.values.get(name, default)
+
+
+    @property
+    def generation(self):
+        '''GENERATION as last printed by the arduino, None if it never was'''
+        value = self.values.get("GENERATION")
+        return int(value) if value is not None else None
+
+
+    @property
+    def stale(self) -> bool:
+        '''whether the settings changed since they were last fetched'''
+        return self.synced is None or self.synced != self.generation
@@ -0,0 +1,653 @@
+'''
+software copy of the `analog_serial_rpi` arduino, to run the python side without a board.
+
+    python simulator.py [options]
+
+creates a pseudo terminal that behaves like the arduino serial port and prints its path,
+which can be given to window4.py or test.py instead of a real port. in python, a
+SimulatedSerial can also be used directly wherever a serial.Serial is expected.
+'''
+import argparse
+import json
+import math
+import os
+import re
+import threading
+import time
+import numpy as np
+from command_parser import BATCH_END, BATCH_NEXT, BATCH_SEPARATOR, INVALID, PARSE_EMPTY, PARSE_ERROR, parse_command
+from protocol import ADC_BURST, ADC_CONVERSION, ADC_SETTLE, FILTERS, encode_frame, mask_channels
+
+WELCOME = "INFO: type `help()` in a serial message to get information on all the commands"
+
+HELP = """Available commands:
+\t- help(): provides information on all the commands.
+\t- add(a, ...): adds from 1 to 3 numbers.
+\t- mult(a, b): multiplies 2 numbers.
+\t- err(): the error of any reading in V, according to the values of TRUE_VOLTAGE, SAMPLES and FILTER.
+\t- defget(...): prints the setting with the provided name (TRUE_VOLTAGE, SAMPLES, INTERVAL, BROADCAST_CHN, FILTER or GENERATION).
+\t\tIf no name is provided, print all the settings.
+\t- defput(name, val): sets the value of the setting with the provided name
+\t\t(TRUE_VOLTAGE, SAMPLES, INTERVAL or BROADCAST_CHN).
+\t- analog(...): prints the input channel voltages, the argument can be a single number
+\t\tfrom 0 to 5 or a bitmask like 0b001011 specifying multiple channels (LSB is A0),
+\t\tin which case the line ends with the millis() of the reading.
+\t\tThe ADC averages SAMPLES readings of every channel all the time, the latest averages are printed right away.
+\t\tIf no argument is provided and is broadcasting, immediately print the broadcast bitmask channels.
+\t- bstart(...): starts broadcasting with the broadcast parameters in the settings.
+\t\tWith the argument BIN, readings are sent as binary frames of raw ADC counts.
+\t- bstop(): stops broadcasting.
+\t- filter(type, alpha): sets the filter of the readings of each channel, NONE, EMA (exponential
+\t\tmoving average) or EMA2 (two in a row), with a smoothing factor alpha between 0 and 1.
+\t\tIf no argument is provided, print the filter.
+Several commands can be sent in one line as a batch, separated by ';' like `bstop();defget()`.
+\tThe answer of each one is followed by a line with ';', and the answer of the last one by a line with '.'.
+Available settings:
+\t- TRUE_VOLTAGE: the real voltage measured at the Arduino 5V pin.
+\t- SAMPLES: number of samples to take average of, to reduce noise.
+\t- INTERVAL: time in ms to wait between reading broadcasts.
+\t- CHANNELS: bitmask like 0b001011 specifying multiple analog ports to read when broadcasting
+\t- FILTER: filter of the readings and its smoothing factor, set with 'filter'.
+\t- GENERATION: how many times the settings changed, it can't be set."""
+
+# settings of a fresh EEPROM
+DEFAULT_SETTINGS = {
+    "trueVoltage": 5.0,
+    "samples": 16,
+    "interval": 100,
+    "channels": 0b111111,
+    "filterType": 0,
+    "filterAlpha": 1.0,
+}
+
+# waveforms on the analog inputs, as 'kind:frequency:amplitude:offset' (volts and Hz)
+DEFAULT_WAVEFORMS = [
+    "sine:1:2:2.5",
+    "square:0.5:2:2.5",
+    "triangle:0.2:2.5:2.5",
+    "saw:0.1:2.5:2.5",
+    "dc:0:0:3.3",
+    "dc:0:0:0",
+]
+
+
+def strtoul(s: str, base: int) -> int:
+    '''like C `strtoul`, converts the leading valid digits of s'''
+    digits = "0123456789"[:base]
+    n = 0
+    for ch in s:
+        if ch not in digits:
+            break
+        n = n*base + int(ch)
+    return n & 0xFFFFFFFF
+
+
+FLOAT = re.compile(r'[+-]?((\d+\.?\d*|\.\d+)([eE][+-]?\d+)?|inf(inity)?|nan)', re.IGNORECASE)
+
+def atof(s: str) -> float:
+    '''like C `atof`, converts the longest valid number at the start of s'''
+    match = FLOAT.match(s)
+    return float(match.group()) if match else 0.0
+
+
+def print_float(v: float, digits=2) -> str:
+    '''formats a float like `Serial.print(v, digits)`'''
+    if math.isnan(v):
+        return "nan"
+    if math.isinf(v):
+        return "inf"
+    if v == 0:
+        v = 0.0     # no minus sign on -0
+    return f"{v:.{digits}f}"
+
+
+def waveform(spec: str):
+    '''returns a function of time (s) with the voltage of the waveform described by spec'''
+    kind, freq, amp, offset = spec.split(':')
+    freq, amp, offset = float(freq), float(amp), float(offset)
+    shapes = {
+        "dc": lambda p: 0 * p,
+        "sine": lambda p: np.sin(2*np.pi*p),
+        "square": lambda p: np.where(p % 1 < 0.5, 1.0, -1.0),
+        "triangle": lambda p: 4*np.abs(p % 1 - 0.5) - 1,
+        "saw": lambda p: 2*(p % 1) - 1,
+    }
+    if kind not in shapes:
+        raise ValueError(f"unknown waveform '{kind}'")
+    return lambda t: offset + amp*shapes[kind](freq*np.asarray(t))
+
+
+class VirtualArduino(threading.Thread):
+    '''
+    thread that runs the `analog_serial_rpi` firmware logic.
+    bytes sent to it with `feed` are parsed as commands, and everything it prints is passed
+    to the `output` callable, after the time it would take to send at `baudrate`.
+    analog inputs follow the given waveforms plus gaussian noise of `noise` ADC counts, and are
+    converted all the time in turns, each conversion taking `conversion_time` seconds, like the
+    free running ADC of the firmware. readings return the last complete averages right away.
+    `latency` seconds are added before running each command.
+    the clock of `millis()` runs `drift` parts per million faster than the host clock, like a real crystal.
+    settings are kept in the JSON file `eeprom` if given, like in the EEPROM of the arduino,
+    and only written when they change, along with how many times they did.
+    '''
+
+    def __init__(self, output, waveforms=DEFAULT_WAVEFORMS, noise=0.5, eeprom=None,
+                 baudrate=38400, latency=0.0, conversion_time=ADC_CONVERSION, drift=0.0, seed=None):
+        super().__init__(daemon=True)
+        self.output = output
+        self.waveforms = [waveform(w) for w in waveforms]
+        self.noise = noise
+        self.eeprom = eeprom
+        self.baudrate = baudrate
+        self.latency = latency
+        self.conversion_time = conversion_time
+        self.drift = drift
+        self.rng = np.random.default_rng(seed)
+
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.generation = 0
+        if eeprom is not None and os.path.exists(eeprom):
+            with open(eeprom) as file:
+                stored = json.load(file)
+            self.generation = stored.pop("generation", 0)
+            self.settings.update(stored)
+
+        self.rx = b''
+        self.rx_lock = threading.Lock()
+        self.rx_event = threading.Event()
+        self.stopped = threading.Event()
+        self.reset()
+
+
+    def reset(self):
+        '''state right after the arduino boots'''
+        self.boot_time = time.time()
+        self.last_broadcast = None     # millis of the last broadcast, None if not broadcasting
+        self.binary = False
+        self.frame_seq = 0
+        self.partial = False           # whether a command was partially received
+        self.batching = False          # whether the last command ended with ';', so the next one is of its batch
+        self.filter_state = [None] * 6 # output of each filter stage of each channel and the average it last took, None until its first reading
+        self.adc_start()
+
+
+    def adc_start(self):
+        '''starts the ADC over, like `adcStart()` when the arduino boots or SAMPLES changes'''
+        self.adc_time = time.time() - self.boot_time     # seconds after booting it started
+        self.adc_samples = max(self.settings["samples"], 1)
+        self.adc_latest = [None] * 6   # (index, sum, millis halfway through) of the last average of each channel
+        self.read_time = 0             # millis halfway through the average returned by the last read_sum
+        self.read_index = None         # index of that average since the ADC started
+
+
+    def millis(self, t=None) -> int:
+        '''millis() at t seconds after booting, now if not given'''
+        if t is None:
+            t = time.time() - self.boot_time
+        return int(t * (1000 + self.drift * 1e-3)) & 0xFFFFFFFF
+
+
+    def feed(self, data: bytes):
+        '''receives bytes from the host (thread-safe)'''
+        with self.rx_lock:
+            self.rx += data
+        self.rx_event.set()
+
+
+    def stop(self):
+        self.stopped.set()
+        self.rx_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+
+    def write(self, data: bytes):
+        '''sends bytes to the host, taking as long as the serial port would'''
+        if self.baudrate:
+            time.sleep(len(data) * 10 / self.baudrate)
+        self.output(data)
+
+
+    def println(self, text=""):
+        self.write((text + "\r\n").encode('ascii'))
+
+
+    def run(self):
+        self.println(WELCOME)
+        while not self.stopped.is_set():
+            self.loop()
+
+
+    def loop(self):
+        '''one iteration of `loop()`'''
+        # check if supposed to broadcast analog readings periodically.
+        # the arduino doesn't get here while it waits for the rest of a command
+        if self.last_broadcast is not None and not self.partial and not self.batching:
+            now = self.millis()
+            if now >= self.last_broadcast + self.settings["interval"]:
+                if self.binary:
+                    self.frame()
+                else:
+                    # not analog(), it would take the arguments of the last command as its own
+                    self.print_channels(self.settings["channels"])
+                self.last_broadcast = now
+
+        # check if there's a new command to process
+        with self.rx_lock:
+            parsed = parse_command(self.rx)
+            if parsed is not None:
+                more = parsed[2] > 0 and self.rx[parsed[2] - 1] == ord(BATCH_SEPARATOR)
+                self.rx = self.rx[parsed[2]:]
+            self.rx_event.clear()
+        self.partial = parsed is None
+        if parsed is None or parsed[0] == PARSE_EMPTY:
+            # wait for bytes, or until the next broadcast is due
+            timeout = 0.1
+            if self.last_broadcast is not None and parsed is not None:
+                timeout = max(self.last_broadcast + self.settings["interval"] - self.millis(), 0) / 1000
+            self.rx_event.wait(timeout)
+            return
+
+        # the answer of each command of a batch is followed by a marker
+        batch = self.batching or more
+        self.batching = more
+
+        result, self.argv, _ = parsed
+        if result == PARSE_ERROR:
+            self.println(INVALID)
+        else:
+            self.run_command()
+
+        if batch:
+            self.println(BATCH_NEXT if more else BATCH_END)
+
+
+    def run_command(self):
+        time.sleep(self.latency)
+        commands = {
+            "help": self.help, "add": self.add, "mult": self.mult, "err": self.err,
+            "defget": self.defget, "defput": self.defput, "analog": self.analog,
+            "bstart": self.bstart, "bstop": self.bstop, "filter": self.filter,
+        }
+        if self.argv[0] in commands:
+            commands[self.argv[0]]()
+        else:
+            self.println(f"ERROR: command '{self.argv[0]}' not found")
+
+
+    def bad_arg_count(self, name: str, x: str):
+        self.println(f"ERROR: '{name}' expects {x} arguments")
+
+
+    def sample_times(self, pin: int, k: np.ndarray) -> np.ndarray:
+        '''seconds after booting the kept conversions number k of a pin end at'''
+        steps = ADC_SETTLE + ADC_BURST
+        conversion = k // ADC_BURST * 6*steps + pin*steps + ADC_SETTLE + k % ADC_BURST
+        return self.adc_time + (conversion + 1) * self.conversion_time
+
+
+    def read_sum(self, pin: int) -> int:
+        '''sum of the samples of the last complete average of a pin, sets read_time to the millis() halfway through it'''
+        if not 0 <= pin <= 5:
+            self.read_time = self.millis()
+            return 0
+        n, steps = self.adc_samples, ADC_SETTLE + ADC_BURST
+        turns, rest = divmod(time.time() - self.boot_time - self.adc_time, 6*steps * self.conversion_time)
+        kept = int(turns) * ADC_BURST + int(np.clip(rest // self.conversion_time - pin*steps - ADC_SETTLE, 0, ADC_BURST))
+        index = kept // n - 1
+        if index < 0:
+            # the first average isn't complete yet, wait for it
+            index = 0
+            time.sleep(max(self.sample_times(pin, n - 1) + self.boot_time - time.time(), 0))
+
+        if self.adc_latest[pin] is None or self.adc_latest[pin][0] != index:
+            t = self.sample_times(pin, np.arange(index * n, (index + 1) * n))
+            tv = self.settings["trueVoltage"]
+            counts = self.waveforms[pin](t) / tv * 1024 + self.rng.normal(0, self.noise, n)
+            first, last = self.millis(t[0]), self.millis(t[-1])
+            total = int(np.clip(np.floor(counts), 0, 1023).sum())
+            self.adc_latest[pin] = (index, total, (first + ((last - first) & 0xFFFFFFFF) // 2) & 0xFFFFFFFF)
+        self.read_index, total, self.read_time = self.adc_latest[pin]
+        return total
+
+
+    @staticmethod
+    def average_time(times: list) -> int:
+        '''average of millis() values close to each other, like the firmware takes it across wrapping'''
+        if not times:
+            return 0
+        offsets = [((t - times[0] + (1 << 31)) & 0xFFFFFFFF) - (1 << 31) for t in times]
+        return (times[0] + int(sum(offsets) / len(offsets))) & 0xFFFFFFFF
+
+
+    def filtered(self, pin: int) -> float:
+        '''sum of the samples of a pin through the filter of its channel'''
+        x = float(self.read_sum(pin))
+        kind, a = FILTERS[self.settings["filterType"]], self.settings["filterAlpha"]
+        if kind == "NONE" or not 0 <= pin <= 5:
+            return x
+        state = self.filter_state[pin] or [x, x, None]
+        if state[2] != self.read_index:
+            # only new averages step the filter, a reading repeating the last one leaves it where it is
+            state[0] += a * (x - state[0])
+            state[1] += a * (state[0] - state[1])
+            state[2] = self.read_index
+        self.filter_state[pin] = state
+        return state[0] if kind == "EMA" else state[1]
+
+
+    def filter_gain(self) -> float:
+        '''how much the filter reduces the noise of the readings'''
+        kind, a = FILTERS[self.settings["filterType"]], self.settings["filterAlpha"]
+        q = (1 - a)**2
+        if kind == "EMA":
+            return math.sqrt(a / (2 - a))
+        if kind == "EMA2":
+            return math.sqrt(a**4 * (1 + q) / (1 - q)**3)
+        return 1.0
+
+
+    def voltage(self, pin: int) -> float:
+        n = self.settings["samples"]
+        total = (self.filtered(pin) + 0.5) * self.settings["trueVoltage"]
+        return total / (n * 1024.0) if n else math.inf
+
+
+    def counts(self, pin: int) -> int:
+        n = self.settings["samples"]
+        return int((self.filtered(pin) + n//2) / n) if n else 1023
+
+
+    def frame(self):
+        mask = self.settings["channels"]
+        counts, times = [], []
+        for i in mask_channels(mask):
+            counts.append(self.counts(i))
+            times.append(self.read_time)
+        t = self.average_time(times)
+        self.write(encode_frame(self.frame_seq, t, counts, mask))
+        self.frame_seq = (self.frame_seq + 1) & 0xFF
+
+
+    # COMMANDS
+
+    def help(self):
+        for line in HELP.split("\n"):
+            self.println(line)
+
+
+    def add(self):
+        if len(self.argv) == 1:
+            return self.bad_arg_count("add", "1 or more")
+        self.println(print_float(sum(atof(a) for a in self.argv[1:]), 6))
+
+
+    def mult(self):
+        if len(self.argv) != 3:
+            return self.bad_arg_count("mult", "2")
+        self.println(print_float(atof(self.argv[1]) * atof(self.argv[2]), 6))
+
+
+    def err(self):
+        if len(self.argv) > 1:
+            return self.bad_arg_count("err", "no")
+        s = self.settings
+        self.println("+- " + print_float(s["trueVoltage"]/(1024.0*math.sqrt(max(s["samples"], 4))) * self.filter_gain(), 8) + " V")
+
+
+    def defget(self):
+        argv = self.argv
+        if len(argv) > 2:
+            return self.bad_arg_count("defget", "0 or 1")
+        s = self.settings
+        if len(argv) == 1 or argv[1] == "TRUE_VOLTAGE":
+            self.println("TRUE_VOLTAGE: " + print_float(s["trueVoltage"]) + " V")
+        if len(argv) == 1 or argv[1] == "SAMPLES":
+            self.println(f"SAMPLES: {s['samples']}")
+        if len(argv) == 1 or argv[1] == "INTERVAL":
+            self.println(f"INTERVAL: {s['interval']} ms")
+        if len(argv) == 1 or argv[1] == "CHANNELS":
+            self.println(f"CHANNELS: 0b{s['channels'] & 0b111111:06b}")
+        if len(argv) == 1 or argv[1] == "FILTER":
+            self.print_filter()
+        if len(argv) == 1 or argv[1] == "GENERATION":
+            self.println(f"GENERATION: {self.generation}")
+
+
+    def print_filter(self):
+        s = self.settings
+        self.println(f"FILTER: {FILTERS[s['filterType']]} " + print_float(s["filterAlpha"], 4))
+
+
+    def defput(self):
+        argv = self.argv
+        if len(argv) != 3:
+            return self.bad_arg_count("defput", "2")
+        s = dict(self.settings)
+        if argv[1] == "TRUE_VOLTAGE":
+            s["trueVoltage"] = atof(argv[2])
+        elif argv[1] == "SAMPLES":
+            s["samples"] = strtoul(argv[2], 10)
+        elif argv[1] == "INTERVAL":
+            s["interval"] = strtoul(argv[2], 10)
+        elif argv[1] == "CHANNELS":
+            if argv[2][:2] != "0b":
+                return self.println("ERROR: incorrectly formatted bitmask")
+            s["channels"] = strtoul(argv[2][2:], 2)
+        else:
+            return self.println(f"ERROR: 'defput' field '{argv[1]}' not found")
+
+        if self.save(s) and argv[1] == "SAMPLES":
+            # averages of the old size are thrown away
+            self.adc_start()
+            self.filter_state = [None] * 6
+        self.println("OK")
+
+
+    def save(self, updated: dict) -> bool:
+        '''replaces the settings, writing them only if they changed, and returns whether they did'''
+        if updated == self.settings:
+            return False
+        self.settings = updated
+        self.generation += 1
+        if self.eeprom is not None:
+            with open(self.eeprom, 'w') as file:
+                json.dump({**self.settings, "generation": self.generation}, file)
+        return True
+
+
+    def filter(self):
+        argv = self.argv
+        if len(argv) > 3:
+            return self.bad_arg_count("filter", "0 to 2")
+        s = self.settings
+        if len(argv) == 1:
+            return self.print_filter()
+        if argv[1] not in FILTERS:
+            return self.println(f"ERROR: 'filter' type '{argv[1]}' not found")
+        alpha = atof(argv[2]) if len(argv) == 3 else s["filterAlpha"]
+        if not 0 < alpha <= 1:
+            return self.println("ERROR: 'filter' alpha must be above 0 and at most 1")
+
+        self.save({**s, "filterType": FILTERS.index(argv[1]), "filterAlpha": alpha})
+        self.filter_state = [None] * 6
+        self.println("OK")
+
+
+    def analog(self):
+        argv = self.argv
+        if len(argv) > 2:
+            return self.bad_arg_count("analog", "0 or 1")
+
+        mask = 0
+        if len(argv) == 2:
+            if argv[1][:2] == "0b":
+                mask = strtoul(argv[1][2:], 2)
+            else:
+                self.println(print_float(self.voltage(int(atof(argv[1]))), 4))
+        elif self.last_broadcast is not None:
+            mask = self.settings["channels"]
+        else:
+            self.println("ERROR: no bitmask set to print periodically; use 'anstart'")
+
+        if mask:
+            self.print_channels(mask)
+
+
+    def print_channels(self, mask: int):
+        '''port of `printChannels()`: prints the voltages of the channels of a bitmask, and the millis() of the reading'''
+        v, times = {}, []
+        for i in range(5, -1, -1):
+            if mask & (1 << i):
+                v[i] = self.voltage(i)
+                times.append(self.read_time)
+        t = self.average_time(times)
+        self.println("".join(print_float(v[i], 4) + "," for i in v) + str(t))
+
+
+    def bstart(self):
+        argv = self.argv
+        if len(argv) > 2:
+            return self.bad_arg_count("bstart", "0 or 1")
+        if len(argv) == 2 and argv[1] != "BIN":
+            return self.println(f"ERROR: 'bstart' mode '{argv[1]}' not found")
+        self.binary = len(argv) == 2
+        self.filter_state = [None] * 6
+        self.last_broadcast = self.millis()
+        self.println("OK")
+
+
+    def bstop(self):
+        if len(self.argv) > 1:
+            return self.bad_arg_count("bstop", "no")
+        self.last_broadcast = None
+        self.println("OK")
+
+
+
+class SimulatedSerial():
+    '''
+    drop-in replacement for serial.Serial connected to a VirtualArduino.
+    opening the port boots the simulated arduino, like the reset of a real one.
+    keyword arguments other than the serial ones are passed to the VirtualArduino.
+    '''
+
+    def __init__(self, port="sim://", baudrate=38400, timeout=None, **options):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.options = options
+        self.device = None
+        self.buffer = b''
+        self.cond = threading.Condition()
+        if port is not None:
+            self.open()
+
+
+    @property
+    def is_open(self) -> bool:
+        return self.device is not None
+
+
+    def open(self):
+        self.buffer = b''
+        self.device = VirtualArduino(self.receive, baudrate=self.baudrate, **self.options)
+        self.device.start()
+
+
+    def close(self):
+        if self.device is not None:
+            self.device.stop()
+            self.device = None
+
+
+    def receive(self, data: bytes):
+        with self.cond:
+            self.buffer += data
+            self.cond.notify_all()
+
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.buffer)
+
+
+    def write(self, data: bytes) -> int:
+        self.device.feed(bytes(data))
+        return len(data)
+
+
+    def read(self, size=1) -> bytes:
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.buffer) >= size, self.timeout)
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+    def read_until(self, expected=b'\n') -> bytes:
+        with self.cond:
+            self.cond.wait_for(lambda: expected in self.buffer, self.timeout)
+            end = self.buffer.find(expected)
+            end = len(self.buffer) if end < 0 else end + len(expected)
+            data, self.buffer = self.buffer[:end], self.buffer[end:]
+        return data
+
+
+    def readline(self) -> bytes:
+        return self.read_until(b'\n')
+
+
+    def read_all(self) -> bytes:
+        with self.cond:
+            data, self.buffer = self.buffer, b''
+        return data
+
+
+    def reset_input_buffer(self):
+        self.read_all()
+
+
+
+def serve_pty(link=None, **options):
+    '''runs a VirtualArduino behind a pseudo terminal until interrupted'''
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    if link is not None:
+        if os.path.islink(link):
+            os.remove(link)
+        os.symlink(path, link)
+        path = link
+    print(f"simulated arduino on {path}", flush=True)
+
+    device = VirtualArduino(lambda data: os.write(master, data), **options)
+    device.start()
+    try:
+        while True:
+            device.feed(os.read(master, 1024))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.stop()
+        if link is not None:
+            os.remove(link)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="simulated analog_serial_rpi arduino behind a pseudo terminal")
+    parser.add_argument("--link", help="also make the port available at this path (symbolic link)")
+    parser.add_argument("--baud", type=int, default=38400, help="emulated baud rate, 0 for no limit")
+    parser.add_argument("--latency", type=float, default=0.0, help="extra seconds before each command runs")
+    parser.add_argument("--conversion-time", type=float, default=ADC_CONVERSION, help="seconds taken by each ADC conversion")
+    parser.add_argument("--drift", type=float, default=0.0, help="parts per million the arduino clock runs fast")
+    parser.add_argument("--noise", type=float, default=0.5, help="standard deviation of the noise, in ADC counts")
+    parser.add_argument("--eeprom", help="JSON file where the settings persist")
+    parser.add_argument("--wave", action="append", metavar="kind:freq:amp:offset",
+                        help="waveform of the next analog input (sine, square, triangle, saw or dc), A0 first")
+    args = parser.parse_args()
+
+    waves = (args.wave or []) + DEFAULT_WAVEFORMS[len(args.wave or []):]
+    serve_pty(args.link, waveforms=waves, noise=args.noise, eeprom=args.eeprom,
+              baudrate=args.baud, latency=args.latency, conversion_time=args.conversion_time, drift=args.drift)
@@ -0,0 +1,171 @@
+import collections
+import queue
+import threading
+import time
+import numpy as np
+
+
+class Spectrum():
+    '''
+    power spectral density of the readings of a channel, with Welch's method, updated as they arrive.
+    readings are resampled on a uniform grid by linear interpolation, at the rate estimated from the
+    first ones, since polled readings don't arrive at regular intervals. every `segment` resampled
+    readings, half overlapping the previous ones, have their periodogram (Hann window, mean removed)
+    added to a running sum of the last `segments`, so a reading is only ever transformed twice.
+    a gap of several sampling intervals (a new line, or a device that stopped) starts over.
+    '''
+
+    # resampled readings in each periodogram, the frequency resolution is the rate divided by this
+    segment = 256
+
+    # periodograms averaged, the most recent `segment * (segments + 1) / 2` readings
+    segments = 16
+
+    # readings the sampling rate is estimated from
+    rate_readings = 16
+
+    # intervals between readings that make a gap
+    gap = 10
+
+    def __init__(self):
+        self.window = np.hanning(Spectrum.segment + 1)[:-1]    # periodic, like scipy.signal.welch
+        self.reset()
+
+
+    def reset(self):
+        self.rate = None            # Hz of the uniform grid
+        self.first = []             # (times, values) of the readings until the rate is known
+        self.last = None            # (time, value) of the last reading, the next batch starts from it
+        self.next = None            # time of the next point of the grid
+        self.pending = np.empty(0)  # resampled readings waiting for a complete segment
+        self.periodograms = collections.deque()
+        self.total = None           # sum of the periodograms
+
+
+    def extend(self, times: np.ndarray, values: np.ndarray):
+        '''adds readings to the channel'''
+        times, values = np.asarray(times, dtype=float), np.asarray(values, dtype=float)
+        if self.rate is None:
+            self.first.append((times, values))
+            times, values = np.concatenate([f[0] for f in self.first]), np.concatenate([f[1] for f in self.first])
+            if len(times) < Spectrum.rate_readings:
+                return
+            self.first = []
+            # readings repeated at the same time (asked for before the next average) aren't steps
+            d = np.diff(times)
+            dt = np.median(d[d > 0]) if np.any(d > 0) else 0
+            if not dt > 0:
+                return self.reset()
+            self.rate = 1 / dt
+            self.last = (times[0], values[0])
+            self.next = times[0]
+
+        # a gap splits the batch, everything before it is forgotten
+        t0, v0 = self.last
+        steps = np.diff(times, prepend=t0)
+        gaps = np.flatnonzero(steps > Spectrum.gap / self.rate)
+        if len(gaps):
+            self.reset()
+            return self.extend(times[gaps[-1]:], values[gaps[-1]:])
+
+        grid = np.arange(self.next, times[-1], 1 / self.rate)
+        if len(grid):
+            self.next = grid[-1] + 1 / self.rate
+            resampled = np.interp(grid, np.concatenate(([t0], times)), np.concatenate(([v0], values)))
+            self.pending = np.concatenate((self.pending, resampled))
+        self.last = (times[-1], values[-1])
+
+        hop = Spectrum.segment // 2
+        while len(self.pending) >= Spectrum.segment:
+            x = self.pending[:Spectrum.segment]
+            self.pending = self.pending[hop:]
+            p = np.abs(np.fft.rfft((x - x.mean()) * self.window))**2
+            self.periodograms.append(p)
+            self.total = p if self.total is None else self.total + p
+            if len(self.periodograms) > Spectrum.segments:
+                self.total = self.total - self.periodograms.popleft()
+
+
+    def psd(self) -> tuple:
+        '''(frequencies in Hz, one sided power spectral density in V²/Hz), None until a segment is complete'''
+        if self.total is None:
+            return None
+        p = self.total / (len(self.periodograms) * self.rate * np.sum(self.window**2))
+        p[1:-1] *= 2    # the negative frequencies
+        return np.fft.rfftfreq(Spectrum.segment, 1 / self.rate), p
+
+
+
+class SpectrumWorker(threading.Thread):
+    '''
+    background thread that keeps the Spectrum of the channels whose readings it's given, and
+    `rate` times per second publishes those that changed, to be picked up with `latest`.
+    channels are identified by any hashable key.
+    '''
+
+    def __init__(self, rate: float):
+        super().__init__(daemon=True)
+        self.interval = 1 / rate
+        self.requests = queue.Queue()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.results = {}   # key -> (frequencies, psd), replaced as a whole when published
+
+        # only touched by this thread after start
+        self.spectra = {}
+        self.changed = set()
+
+
+    def feed(self, key, times: np.ndarray, values: np.ndarray):
+        '''adds readings of a channel (thread-safe)'''
+        self.requests.put(('samples', key, (np.array(times, dtype=float), np.array(values, dtype=float))))
+
+
+    def reset(self):
+        '''forgets every channel (thread-safe)'''
+        self.requests.put(('reset', None, None))
+
+
+    def latest(self) -> dict:
+        '''the last published spectra, by key'''
+        with self.lock:
+            return self.results
+
+
+    def stop(self):
+        '''stops the thread and waits for it to finish'''
+        self.stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+
+    def run(self):
+        deadline = time.time() + self.interval
+        while not self.stopped.is_set():
+            try:
+                kind, key, arg = self.requests.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                pass
+            else:
+                if kind == 'samples':
+                    self.spectra.setdefault(key, Spectrum()).extend(*arg)
+                    self.changed.add(key)
+                elif kind == 'reset':
+                    self.spectra.clear()
+                    self.changed.clear()
+                    with self.lock:
+                        self.results = {}
+
+            if time.time() < deadline:
+                continue
+            deadline = max(deadline + self.interval, time.time())
+            if not self.changed:
+                continue
+            results = dict(self.results)
+            for key in self.changed:
+                psd = self.spectra[key].psd()
+                if psd is not None:
+                    results[key] = psd
+            self.changed.clear()
+            with self.lock:
+                self.results = results
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class RunningStats():
+    '''
+    statistics of the readings of a channel over the last `window` seconds, updated as they arrive.
+    readings are summarized in blocks of `window / blocks` seconds by their count, mean, sum of
+    squared deviations (merged with Chan's parallel form of Welford's algorithm, so no precision is
+    lost to cancellation), min and max. each batch only touches the blocks it falls in, and the
+    statistics combine the blocks of the window, so nothing is ever computed again from the readings.
+    the window is rounded up to whole blocks.
+
+    besides the spread of the readings, which includes the signal itself, the noise is estimated
+    from the differences of successive readings of a line, where slow signals cancel out. filtered
+    readings are correlated, so `correlation` must be set to the correlation of successive outputs
+    of the filter (FilterChain.correlation) for the estimate to be the noise of the readings.
+    '''
+
+    # blocks the window is divided in
+    blocks = 50
+
+    def __init__(self, window: float):
+        self.window = window
+        self.block = window / RunningStats.blocks
+        self.correlation = 0.0
+        self.clear()
+
+
+    def clear(self):
+        slots = RunningStats.blocks + 1
+        self.ids = np.full(slots, np.iinfo(np.int64).min)  # block in each slot
+        self.n = np.zeros(slots)
+        self.mean = np.zeros(slots)
+        self.m2 = np.zeros(slots)       # sum of squared deviations from the mean
+        self.min = np.full(slots, np.inf)
+        self.max = np.full(slots, -np.inf)
+        self.diffs = np.zeros(slots)    # differences of successive readings
+        self.d2 = np.zeros(slots)       # sum of their squares
+        self.newest = None              # newest block
+        self.last = None                # (time, value) of the last reading of the current line
+
+
+    def new_line(self):
+        '''the next reading doesn't follow the last one'''
+        self.last = None
+
+
+    def extend(self, times: np.ndarray, values: np.ndarray):
+        '''adds readings to the current line'''
+        times, values = np.broadcast_arrays(np.asarray(times, dtype=float), np.asarray(values, dtype=float))
+        # a reading at the time of the one before repeats it (asked for before the next average was
+        # complete), its difference of 0 isn't noise
+        new = np.diff(times, prepend=np.nan if self.last is None else self.last[0]) != 0
+        times, values = times[new], values[new]
+        if not len(values):
+            return
+        d = np.diff(values, prepend=values[0] if self.last is None else self.last[1])
+        has_diff = np.ones(len(values), dtype=bool)
+        has_diff[0] = self.last is not None
+        self.last = (times[-1], values[-1])
+
+        ids = np.floor(times / self.block).astype(np.int64)
+        self.newest = ids.max() if self.newest is None else max(self.newest, ids.max())
+        # readings already out of the window would take the slots of newer blocks
+        order = np.flatnonzero(ids > self.newest - len(self.ids))
+        order = order[np.argsort(ids[order], kind='stable')]
+        ids, values, d, has_diff = ids[order], values[order], d[order], has_diff[order]
+        if not len(ids):
+            return
+        blocks, starts = np.unique(ids, return_index=True)
+
+        # summary of the batch in each of its blocks
+        n = np.diff(np.append(starts, len(values))).astype(float)
+        mean = np.add.reduceat(values, starts) / n
+        m2 = np.add.reduceat((values - np.repeat(mean, n.astype(int)))**2, starts)
+        lo = np.minimum.reduceat(values, starts)
+        hi = np.maximum.reduceat(values, starts)
+        diffs = np.add.reduceat(has_diff.astype(float), starts)
+        d2 = np.add.reduceat(np.where(has_diff, d, 0)**2, starts)
+
+        # blocks that are new replace the expired ones in their slot
+        slots = blocks % len(self.ids)
+        stale = self.ids[slots] != blocks
+        s = slots[stale]
+        self.ids[s] = blocks[stale]
+        self.n[s] = self.mean[s] = self.m2[s] = self.diffs[s] = self.d2[s] = 0
+        self.min[s], self.max[s] = np.inf, -np.inf
+
+        # merge with what the blocks already had
+        total = self.n[slots] + n
+        delta = mean - self.mean[slots]
+        self.m2[slots] += m2 + delta**2 * self.n[slots] * n / total
+        self.mean[slots] += delta * n / total
+        self.n[slots] = total
+        self.min[slots] = np.minimum(self.min[slots], lo)
+        self.max[slots] = np.maximum(self.max[slots], hi)
+        self.diffs[slots] += diffs
+        self.d2[slots] += d2
+
+
+    def summary(self) -> dict:
+        '''statistics of the readings in the window, None if there are none'''
+        if self.newest is None:
+            return None
+        valid = (self.ids > self.newest - len(self.ids)) & (self.n > 0)
+        n, mean, m2 = self.n[valid], self.mean[valid], self.m2[valid]
+        if not len(n):
+            return None
+
+        count = n.sum()
+        total_mean = np.sum(n * mean) / count
+        total_m2 = np.sum(m2) + np.sum(n * (mean - total_mean)**2)
+        diffs = self.diffs[valid].sum()
+        # successive differences of uncorrelated noise have twice its variance, and less if it's correlated
+        noise = np.sqrt(self.d2[valid].sum() / (2 * diffs * (1 - self.correlation))) if diffs else np.nan
+        return {
+            "count": int(count),
+            "mean": total_mean,
+            "rms": np.sqrt(total_mean**2 + total_m2 / count),
+            "min": self.min[valid].min(),
+            "max": self.max[valid].max(),
+            "std": np.sqrt(total_m2 / (count - 1)) if count > 1 else np.nan,
+            "noise": noise,
+        }
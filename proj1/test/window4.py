@@ -1,12 +1,25 @@
 import sys
+import queue
 import serial
 import serial.tools.list_ports
+import threading
 import time
 from enum import Enum
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QCheckBox, QLineEdit, QMessageBox, QComboBox, QLabel, QSpacerItem, QSizePolicy
-from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QCheckBox, QLineEdit, QMessageBox, QComboBox, QLabel, QSpacerItem, QSizePolicy, QSpinBox, QDoubleSpinBox, QSlider, QFileDialog, QTableWidget, QTableWidgetItem
+from PyQt5.QtCore import QTimer, Qt
 from PyQt5.QtGui import QColor
 import pyqtgraph as pg
+import numpy as np
+from acquisition import SerialReader
+from portwatch import PortWatcher
+from protocol import FILTERS, Response, format_command
+from ratecontrol import RateController
+from ringbuffer import RingBuffer
+from decimate import MinMaxPyramid
+from recorder import Recorder
+from session import Session
+from stats import RunningStats
+from spectrum import SpectrumWorker
 
 
 class AcquisitionState(Enum):
@@ -17,7 +30,7 @@ class AcquisitionState(Enum):
 
     RUNNING = 2         # data is being recorded. start button should be disabled
                         #  -> STOPPED if user stops acquisition through the stop button
-                        #  -> HALTED if the arduino is disconnected 
+                        #  -> HALTED if every arduino acquiring is disconnected
 
     HALTED = 3          # data stopped being recorded without user instruction.
                         # start button should be disabled
@@ -25,19 +38,27 @@ class AcquisitionState(Enum):
                         #  -> STOPPED if user stops acquisition through the stop button
                         #  -> RUNNING if data can be read again
 
-    CLEARED = 4         # no data is present
+    CLEARED = 4         # no data is present. devices can be added or removed
                         #  -> RUNNING if the user starts aquisition through the start button
+                        #  -> REPLAY if the user opens a recording
+
+    REPLAY = 5          # data of a recording is being shown. start button should be disabled
+                        #  -> CLEARED if the user clears data through the clear button
 
 
 class SerialState(Enum):
-    '''state of the serial communication. the value of each state is the associated color'''
+    '''state of the serial communication of a device. the value of each state is the associated color'''
     NONE = 'lightgray'          # initial state of the program
                                 #  -> DISCONNECTED if any port is found, and set current port to it.
 
     DISCONNECTED = '#f59b2c'    # current serial port is not in the list or otherwise needs to be reconnected
+                                #  -> CONNECTING if the port is in the list, and start opening it in the background
+
+    CONNECTING = '#f5e02c'      # the reader thread is opening the port
                                 #  -> OK if connection to arduino was successful, and enable start button.
-                                #     if serial state is HALTED, set it to RUNNING
+                                #     if the device was halted, start acquiring again
                                 #  -> ERROR if connection to arduino was not successful
+                                #  -> DISCONNECTED if current serial port is not in the list
 
     OK = '#20a845'              # connection successful
                                 #  -> DISCONNECTED if current serial port is not in the list. disable start button
@@ -51,33 +72,402 @@ class SerialState(Enum):
 
 class Channel():
     '''Interface for a single analog channel data and its plot'''
-    def __init__(self, graph, color):
+
+    # how many readings of each channel are kept in memory
+    capacity = 1 << 16
+
+    def __init__(self, graph, color, name=""):
         self.color = color
         self.graph = graph
-        self.x_datas = []
-        self.y_datas = []
+        self.name = name
+        self.buffer = RingBuffer(Channel.capacity, 2)   # (time, voltage) of the readings
+        self.pyramid = MinMaxPyramid(Channel.capacity // MinMaxPyramid.factor)  # for long time ranges
+        self.stats = RunningStats(AcquisitionApp.time_range)    # of the readings in the time range
+        self.starts = []    # index of the first reading of each line in the buffer
         self.lines = []
-    
+        self.dirty = False  # whether there are readings that were not plotted yet
+
     def clear(self):
-        for i in range(len(self.x_datas)):
-            self.x_datas[i].clear()
-            self.y_datas[i].clear()
-            self.lines[i].clear()
-        self.x_datas.clear()
-        self.y_datas.clear()
+        for line in self.lines:
+            line.clear()
+        self.buffer.clear()
+        self.pyramid.clear()
+        self.stats.clear()
+        self.starts.clear()
         self.lines.clear()
+        self.dirty = False
 
     def new_line(self):
-        self.x_datas.append([])
-        self.y_datas.append([])
+        self.starts.append(self.buffer.count)
+        self.pyramid.new_line()
+        self.stats.new_line()
         self.lines.append(self.graph.plot(pen=self.color))
 
+    def extend(self, times, values):
+        '''appends readings to the current line, they are plotted on the next update'''
+        self.buffer.append(times, values)
+        self.pyramid.extend(times, values)
+        self.stats.extend(times, values)
+        self.dirty = True
+
     def __iadd__(self, obj):
-        self.x_datas[-1].append(obj[0])
-        self.y_datas[-1].append(obj[1])
-        self.lines[-1].setData(self.x_datas[-1], self.y_datas[-1])
+        self.extend(obj[0], obj[1])
         return self
 
+    def update(self, x_min: float, x_max: float, pixels: int):
+        '''
+        sets the data of each line to its readings between x_min and x_max.
+        if there are more readings than about 2 per pixel, a (min, max) pair of the finest level
+        of the pyramid with at most one entry per pixel is drawn instead, so peaks remain visible
+        '''
+        times = self.buffer.view(0, self.buffer.count)[0]
+        first = self.buffer.first + np.searchsorted(times, x_min)
+        last = self.buffer.first + np.searchsorted(times, x_max, side='right')
+        ends = self.starts[1:] + [self.buffer.count]
+        for i, (line, start, end) in enumerate(zip(self.lines, self.starts, ends)):
+            a, b = max(start, first), min(end, last)
+            if b - a <= 2*pixels and (a > self.buffer.first or start >= self.buffer.first):
+                # few enough readings, and none of them were dropped from the buffer
+                t, v = self.buffer.view(a, b)
+                line.setData(t, v)
+                continue
+
+            found = self.pyramid.line(i, x_min, x_max, pixels)
+            if found is None:
+                line.setData([], [])
+            else:
+                _, t, lo, hi = found
+                line.setData(np.repeat(t, 2), np.column_stack((lo, hi)).ravel())
+        self.dirty = False
+
+
+
+class Device():
+    '''
+    Interface for a single arduino: its serial port, the thread reading it, its widgets and its channels.
+    each device has its own reader thread and events queue, so they acquire in parallel, and readings
+    of every device are timestamped with the same host clock, so they line up on the graph
+    '''
+
+    # how many analog channels each arduino has
+    channel_count = 6
+
+    # line styles that tell apart the channels of each device on the graph
+    styles = [Qt.SolidLine, Qt.DashLine, Qt.DotLine, Qt.DashDotLine]
+
+    def __init__(self, app, index: int):
+        self.app = app
+        self.index = index
+        self.name = f"dev{index+1}"
+
+        # serial state. the port is only read and written by the reader thread,
+        # which reports back through the events queue of the device
+        self.serial = serial.Serial(None, 38400, timeout=1)
+        self.reader = None
+        self.events = queue.Queue()
+        self.serial_state = SerialState.NONE
+        self.mode = AcquisitionApp.modes[0]
+        self.filter = ("NONE", 1.0, False)  # (type, alpha, whether the arduino applies it)
+        self.running = False        # whether the device is acquiring
+        self.halted = False         # whether it stopped acquiring because it was disconnected
+        self.true_voltage = 5.0
+        self.error = None           # theoretical error of the readings in V, from `err()`
+        self.error_gain = 1         # noise gain of the filter applied by the reader, left out of `err()`
+        self.rate = None            # RateController of the acquisition, while it runs
+
+        # written from the reader thread, the readings of the device start at column `index*channel_count`
+        self.recorder = None
+
+        # horizontal layout with serial information
+        self.widget = QWidget()
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.serial_widget = QWidget()
+        self.serial_widget.setObjectName("serial_widget")
+        self.serial_layout = QHBoxLayout()
+        self.serial_layout.addWidget(QLabel(f"{self.name} serial port:"))
+        self.ports_combobox = QComboBox()
+        self.ports_combobox.activated.connect(self.on_port_select)
+        self.serial_layout.addWidget(self.ports_combobox)
+        self.serial_layout.addStretch(1)
+        self.rate_label = QLabel()
+        self.serial_layout.addWidget(self.rate_label)
+        self.status_label = QLabel()
+        self.serial_layout.addWidget(self.status_label)
+        self.serial_widget.setLayout(self.serial_layout)
+        layout.addWidget(self.serial_widget)
+
+        # horizontal layout for the analog channel checkboxes, and the channels themselves
+        self.button_layout = QHBoxLayout()
+        self.checkboxes = []
+        self.channels = []
+        style = Device.styles[index % len(Device.styles)]
+        for i in range(Device.channel_count):
+            color = pg.intColor(i, Device.channel_count)
+            h, _, v, _ = color.getHsv()
+            checkbox = QCheckBox(f"A{i}")
+            checkbox.setStyleSheet(f"QCheckBox {{ background-color : {QColor.fromHsv(h, 128, v).name()}; }}")
+            checkbox.setChecked(AcquisitionApp.checkboxes_default[i])
+            self.button_layout.addWidget(checkbox)
+            self.checkboxes.append(checkbox)
+            self.channels.append(Channel(app.graph, pg.mkPen(color, style=style), f"{self.name}:A{i}"))
+        layout.addLayout(self.button_layout)
+        self.widget.setLayout(layout)
+
+        self.set_serial_state(SerialState.NONE)
+
+
+    def set_serial_state(self, s: SerialState):
+        '''sets the serial state and updates the serial widget'''
+        # UI changes
+        self.serial_widget.setStyleSheet(f"QWidget#serial_widget {{ background-color: {s.value}; }}")
+        text = s.name
+        if self.serial.port != None:
+            text = str(self.serial.port) + " " + text
+        self.status_label.setText(text)
+
+        self.serial_state = s
+        self.app.update_controls()
+
+
+    def set_enabled(self, enabled: bool):
+        '''enables or disables the selection of channels'''
+        for check in self.checkboxes:
+            check.setEnabled(enabled)
+
+
+    def on_port_select(self, i: int):
+        '''called when the user selects a combobox item'''
+        new_port = self.ports_combobox.itemText(i).split(": ")[0]
+        if new_port == self.serial.port:
+            return
+        if any(dev.serial.port == new_port for dev in self.app.devices):
+            # a port can only be open by one device
+            self.ports_combobox.setCurrentIndex(self.ports_combobox.findText(str(self.serial.port), Qt.MatchStartsWith))
+            return
+
+        # refer to the state transitions
+        if self.app.state == AcquisitionState.RUNNING:
+            self.app.on_stop_acquisition()
+
+        # disconnect and change ports
+        self.set_serial_state(SerialState.DISCONNECTED)
+        self.close_serial()
+        self.serial.port = new_port
+        self.app.check_connection(force=True)
+
+
+    def check_connection(self, ports: list):
+        '''handles the connection of the device given the list of ports of the system'''
+        coms = [k[0] for k in ports]
+
+        if self.serial.port == None:
+            # if no port on the serial object, assign it the first one no other device is using
+            used = [dev.serial.port for dev in self.app.devices]
+            free = [com for com in coms if com not in used]
+            if free:
+                self.serial.port = free[0]
+                self.serial_state = SerialState.DISCONNECTED  # don't trigger UI changes
+
+        # whether the current port is present in the list of ports
+        found = self.serial.port in coms
+
+        if not self.ports_combobox.view().isVisible():
+            # if the combobox window is not being interacted with, update its values
+            self.ports_combobox.clear()
+            self.ports_combobox.addItems([k[0]+": "+k[1] for k in ports])
+            self.ports_combobox.setMinimumWidth(self.ports_combobox.view().sizeHintForColumn(0) + 20)
+            self.ports_combobox.setCurrentIndex(coms.index(self.serial.port) if found else 0)
+
+        # refer to the state transition in the declaration of SerialState
+        if not found and self.serial_state in [SerialState.OK, SerialState.ERROR, SerialState.CONNECTING]:
+            self.on_disconnect()
+            self.set_serial_state(SerialState.DISCONNECTED)
+        elif found and self.serial_state == SerialState.DISCONNECTED:
+            connect_state = self.on_connect()
+            self.set_serial_state(connect_state)
+
+
+    def on_connect(self) -> SerialState:
+        '''called on serial device connect, the reader thread opens the port and reports back'''
+        print("CONNECT", self.name)
+        # commands wait for the welcome message, which arrives once the arduino is done resetting
+        self.reader = SerialReader(self.serial, self.events, welcome=AcquisitionApp.start_msg)
+        self.reader.sinks = [self]
+        self.reader.start()
+        return SerialState.CONNECTING
+
+
+    def on_open(self) -> SerialState:
+        '''called once the reader thread opened the port'''
+        self.reader.refresh_settings()
+        # refer to the state transitions
+        if self.halted:
+            self.start(self.mode, self.app.interval_spinbox.value(), self.filter, self.app.auto_rate_checkbox.isChecked())
+            if self.app.recorder is not None:
+                self.app.recorder.new_line()
+            if self.app.state == AcquisitionState.HALTED:
+                self.app.set_acquisition_state(AcquisitionState.RUNNING)
+        return SerialState.OK
+
+
+    def on_disconnect(self):
+        '''called on serial device disconnect'''
+        print("DISCONNECT", self.name)
+        self.close_serial()
+
+        # refer to the state transitions
+        if self.running:
+            self.running = False
+            self.halted = True
+            if self.app.state == AcquisitionState.RUNNING and not any(dev.running for dev in self.app.devices):
+                self.app.set_acquisition_state(AcquisitionState.HALTED)
+
+
+    def close_serial(self):
+        '''stops the reader thread and closes the serial port'''
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+        self.serial.close()
+
+
+    def call(self, text: str, callback):
+        '''
+        sends a command to the arduino, and calls callback(response) from the GUI thread once its
+        Response arrives. if it fails, the response is an error message explaining why
+        '''
+        def done(future):
+            if future.exception() is not None:
+                response = Response(text, [f"ERROR: {future.exception()}"])
+            else:
+                response = future.result()
+            self.events.put(('call', time.time(), (callback, response)))
+        self.reader.submit(text).add_done_callback(done)
+
+
+    def start(self, mode: str, interval: int, filter: tuple, adaptive=False):
+        '''
+        starts polling or streaming the selected channels in new lines.
+        filter is the (type, alpha, on device) of the filter of the readings, applied either
+        by the arduino or by the reader thread, the other side leaves them as they are.
+        if adaptive, the interval and the samples of the readings are tuned to the fastest the
+        device sustains, instead of the interval given
+        '''
+        for chn in self.channels:
+            chn.new_line()
+        self.rate = RateController(self.reader, self.channel_mask(), mode, adaptive)
+        interval = self.rate.start(interval)
+        self.reader.sinks = [self, self.rate]
+        from filters import FilterChain     # imported in the background on startup
+        kind, alpha, on_device = filter
+        chain = FilterChain([(kind, alpha)])
+        self.call(format_command("filter", kind if on_device else "NONE", alpha), lambda r: r.ok or self.app.show_response(r))
+        self.reader.set_filter(chain if kind != "NONE" and not on_device else None)
+
+        # the error the arduino reports leaves out the filter when it's applied here
+        self.error_gain = 1 if on_device else chain.noise_gain()
+        self.request_error()
+        for chn in self.channels:
+            chn.stats.correlation = chain.correlation()
+        self.filter = filter
+        self.mode = mode
+        if mode != "poll":
+            self.reader.stream(self.channel_mask(), interval, binary=mode == "binary")
+        else:
+            self.reader.poll(self.channel_mask())
+        self.running = True
+        self.halted = False
+
+
+    def request_error(self):
+        '''asks for the theoretical error of the readings, which depends on the settings'''
+        def error(response):
+            if response.ok:
+                self.error = float(response.lines[0].split(' ')[1]) * self.error_gain
+        self.call("err()", error)
+
+
+    def stop(self):
+        '''stops the acquisition of the device'''
+        if self.reader is not None and self.running:
+            if self.mode != "poll":
+                self.reader.stream(0, 0)
+            else:
+                self.reader.poll(0)
+            self.reader.sinks = [self]
+        self.running = False
+        self.halted = False
+        self.rate = None
+        self.rate_label.setText("")
+
+
+    def write(self, times: np.ndarray, refs: list, values: np.ndarray):
+        '''passes the readings of the reader thread to the recorder, if any, in the columns of the device'''
+        recorder = self.recorder
+        if recorder is not None:
+            offset = self.index * Device.channel_count
+            recorder.write(times, [offset + j for j in refs], values)
+
+
+    def channel_mask(self) -> int:
+        '''bitmask of the selected channels (LSB is A0)'''
+        return sum(1 << i for i, checkbox in enumerate(self.checkboxes) if checkbox.isChecked())
+
+
+    def acquire_data(self):
+        '''handles the events sent by the reader thread, storing new readings in the channels'''
+        while True:
+            try:
+                kind, t, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == 'samples':
+                if not self.running:
+                    # late reading of a stopped acquisition
+                    continue
+                times, refs, values = payload
+                times = times - self.app.start_time
+                for k, j in enumerate(refs):
+                    self.channels[j].extend(times, values[:, k])
+                    self.app.spectrum.feed(self.channels[j].name, times, values[:, k])
+                self.app.last_time = max(self.app.last_time, times[-1])
+
+            elif kind == 'call':
+                # response to a command sent with `call`
+                callback, response = payload
+                QTimer.singleShot(0, lambda c=callback, r=response: c(r))
+
+            elif kind == 'line':
+                response = Response(self.name, [payload])
+                if response.status is not None:
+                    # status message nobody asked for, such as the welcome message
+                    QTimer.singleShot(0, lambda r=response: self.app.show_response(r))
+                else:
+                    print(self.name, payload)
+
+            elif kind == 'settings':
+                # the copy of the settings of the arduino changed
+                self.true_voltage = float(payload.get("TRUE_VOLTAGE", self.true_voltage))
+                self.app.scale_voltage()
+
+            elif kind == 'open':
+                if self.serial_state == SerialState.CONNECTING:
+                    self.set_serial_state(self.on_open())
+
+            elif kind == 'error':
+                # the port failed, reconnect if it is still present
+                print("SERIAL ERROR:", self.name, payload)
+                if self.serial_state == SerialState.CONNECTING:
+                    # it couldn't be opened
+                    self.close_serial()
+                    self.set_serial_state(SerialState.ERROR)
+                elif self.serial_state == SerialState.OK:
+                    self.on_disconnect()
+                    self.set_serial_state(SerialState.DISCONNECTED)
+                    self.app.check_connection(force=True)
+
 
 
 class AcquisitionApp(QWidget):
@@ -86,13 +476,51 @@ class AcquisitionApp(QWidget):
     # how much time in seconds of data to display at any moment
     time_range = 50
 
+    # how many times per second the graph is redrawn, regardless of how fast readings arrive
+    fps = 30
+
+    # acquisition modes: request each reading with `analog`, or let the arduino broadcast them,
+    # as text or as binary frames
+    modes = ["poll", "stream", "binary"]
+
+    # default time between broadcast readings in stream mode, in ms
+    interval_default = 100
+
+    # default smoothing factor of the filters, from 0 (frozen) to 1 (no smoothing)
+    alpha_default = 0.2
+
+    # formats in which acquisitions can be recorded to a file as they happen
+    record_formats = ["off"] + Recorder.formats
+
+    # steps per second of the replay slider
+    replay_resolution = 10
+
+    # how many times per second the statistics panel is updated
+    stats_rate = 2
+
+    # statistics of each channel in the panel, and the keys of RunningStats.summary they show
+    stats_columns = ["Mean", "RMS", "Min", "Max", "Std", "Noise", "err()"]
+    stats_keys = ["mean", "rms", "min", "max", "std", "noise"]
+
+    # how many times per second the spectrum view is redrawn
+    spectrum_rate = 5
+
+    # noise above this many times the theoretical error is shown in red, the ADC alone doesn't explain it
+    noise_warning = 2
+
     # which analog channel checkboxes should be checked on startup
     checkboxes_default = [True, True, True, True, True, True]
 
+    # ports not found by the system that should be listed anyway, such as a simulated arduino
+    extra_ports = []
+
+    # how many arduinos are acquired from on startup
+    devices_default = 1
+
     # whether the program should expect a start message from the arduino
     start_msg = True
 
-    # QMessageBox icons associated to each possible arduino status message 
+    # QMessageBox icons associated to each possible arduino status message
     statuses = {
         "ERROR": QMessageBox.Critical,
         "WARN": QMessageBox.Warning,
@@ -103,41 +531,74 @@ class AcquisitionApp(QWidget):
         super().__init__()
         self.app = app
         self.state = AcquisitionState.CLEARED
-        self.serial_state = SerialState.NONE
+        self.devices = []
 
         # main vertical layout
         self.layout = QVBoxLayout()
 
-        # horizontal layout with serial information
-        self.serial_widget = QWidget()
-        self.serial_widget.setObjectName("serial_widget")
-        self.serial_layout = QHBoxLayout()
-        self.serial_layout.addWidget(QLabel("Serial Port:"))
-        self.ports_combobox = QComboBox()
-        self.ports_combobox.activated.connect(self.on_port_select)
-        self.serial_layout.addWidget(self.ports_combobox)
-        self.serial_layout.addStretch(1)
-        self.status_label = QLabel()
-        self.serial_layout.addWidget(self.status_label)
-        self.serial_widget.setLayout(self.serial_layout)
-        self.layout.addWidget(self.serial_widget)
+        # one serial information and channel checkboxes section per device
+        self.devices_layout = QVBoxLayout()
+        self.layout.addLayout(self.devices_layout)
 
-        # spacer between horizontal layout and the rest of the window
+        # spacer between the devices and the rest of the window
         self.layout.addItem(QSpacerItem(100,50,QSizePolicy.Expanding,QSizePolicy.Minimum))
 
-        # horizontal layout for the analog channel checkboxes
-        self.button_layout = QHBoxLayout()
-        self.checkboxes = []
-        colors = []
-        for i in range(6):
-            colors.append(pg.intColor(i, 6))
-            h, _, v, _ = colors[-1].getHsv()
-            checkbox = QCheckBox(f"A{i}")
-            checkbox.setStyleSheet(f"QCheckBox {{ background-color : {QColor.fromHsv(h, 128, v).name()}; }}")
-            checkbox.setChecked(AcquisitionApp.checkboxes_default[i])
-            self.button_layout.addWidget(checkbox)
-            self.checkboxes.append(checkbox)
-        self.layout.addLayout(self.button_layout)
+        # horizontal layout for the acquisition mode and broadcast interval
+        self.mode_layout = QHBoxLayout()
+        self.mode_layout.addWidget(QLabel("Mode:"))
+        self.mode_combobox = QComboBox()
+        self.mode_combobox.addItems([m.title() for m in AcquisitionApp.modes])
+        self.mode_layout.addWidget(self.mode_combobox)
+        self.mode_layout.addWidget(QLabel("Interval (ms):"))
+        self.interval_spinbox = QSpinBox()
+        self.interval_spinbox.setRange(0, 60000)
+        self.interval_spinbox.setValue(AcquisitionApp.interval_default)
+        self.mode_layout.addWidget(self.interval_spinbox)
+        # tunes the interval and the samples of each device to the fastest rate it sustains
+        self.auto_rate_checkbox = QCheckBox("Auto rate")
+        self.mode_layout.addWidget(self.auto_rate_checkbox)
+        self.mode_combobox.currentIndexChanged.connect(self.update_interval_enabled)
+        self.auto_rate_checkbox.toggled.connect(self.update_interval_enabled)
+        self.update_interval_enabled()
+        self.mode_layout.addWidget(QLabel("Devices:"))
+        self.add_device_button = QPushButton("+")
+        self.add_device_button.clicked.connect(self.add_device)
+        self.mode_layout.addWidget(self.add_device_button)
+        self.remove_device_button = QPushButton("-")
+        self.remove_device_button.clicked.connect(self.remove_device)
+        self.mode_layout.addWidget(self.remove_device_button)
+        self.mode_layout.addStretch(1)
+        self.mode_layout.addWidget(QLabel("Record:"))
+        self.record_combobox = QComboBox()
+        self.record_combobox.addItems(AcquisitionApp.record_formats)
+        self.mode_layout.addWidget(self.record_combobox)
+        self.open_button = QPushButton("Open...")
+        self.open_button.clicked.connect(self.on_open_recording)
+        self.mode_layout.addWidget(self.open_button)
+        self.layout.addLayout(self.mode_layout)
+
+        # horizontal layout for the filter of the readings
+        self.filter_layout = QHBoxLayout()
+        self.filter_layout.addWidget(QLabel("Filter:"))
+        self.filter_combobox = QComboBox()
+        self.filter_combobox.addItems(FILTERS)
+        self.filter_layout.addWidget(self.filter_combobox)
+        self.filter_layout.addWidget(QLabel("Alpha:"))
+        self.alpha_spinbox = QDoubleSpinBox()
+        self.alpha_spinbox.setRange(0.01, 1)
+        self.alpha_spinbox.setSingleStep(0.05)
+        self.alpha_spinbox.setValue(AcquisitionApp.alpha_default)
+        self.filter_layout.addWidget(self.alpha_spinbox)
+        self.device_filter_checkbox = QCheckBox("On device")
+        self.device_filter_checkbox.setChecked(True)
+        self.filter_layout.addWidget(self.device_filter_checkbox)
+        self.filter_layout.addStretch(1)
+        self.stats_checkbox = QCheckBox("Statistics")
+        self.stats_checkbox.setChecked(True)
+        self.filter_layout.addWidget(self.stats_checkbox)
+        self.spectrum_checkbox = QCheckBox("Spectrum")
+        self.filter_layout.addWidget(self.spectrum_checkbox)
+        self.layout.addLayout(self.filter_layout)
 
         # vertically stacked wide Start/Stop/Clear buttons
         for command in ["start", "stop", "clear"]:
@@ -154,30 +615,78 @@ class AcquisitionApp(QWidget):
         self.graph.setLabel('bottom', 'Elapsed time (s)')
         self.graph.setYRange(0, 5.2, padding=0)
         self.graph.setXRange(0, AcquisitionApp.time_range, padding=0)
-        self.layout.addWidget(self.graph)
 
-        # text field at the bottom to send custom commands
+        # statistics of the readings of each channel in the time range, beside the graph
+        self.stats_table = QTableWidget(0, len(AcquisitionApp.stats_columns))
+        self.stats_table.setHorizontalHeaderLabels([c + " (V)" for c in AcquisitionApp.stats_columns])
+        self.stats_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.stats_table.horizontalHeader().setDefaultSectionSize(70)
+        self.stats_checkbox.toggled.connect(self.stats_table.setVisible)
+        self.graph_layout = QHBoxLayout()
+        self.graph_layout.addWidget(self.graph, 1)
+        self.graph_layout.addWidget(self.stats_table)
+        self.layout.addLayout(self.graph_layout)
+
+        # power spectral density of the acquired channels, computed in the background
+        self.spectrum_graph = pg.PlotWidget()
+        self.spectrum_graph.getPlotItem().hideButtons()
+        self.spectrum_graph.setLogMode(x=False, y=True)
+        self.spectrum_graph.setLabel('left', 'PSD (V²/Hz)')
+        self.spectrum_graph.setLabel('bottom', 'Frequency (Hz)')
+        self.spectrum_graph.hide()
+        self.spectrum_checkbox.toggled.connect(self.spectrum_graph.setVisible)
+        self.layout.addWidget(self.spectrum_graph)
+        self.spectrum_lines = {}    # channel name -> line of its spectrum
+        self.spectrum = SpectrumWorker(AcquisitionApp.spectrum_rate)
+        self.spectrum.start()
+
+        # replay controls, only shown while a recording is open
+        self.replay_widget = QWidget()
+        self.replay_layout = QHBoxLayout()
+        self.replay_layout.setContentsMargins(0, 0, 0, 0)
+        self.play_button = QPushButton("Play")
+        self.play_button.setCheckable(True)
+        self.replay_layout.addWidget(self.play_button)
+        self.replay_slider = QSlider(Qt.Horizontal)
+        self.replay_slider.valueChanged.connect(lambda v: self.replay_to(v / AcquisitionApp.replay_resolution))
+        self.replay_layout.addWidget(self.replay_slider)
+        self.replay_label = QLabel()
+        self.replay_layout.addWidget(self.replay_label)
+        self.replay_widget.setLayout(self.replay_layout)
+        self.replay_widget.hide()
+        self.layout.addWidget(self.replay_widget)
+        self.session = None
+
+        # text field at the bottom to send custom commands, to the device selected beside it
+        self.command_layout = QHBoxLayout()
+        self.target_combobox = QComboBox()
+        self.command_layout.addWidget(self.target_combobox)
         self.line_edit = QLineEdit()
         self.line_edit.setPlaceholderText("Run command")
         self.line_edit.returnPressed.connect(self.message)
-        self.layout.addWidget(self.line_edit)
+        self.command_layout.addWidget(self.line_edit)
+        self.layout.addLayout(self.command_layout)
 
         self.setLayout(self.layout)
 
-
-        # create analog channel objects
-        self.channels = []
-        for col in colors:
-            self.channels.append(Channel(self.graph, col))
-
         # acquisition state
         self.set_acquisition_state(AcquisitionState.CLEARED)
+        self.start_time = time.time()
+        self.last_time = 0      # time of the latest reading
+        self.recorder = None    # writes the readings to a file, None if not recording
 
-        # serial state and initialization
-        self.serial = serial.Serial(None, 38400, timeout=1)
-        self.set_serial_state(SerialState.NONE)
+        # devices and serial initialization. the ports are listed in the background, so the window
+        # shows right away, and only listed again when the watcher reports one was plugged or unplugged
         self.ports_list = []
-        self.check_connection()
+        self.port_events = queue.Queue()
+        for _ in range(AcquisitionApp.devices_default):
+            self.add_device()
+        self.list_ports()
+        self.port_watcher = PortWatcher(self.port_events)
+        self.port_watcher.start()
+
+        # scipy takes longer to import than everything else together, and is only needed to filter
+        threading.Thread(target=lambda: __import__("filters"), daemon=True).start()
 
         # setup periodic function callbacks
         def setTimeout(func, interval, start=False):
@@ -187,171 +696,142 @@ class AcquisitionApp(QWidget):
             if start:
                 timer.start()
             setattr(self, func.__name__+"_timer", timer)
-        setTimeout(self.acquire_data, 100)
-        setTimeout(self.check_connection, 500, start=True)
-        setTimeout(self.get_true_voltage, 10000, start=True)
+        setTimeout(self.acquire_data, 20, start=True)
+        setTimeout(self.render, 1000 // AcquisitionApp.fps, start=True)
+        setTimeout(self.replay_step, 1000 // AcquisitionApp.fps)
+        self.play_button.toggled.connect(lambda on: self.replay_step_timer.start() if on else self.replay_step_timer.stop())
+        setTimeout(self.refresh_settings, 10000, start=True)
+        setTimeout(self.update_stats, 1000 // AcquisitionApp.stats_rate, start=True)
+        setTimeout(self.update_spectrum, 1000 // AcquisitionApp.spectrum_rate, start=True)
+        setTimeout(self.update_rates, RateController.period * 1000, start=True)
+
+
+    @property
+    def channels(self) -> list:
+        '''channels of every device, in order'''
+        return [chn for dev in self.devices for chn in dev.channels]
 
 
     def set_acquisition_state(self, s: AcquisitionState):
         '''sets the acquisition state and updates the window title'''
         # UI changes
         self.setWindowTitle(f"Acquisition App ({s.name})")
-        for check in self.checkboxes:
-            check.setEnabled(s != AcquisitionState.RUNNING)
+        for dev in self.devices:
+            dev.set_enabled(s != AcquisitionState.RUNNING)
+        self.mode_combobox.setEnabled(s != AcquisitionState.RUNNING)
+        self.auto_rate_checkbox.setEnabled(s != AcquisitionState.RUNNING)
+        for widget in [self.filter_combobox, self.alpha_spinbox, self.device_filter_checkbox]:
+            widget.setEnabled(s != AcquisitionState.RUNNING)
+        self.record_combobox.setEnabled(s == AcquisitionState.CLEARED)
+        self.add_device_button.setEnabled(s == AcquisitionState.CLEARED)
+        self.remove_device_button.setEnabled(s == AcquisitionState.CLEARED and len(self.devices) > 1)
+        self.open_button.setEnabled(s != AcquisitionState.RUNNING)
         self.stop_button.setEnabled(s in [AcquisitionState.RUNNING, AcquisitionState.HALTED])
-        self.start_button.setEnabled(self.serial_state == SerialState.OK and s != AcquisitionState.RUNNING)
-        self.clear_button.setEnabled(s in [AcquisitionState.STOPPED, AcquisitionState.HALTED])
+        self.clear_button.setEnabled(s in [AcquisitionState.STOPPED, AcquisitionState.HALTED, AcquisitionState.REPLAY])
 
         self.state = s
+        self.update_controls()
 
 
-    def set_serial_state(self, s: SerialState):
-        '''sets the serial state and updates the serial widget'''
-        # UI changes
-        self.serial_widget.setStyleSheet(f"QWidget#serial_widget {{ background-color: {s.value}; }}")
-        text = s.name
-        if self.serial.port != None:
-            text = str(self.serial.port) + " " + text
-        self.status_label.setText(text)
-        self.line_edit.setEnabled(s == SerialState.OK)
-        self.start_button.setEnabled(s == SerialState.OK and self.state != AcquisitionState.RUNNING)
-        
-        self.serial_state = s
+    def update_controls(self):
+        '''enables the controls that depend on the serial state of the devices'''
+        connected = any(dev.serial_state == SerialState.OK for dev in self.devices)
+        self.start_button.setEnabled(connected and self.state not in [AcquisitionState.RUNNING, AcquisitionState.REPLAY])
+        self.line_edit.setEnabled(connected)
 
 
-    def on_port_select(self, i: int):
-        '''called when the user selects a combobox item'''
-        new_port = self.ports_combobox.itemText(i).split(": ")[0]
-        if new_port == self.serial.port:
+    def add_device(self):
+        '''adds the section of a new device to the window, and connects it to a free port if there's any'''
+        dev = Device(self, len(self.devices))
+        self.devices.append(dev)
+        self.devices_layout.addWidget(dev.widget)
+        self.target_combobox.addItem(dev.name)
+        self.set_acquisition_state(self.state)
+        self.check_connection(force=True)
+
+
+    def remove_device(self):
+        '''removes the last device, closing its port'''
+        if len(self.devices) <= 1:
             return
+        dev = self.devices.pop()
+        dev.close_serial()
+        for chn in dev.channels:
+            chn.clear()
+            if chn.name in self.spectrum_lines:
+                self.spectrum_graph.removeItem(self.spectrum_lines.pop(chn.name))
+        dev.widget.deleteLater()
+        self.target_combobox.removeItem(len(self.devices))
+        self.set_acquisition_state(self.state)
 
-        # refer to the state transitions
-        if self.state == AcquisitionState.RUNNING:
-            self.on_stop_acquisition()
 
-        # disconnect and change ports
-        self.set_serial_state(SerialState.DISCONNECTED)
-        self.serial.close()
-        self.serial.port = new_port
-        self.check_connection(force=True)
+    def list_ports(self):
+        '''lists the serial ports in a background thread, the list is handled by `acquire_data`'''
+        def run():
+            ports = serial.tools.list_ports.comports()
+            ports += [(port, "given port", "") for port in AcquisitionApp.extra_ports]
+            self.port_events.put(("list", ports))
+        threading.Thread(target=run, daemon=True).start()
 
 
-    def check_connection(self, force=False):
+    def check_connection(self, ports=None, force=False):
         '''
-        handles the serial port connection (possible disconnections or device changes).
-        does nothing if the serial port list stays the same, unless if forced.
+        handles the serial port connections (possible disconnections or device changes),
+        given the list of ports, or the last one if None.
+        does nothing if a new list is the same as the last, unless if forced.
         '''
-        ports = serial.tools.list_ports.comports()
-        if self.ports_list == ports and not force:
+        if ports is None:
+            ports = self.ports_list
+        elif self.ports_list == ports and not force:
             # nothing new
             return
         self.ports_list = ports
-        coms = [k[0] for k in ports]
-
-        if self.serial.port == None and coms:
-            # if no port on the serial object and ports available, assign it the first one
-            self.serial.port = coms[0]
-            self.serial_state = SerialState.DISCONNECTED  # don't trigger UI changes
-
-        # whether the current port is present in the list of ports
-        found = self.serial.port in coms
-        
-        if not self.ports_combobox.view().isVisible():
-            # if the combobox window is not being interacted with, update its values
-            self.ports_combobox.clear()
-            self.ports_combobox.addItems([k[0]+": "+k[1] for k in ports])
-            self.ports_combobox.setMinimumWidth(self.ports_combobox.view().sizeHintForColumn(0) + 20)
-            self.ports_combobox.setCurrentIndex(coms.index(self.serial.port) if found else 0) 
-
-        # refer to the state transition in the declaration of SerialState
-        if not found and self.serial_state in [SerialState.OK, SerialState.ERROR]:
-            self.on_disconnect()
-            self.set_serial_state(SerialState.DISCONNECTED)
-        elif found and self.serial_state == SerialState.DISCONNECTED:
-            connect_state = self.on_connect()
-            self.set_serial_state(connect_state)                
-        
-
-    def on_connect(self) -> SerialState:
-        '''called on serial device connect'''
-        print("CONNECT")
-        try:
-            self.serial.open()
-        except:
-            return SerialState.ERROR
-        
-        # read welcome message
-        if AcquisitionApp.start_msg:
-            self.message(force=True)
-        
-        # refer to the state transitions
-        if self.state == AcquisitionState.HALTED:
-            self.on_start_acquisition()
-        return SerialState.OK
-
-
-    def on_disconnect(self):
-        '''called on serial device disconnect'''
-        print("DISCONNECT")
-        self.serial.close()
+        for dev in self.devices:
+            dev.check_connection(ports)
 
-        # refer to the state transitions
-        if self.state == AcquisitionState.RUNNING:
-            self.on_stop_acquisition()
-            self.set_acquisition_state(AcquisitionState.HALTED)
 
+    def refresh_settings(self):
+        '''
+        brings the copy of the settings of the arduinos up to date, which only takes fetching
+        them if they changed. the y axis is scaled when a new maximum voltage arrives
+        '''
+        for dev in self.devices:
+            if dev.reader is not None:
+                dev.reader.refresh_settings()
 
-    def get_true_voltage(self):
-        '''scales the y axis according to the maximum voltage reported by the arduino'''
-        if not self.serial.is_open:
-            # can't send the command
-            return
-        
-        # send specific command to get the true voltage
-        self.serial.write(b"defget(TRUE_VOLTAGE)\n")
-        time.sleep(0.1)
 
-        if self.serial.in_waiting > 0:
-            # if there's a response, update the y axis to reflect the new maximum voltage
-            data = self.serial.readline().decode().rstrip()
-            volt = float(data.split(' ')[1])
-            self.graph.setYRange(0, volt*1.04, padding=0)
+    def scale_voltage(self):
+        '''updates the y axis to reflect the highest maximum voltage'''
+        volt = max(d.true_voltage for d in self.devices)
+        self.graph.setYRange(0, volt*1.04, padding=0)
 
 
-    def message(self, force=False):
-        '''
-        sends the text of the command text field as a command to the arduino.
-        sends nothing if there's no text on the text field, unless if forced.
-        '''
+    def message(self):
+        '''sends the text of the command text field as a command to the selected arduino, if there's any'''
         text = self.line_edit.text()
-        if not text and not force:
+        dev = self.devices[self.target_combobox.currentIndex()]
+        if not text or dev.reader is None:
             # nothing to send
             return
-        text += "\n"
         self.line_edit.clear()
+        dev.call(text, self.show_response)
 
-        # send given command
-        self.serial.write(text.encode("ascii"))
-        time.sleep(2 if force else 0.5)
 
-        lines = []
-        while self.serial.in_waiting > 0:
-            # while there's a response, store each line
-            data = self.serial.readline().decode().rstrip()
-            lines.append(data)
+    def show_response(self, response: Response):
+        '''shows the response to a command in a popup window'''
+        lines = response.lines or [""]
 
         # open a popup window
         msg = QMessageBox()
-        status = next((k for k in AcquisitionApp.statuses if lines[0].startswith(k+": ")), None)
-        if len(lines) == 1 and status != None:
+        if response.status is not None:
             # if it's a status message, set the appropriate status icon
-            msg.setWindowTitle(status)
-            msg.setIcon(AcquisitionApp.statuses[status])
-            msg.setText(lines[0].split(": ")[1])
+            msg.setWindowTitle(response.status)
+            msg.setIcon(AcquisitionApp.statuses[response.status])
+            msg.setText(response.message)
         else:
             # write the original command in bold and the response below
             msg.setWindowTitle("RESULT")
-            msg.setText("<b>"+text+"</b><br><br>"+'<br>'.join([l.replace('\t','&nbsp;'*4) for l in lines]))
+            msg.setText("<b>"+response.command+"</b><br><br>"+'<br>'.join([l.replace('\t','&nbsp;'*4) for l in lines]))
         msg.exec_()
 
 
@@ -360,76 +840,231 @@ class AcquisitionApp(QWidget):
         # clear everything and update x range
         for chn in self.channels:
             chn.clear()
+        self.last_time = 0
+        if self.recorder is not None:
+            for dev in self.devices:
+                dev.recorder = None
+            self.recorder.close()
+            self.recorder = None
+        self.session = None
+        self.play_button.setChecked(False)
+        self.replay_widget.hide()
         self.graph.clear()
+        self.spectrum.reset()
+        self.spectrum_graph.clear()
+        self.spectrum_lines.clear()
         self.graph.setXRange(0, AcquisitionApp.time_range, padding=0)
         self.app.processEvents()
-        
+
         self.set_acquisition_state(AcquisitionState.CLEARED)
 
 
     def on_start_acquisition(self):
-        '''starts or restarts the data acquisition'''
-        if not self.channels[0].lines:
-            # if there's no previous data set the start time to now 
+        '''starts or restarts the data acquisition of every connected device'''
+        connected = [dev for dev in self.devices if dev.serial_state == SerialState.OK]
+        if not any(chn.lines for chn in self.channels):
+            # if there's no previous data set the start time to now, the same for every device
             self.start_time = time.time()
 
-        # create new separate lines for each channel
-        for chn in self.channels:
-            chn.new_line()
-            
-        # starts the periodic calls to the data acquisition method
-        self.acquire_data_timer.start()
+            # and start a new recording if asked to
+            fmt = AcquisitionApp.record_formats[self.record_combobox.currentIndex()]
+            if fmt != "off":
+                path = time.strftime(f"acquisition_%Y%m%d_%H%M%S.{fmt}")
+                names = [chn.name for chn in self.channels]
+                self.recorder = Recorder(path, fmt, names, connected[0].reader.true_voltage, self.start_time)
+                self.recorder.start()
+                for dev in self.devices:
+                    dev.recorder = self.recorder
+                print("RECORDING", path)
+
+        if self.recorder is not None:
+            self.recorder.new_line()
+
+        # start polling or streaming the selected channels of each device, with new separate lines
+        mode = AcquisitionApp.modes[self.mode_combobox.currentIndex()]
+        filter = (FILTERS[self.filter_combobox.currentIndex()], self.alpha_spinbox.value(), self.device_filter_checkbox.isChecked())
+        for dev in connected:
+            dev.start(mode, self.interval_spinbox.value(), filter, self.auto_rate_checkbox.isChecked())
         self.set_acquisition_state(AcquisitionState.RUNNING)
-        
+
 
     def on_stop_acquisition(self):
         '''stops the data acquisition'''
-        self.acquire_data_timer.stop()
+        for dev in self.devices:
+            dev.stop()
         self.set_acquisition_state(AcquisitionState.STOPPED)
 
 
-    def acquire_data(self):
-        '''reads data and updates the lines'''
-        # prepare the command based on selected checkboxes
-        command = ''
-        refs = []
-        for checkbox in self.checkboxes:
-            if checkbox.isChecked():
-                refs.append(len(command))
-                command += "1"
-            else:
-                command += "0"
-        command = command[::-1]
-
+    def on_open_recording(self):
+        '''opens a binary recording to replay it'''
+        path, _ = QFileDialog.getOpenFileName(self, "Open recording", "", "Recordings (*.bin)")
+        if not path:
+            return
         try:
-            # send the command
-            self.serial.write(f'analog(0b{command})\n'.encode())
-            time.sleep(0.1)
+            session = Session(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "ERROR", f"Can't open the recording: {e}")
+            return
 
-            if self.serial.in_waiting > 0:
-                # if there's a response, parse it and update the graph
-                data = self.serial.readline().decode().strip()
-                values = [float(v) for v in data.split(',')[:-1]]
-                values.reverse()
+        # replace any data on the graph by the recording, with enough devices for its channels
+        self.on_clear_acquisition()
+        while len(self.channels) < len(session.names):
+            self.add_device()
+        self.session = session
+        self.graph.setYRange(0, session.true_voltage*1.04, padding=0)
+        self.replay_slider.setRange(0, int(session.duration * AcquisitionApp.replay_resolution))
+        self.replay_widget.show()
+        self.set_acquisition_state(AcquisitionState.REPLAY)
+        self.replay_slider.setValue(self.replay_slider.maximum())
+        self.replay_to(self.replay_slider.value() / AcquisitionApp.replay_resolution)
+
+
+    def replay_to(self, t: float):
+        '''shows the time range of the recording that ends at time t'''
+        if self.session is None:
+            return
+        self.replay_time = t
+        self.replay_label.setText(f"{t:.1f} / {self.session.duration:.1f} s")
+
+        # only the records in the time range are read from the file
+        t_min = max(t, AcquisitionApp.time_range) - AcquisitionApp.time_range
+        start, stop = self.session.seek(t_min), self.session.seek(t)
+        channels = self.channels
+        for chn in channels:
+            chn.clear()
+        self.graph.clear()
+        self.spectrum.reset()
+        for a, b in self.session.lines(start, stop):
+            records = self.session.records[a:b]
+            for j, chn in enumerate(channels[:len(self.session.names)]):
+                chn.new_line()
+                v = records['v'][:, j]
+                acquired = ~np.isnan(v)
+                if acquired.any():
+                    chn.extend(records['t'][acquired], v[acquired])
+                    self.spectrum.feed(chn.name, records['t'][acquired], v[acquired])
+        self.last_time = t
+
+
+    def replay_step(self):
+        '''advances the replay by one frame in real time'''
+        t = self.replay_time + 1 / AcquisitionApp.fps
+        if t >= self.session.duration:
+            t = self.session.duration
+            self.play_button.setChecked(False)
+        self.replay_slider.blockSignals(True)
+        self.replay_slider.setValue(int(t * AcquisitionApp.replay_resolution))
+        self.replay_slider.blockSignals(False)
+        self.replay_to(t)
+
+
+    def closeEvent(self, event):
+        '''finishes the recording, if any, when the window is closed'''
+        if self.recorder is not None:
+            self.recorder.close()
+        self.port_watcher.stop()
+        self.spectrum.stop()
+        super().closeEvent(event)
+
+
+    def render(self):
+        '''redraws the channels that got new readings since the last frame'''
+        # only the readings in the time range are plotted, with detail limited by the graph width
+        x_max = max(self.last_time, AcquisitionApp.time_range)
+        x_min = x_max - AcquisitionApp.time_range
+        pixels = max(int(self.graph.getPlotItem().getViewBox().width()), 1)
+        dirty = [chn for chn in self.channels if chn.dirty]
+        for chn in dirty:
+            chn.update(x_min, x_max, pixels)
+        if dirty and self.last_time > AcquisitionApp.time_range:
+            # if time exceeds the time range set a new x range
+            self.graph.setXRange(x_min, x_max, padding=0)
+
+
+    def update_stats(self):
+        '''shows the statistics of every channel in the panel, and how far the noise is from the theoretical error'''
+        if not self.stats_table.isVisible():
+            return
+        channels = self.channels
+        if self.stats_table.rowCount() != len(channels):
+            self.stats_table.setRowCount(len(channels))
+            self.stats_table.setVerticalHeaderLabels([chn.name for chn in channels])
+
+        devices = [dev for dev in self.devices for _ in dev.channels]
+        for row, (chn, dev) in enumerate(zip(channels, devices)):
+            summary = chn.stats.summary()
+            values = [summary[key] if summary else np.nan for key in AcquisitionApp.stats_keys]
+            values.append(dev.error if dev.error is not None and summary else np.nan)
+            for col, value in enumerate(values):
+                item = self.stats_table.item(row, col)
+                if item is None:
+                    item = QTableWidgetItem()
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    self.stats_table.setItem(row, col, item)
+                item.setText("" if np.isnan(value) else f"{value:.5g}")
+
+            noise = self.stats_table.item(row, AcquisitionApp.stats_keys.index("noise"))
+            high = summary is not None and dev.error is not None and summary["noise"] > AcquisitionApp.noise_warning * dev.error
+            noise.setForeground(QColor('#e60e0e' if high else 'black'))
+
+
+    def update_interval_enabled(self):
+        '''the interval is only set by hand when broadcasting without the automatic rate'''
+        mode = AcquisitionApp.modes[self.mode_combobox.currentIndex()]
+        self.interval_spinbox.setEnabled(mode != "poll" and not self.auto_rate_checkbox.isChecked())
+
+
+    def update_rates(self):
+        '''shows the rate of the readings of every device, and tunes it if it's automatic'''
+        for dev in self.devices:
+            if dev.rate is not None and dev.running:
+                if dev.rate.update():
+                    # the samples changed, and the error with them
+                    dev.request_error()
+                dev.rate_label.setText(dev.rate.describe())
+
+
+    def update_spectrum(self):
+        '''draws the latest spectra computed by the spectrum worker'''
+        if not self.spectrum_graph.isVisible():
+            return
+        channels = {chn.name: chn for chn in self.channels}
+        for name, (freqs, psd) in self.spectrum.latest().items():
+            if name not in channels:
+                continue
+            if name not in self.spectrum_lines:
+                self.spectrum_lines[name] = self.spectrum_graph.plot(pen=channels[name].color, name=name)
+            # the constant component was removed, and the log scale can't show zeros
+            self.spectrum_lines[name].setData(freqs[1:], np.maximum(psd[1:], 1e-20))
 
-                # update only the channels sent in the command
-                for i, j in enumerate(refs):
-                    t = time.time() - self.start_time
-                    self.channels[j] += (t, values[i])
-                    if t > AcquisitionApp.time_range:
-                        # if time exceeds the time range set a new x range
-                        self.graph.setXRange(t-AcquisitionApp.time_range, t, padding=0)
 
-                self.app.processEvents()
-        except:
-            # possible state transition to SerialState.ERROR ???
-            pass
+    def acquire_data(self):
+        '''handles the events sent by the port watcher and the reader threads of every device'''
+        changed = False
+        while True:
+            try:
+                action, arg = self.port_events.get_nowait()
+            except queue.Empty:
+                break
+            if action == "list":
+                self.check_connection(arg)
+            else:
+                print("PORT", action.upper(), arg)
+                changed = True
+        if changed:
+            # a burst of events only lists the ports once
+            self.list_ports()
+
+        for dev in self.devices:
+            dev.acquire_data()
 
 
 
 if __name__ == "__main__":
-    # main loop
+    # main loop, with a device for each port given in the arguments
     app = QApplication(sys.argv)
+    AcquisitionApp.extra_ports = sys.argv[1:]
+    AcquisitionApp.devices_default = max(len(AcquisitionApp.extra_ports), 1)
     window = AcquisitionApp(app)
     window.show()
     sys.exit(app.exec_())